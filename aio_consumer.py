@@ -0,0 +1,401 @@
+import asyncio
+import logging
+import functools
+import pika
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Iterable, Optional
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.exceptions import AMQPError, AMQPConnectionError, AMQPChannelError
+from rabbit import backoff_delay
+from config import (
+    RABBITMQ_HOST,
+    RABBITMQ_USER,
+    RABBITMQ_PASSWORD,
+    RABBITMQ_HEARTBEAT,
+    ASYNC_CONCURRENCY,
+)
+
+
+class Delivery:
+    """Message reçu, acquittable une seule fois."""
+
+    def __init__(self, channel, method, properties, body: bytes) -> None:
+        """Conserve le message et le canal sur lequel il a été reçu.
+
+        :param channel: canal pika (asyncio) de consommation
+        :param method: meta-données de livraison
+        :param properties: propriétés AMQP
+        :param bytes body: corps du message
+        :return: ``None``
+        :rtype: None
+        """
+        self.channel = channel
+        self.method = method
+        self.properties = properties
+        self.body = body
+        self.settled = False
+
+    def ack(self) -> None:
+        """Acquitte le message s'il ne l'a pas déjà été.
+
+        :return: ``None``
+        :rtype: None
+        """
+        if not self.settled:
+            self.settled = True
+            # Après une coupure, le message sera relivré sur un autre canal
+            if self.channel.is_open:
+                self.channel.basic_ack(delivery_tag=self.method.delivery_tag)
+
+    def nack(self, requeue: bool = True) -> None:
+        """Rejette le message s'il n'a pas déjà été acquitté.
+
+        :param bool requeue: remet le message dans la file
+        :return: ``None``
+        :rtype: None
+        """
+        if not self.settled:
+            self.settled = True
+            if self.channel.is_open:
+                self.channel.basic_nack(
+                    delivery_tag=self.method.delivery_tag, requeue=requeue
+                )
+
+
+Handler = Callable[["AsyncConsumer", list[Delivery]], Awaitable[None]]
+
+# Erreurs temporaires (réseau, broker) : le message est remis en file. Toute
+# autre erreur désigne un message invalide, rejeté sans remise en file.
+TRANSIENT_ERRORS = (AMQPError, OSError)
+
+
+class AsyncConsumer:
+    """Consumer asyncio commun à toutes les étapes du pipeline.
+
+    La boucle asyncio ne fait que de l'AMQP (via l'adaptateur asyncio de
+    pika) : les heartbeats sont toujours servis et le travail bloquant est
+    confié à un pool de threads via ``run_blocking``. ``concurrency`` tâches
+    traitent les messages en parallèle au sein d'un ``TaskGroup`` ; chacune
+    reçoit des lots de jusqu'à ``batch_size`` messages (ou ``batch_bytes``
+    octets), complétés pendant au plus ``batch_timeout`` secondes. Un lot
+    est acquitté quand le handler se termine sans erreur ; le handler peut
+    aussi acquitter lui-même chaque message. Si le handler échoue sur une
+    erreur de ``transient``, les messages restants sont remis en file ;
+    sinon ils sont retraités un par un pour isoler le message invalide, qui
+    est rejeté sans remise en file au lieu de bloquer tout le lot.
+    """
+
+    def __init__(
+        self,
+        queue: str,
+        handler: Handler,
+        concurrency: int = ASYNC_CONCURRENCY,
+        batch_size: int = 1,
+        batch_timeout: float = 0.0,
+        declare: Iterable[str] = (),
+        heartbeat: int = RABBITMQ_HEARTBEAT,
+        batch_bytes: int = 0,
+        prefetch_count: Optional[int] = None,
+        transient: tuple[type[BaseException], ...] = TRANSIENT_ERRORS,
+    ) -> None:
+        """Prépare le consumer sans ouvrir de connexion.
+
+        :param str queue: file à consommer
+        :param Handler handler: coroutine ``handler(consumer, deliveries)``
+        :param int concurrency: nombre de lots traités simultanément
+        :param int batch_size: nombre maximal de messages par lot
+        :param float batch_timeout: attente maximale pour compléter un lot
+        :param Iterable[str] declare: files de publication à déclarer
+        :param int heartbeat: intervalle de heartbeat négocié (secondes)
+        :param int batch_bytes: taille cumulée des corps fermant un lot (0 : sans limite)
+        :param Optional[int] prefetch_count: messages non acquittés autorisés
+            (par défaut ``concurrency * batch_size``)
+        :param tuple transient: erreurs du handler justifiant une remise en file
+        :return: ``None``
+        :rtype: None
+        """
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.batch_bytes = batch_bytes
+        self.prefetch_count = prefetch_count
+        self.transient = transient
+        self.declare = tuple(declare)
+        self.parameters = pika.ConnectionParameters(
+            host=RABBITMQ_HOST,
+            credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD),
+            heartbeat=heartbeat,
+        )
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.publish_channel = None
+        self._closed: Optional[asyncio.Future] = None
+        self._pending: set[asyncio.Future] = set()
+        self._consuming = False
+
+    def _fail(self, reason: Any) -> None:
+        """Signale la perte d'une connexion ou d'un canal.
+
+        :param Any reason: cause de la fermeture
+        :return: ``None``
+        :rtype: None
+        """
+        error = reason if isinstance(reason, Exception) else AMQPConnectionError(reason)
+        for future in [self._closed, *self._pending]:
+            if future is not None and not future.done():
+                future.set_exception(error)
+
+    async def _wait(self, register: Callable[[Callable], None]) -> Any:
+        """Attend le résultat d'une opération pika à callback.
+
+        :param Callable register: lance l'opération avec le callback fourni
+        :return: argument passé au callback
+        :rtype: Any
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+
+        def done(result: Any = None, *args) -> None:
+            if not future.done():
+                future.set_result(result)
+
+        try:
+            register(done)
+            return await future
+        finally:
+            self._pending.discard(future)
+
+    async def _connect(self) -> AsyncioConnection:
+        """Ouvre une connexion asyncio.
+
+        :return: connexion ouverte
+        :rtype: AsyncioConnection
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_open(connection: AsyncioConnection) -> None:
+            future.set_result(connection)
+
+        def on_open_error(connection: AsyncioConnection, error: Any) -> None:
+            if not future.done():
+                future.set_exception(
+                    error if isinstance(error, Exception) else AMQPConnectionError(error)
+                )
+
+        def on_close(connection: AsyncioConnection, reason: Any) -> None:
+            self._fail(reason)
+
+        AsyncioConnection(
+            self.parameters,
+            on_open_callback=on_open,
+            on_open_error_callback=on_open_error,
+            on_close_callback=on_close,
+            custom_ioloop=loop,
+        )
+        return await future
+
+    async def _channel(self, connection: AsyncioConnection):
+        """Ouvre un canal et surveille sa fermeture.
+
+        :param AsyncioConnection connection: connexion ouverte
+        :return: canal ouvert
+        :rtype: pika.channel.Channel
+        """
+        channel = await self._wait(lambda done: connection.channel(on_open_callback=done))
+        channel.add_on_close_callback(lambda ch, reason: self._fail(reason))
+        return channel
+
+    async def _session(self) -> None:
+        """Connecte, consomme et traite les messages jusqu'à une coupure.
+
+        :return: ``None``
+        :rtype: None
+        """
+        loop = asyncio.get_running_loop()
+        self._closed = loop.create_future()
+        connections = []
+        try:
+            consume_connection = await self._connect()
+            connections.append(consume_connection)
+            publish_connection = await self._connect()
+            connections.append(publish_connection)
+            channel = await self._channel(consume_connection)
+            self.publish_channel = await self._channel(publish_connection)
+            await self._wait(
+                lambda done: channel.queue_declare(self.queue, durable=True, callback=done)
+            )
+            for name in self.declare:
+                await self._wait(
+                    lambda done: self.publish_channel.queue_declare(
+                        name, durable=True, callback=done
+                    )
+                )
+            await self._wait(
+                lambda done: channel.basic_qos(
+                    prefetch_count=self.prefetch_count or self.concurrency * self.batch_size,
+                    callback=done,
+                )
+            )
+            inbox: asyncio.Queue[Delivery] = asyncio.Queue()
+            channel.basic_consume(
+                self.queue,
+                on_message_callback=lambda ch, method, properties, body: inbox.put_nowait(
+                    Delivery(ch, method, properties, body)
+                ),
+            )
+            self._consuming = True
+            logging.info(f"Consumer asyncio en attente de messages sur {self.queue}...")
+            async with asyncio.TaskGroup() as group:
+                for _ in range(self.concurrency):
+                    group.create_task(self._worker(inbox))
+                # Lève l'erreur de fermeture et annule les workers
+                group.create_task(self._watch())
+        finally:
+            self._closed = None
+            self.publish_channel = None
+            for connection in connections:
+                if connection.is_open:
+                    connection.close()
+
+    async def _watch(self) -> None:
+        """Propage la perte de connexion au ``TaskGroup``.
+
+        :return: ``None``
+        :rtype: None
+        """
+        await self._closed
+
+    async def _worker(self, inbox: "asyncio.Queue[Delivery]") -> None:
+        """Forme des lots de messages et les confie au handler.
+
+        :param asyncio.Queue inbox: messages reçus
+        :return: ``None``
+        :rtype: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await inbox.get()]
+            size = len(batch[0].body)
+            deadline = loop.time() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                if self.batch_bytes and size >= self.batch_bytes:
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(inbox.get(), remaining))
+                except TimeoutError:
+                    break
+                size += len(batch[-1].body)
+            try:
+                await self.handler(self, batch)
+            except Exception as e:
+                await self._recover(batch, e)
+            else:
+                for delivery in batch:
+                    delivery.ack()
+
+    async def _recover(self, batch: list[Delivery], error: Exception) -> None:
+        """Traite l'échec du handler sur un lot.
+
+        :param list[Delivery] batch: lot en échec
+        :param Exception error: erreur levée par le handler
+        :return: ``None``
+        :rtype: None
+        """
+        pending = [delivery for delivery in batch if not delivery.settled]
+        if isinstance(error, self.transient):
+            logging.error(f"Erreur temporaire dans le handler asyncio: {error!r}")
+            for delivery in pending:
+                delivery.nack(requeue=True)
+            return
+        if len(pending) == 1:
+            logging.error(f"Message invalide rejeté sans remise en file: {error!r}")
+            pending[0].nack(requeue=False)
+            return
+        logging.warning(
+            f"Erreur dans le handler asyncio ({error!r}), "
+            f"retraitement message par message de {len(pending)} messages"
+        )
+        for delivery in pending:
+            try:
+                await self.handler(self, [delivery])
+            except Exception as e:
+                logging.error(f"Message en échec ({e!r})")
+                delivery.nack(requeue=isinstance(e, self.transient))
+            else:
+                delivery.ack()
+
+    async def run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        """Exécute une fonction bloquante dans le pool de threads du consumer.
+
+        :param Callable func: fonction à exécuter
+        :return: résultat de la fonction
+        :rtype: Any
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def publish(
+        self, routing_key: str, body: bytes, properties: Optional[pika.BasicProperties] = None
+    ) -> None:
+        """Publie un message sur la connexion de publication.
+
+        :param str routing_key: file de destination
+        :param bytes body: corps du message
+        :param Optional[pika.BasicProperties] properties: propriétés AMQP
+        :return: ``None``
+        :rtype: None
+        """
+        if self.publish_channel is None or not self.publish_channel.is_open:
+            raise AMQPChannelError("Canal de publication fermé")
+        self.publish_channel.basic_publish(
+            exchange="",
+            routing_key=routing_key,
+            body=body,
+            properties=properties or pika.BasicProperties(delivery_mode=2),
+        )
+
+    async def run(self) -> None:
+        """Consomme indéfiniment en se reconnectant après chaque coupure.
+
+        :return: ``None``
+        :rtype: None
+        """
+        attempt = 0
+        while True:
+            error = None
+            self._consuming = False
+            try:
+                await self._session()
+            except* (AMQPConnectionError, AMQPChannelError) as group:
+                error = group.exceptions[0]
+            # Le délai ne croît que si la reconnexion elle-même échoue
+            if self._consuming:
+                attempt = 0
+            delay = backoff_delay(attempt)
+            logging.error(
+                f"Connexion RabbitMQ perdue ({error!r}), reprise dans {delay:.1f} secondes."
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def run(consumer: AsyncConsumer) -> None:
+    """Lance un consumer asyncio jusqu'à interruption manuelle.
+
+    :param AsyncConsumer consumer: consumer à exécuter
+    :return: ``None``
+    :rtype: None
+    """
+    try:
+        asyncio.run(consumer.run())
+    except KeyboardInterrupt:
+        logging.info("Interruption manuelle, arrêt du consumer.")
+    finally:
+        consumer.executor.shutdown(wait=False, cancel_futures=True)
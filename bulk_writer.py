@@ -0,0 +1,256 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from opensearchpy import OpenSearch, helpers
+from embedding_sink import Sink
+from config import (
+    BULK_CONCURRENCY,
+    BULK_RETRIES,
+    BULK_RETRY_DELAY_MS,
+    BULK_MAX_RETRY_DELAY_MS,
+    INDEX_BATCH_MIN,
+    INDEX_BATCH_MAX,
+    INDEX_BATCH_INITIAL,
+    INDEX_TARGET_LATENCY_MS,
+)
+
+# Statuts d'item temporaires : l'item est renvoyé, les autres sont définitifs
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+def is_retryable(status) -> bool:
+    """Indique si un item refusé peut être renvoyé.
+
+    :param status: statut HTTP de l'item (``"N/A"`` pour une erreur réseau)
+    :return: ``True`` pour un refus temporaire
+    :rtype: bool
+    """
+    return not isinstance(status, int) or status in RETRYABLE_STATUS
+
+
+def retry_delay(attempt: int) -> float:
+    """Calcule l'attente avant un nouvel envoi des items refusés.
+
+    Le délai double à chaque renvoi à partir de ``BULK_RETRY_DELAY_MS``,
+    jusqu'à ``BULK_MAX_RETRY_DELAY_MS`` ; une part aléatoire évite que les
+    requêtes en vol reviennent toutes ensemble sur un cluster saturé.
+
+    :param int attempt: numéro du renvoi (à partir de 0)
+    :return: délai en secondes
+    :rtype: float
+    """
+    delay = min(BULK_RETRY_DELAY_MS * 2 ** attempt, BULK_MAX_RETRY_DELAY_MS) / 1000
+    return random.uniform(delay / 2, delay)
+
+
+class AdaptiveBatchSize:
+    """Taille de lot ajustée selon la réponse du cluster (AIMD).
+
+    La taille augmente de ``step`` documents après chaque lot plein traité
+    sous la latence cible sans refus 429, et est divisée par deux dès qu'un
+    lot est trop lent ou rejeté : l'indexer converge seul vers le débit que
+    le cluster peut absorber.
+    """
+
+    def __init__(
+        self,
+        initial: int = INDEX_BATCH_INITIAL,
+        minimum: int = INDEX_BATCH_MIN,
+        maximum: int = INDEX_BATCH_MAX,
+        target_latency: float = INDEX_TARGET_LATENCY_MS / 1000,
+    ) -> None:
+        """Initialise la taille de lot.
+
+        :param int initial: taille de départ
+        :param int minimum: taille minimale
+        :param int maximum: taille maximale
+        :param float target_latency: durée cible d'une requête bulk (secondes)
+        :return: ``None``
+        :rtype: None
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = min(max(initial, minimum), maximum)
+        self.step = max(minimum // 2, 1)
+        self.target_latency = target_latency
+        self.lock = threading.Lock()
+
+    def update(self, stats: dict) -> int:
+        """Ajuste la taille d'après les statistiques d'un lot.
+
+        :param dict stats: statistiques fournies par ``BulkWriter.write``
+        :return: nouvelle taille de lot
+        :rtype: int
+        """
+        with self.lock:
+            if stats["throttled"] or stats["batch_time"] > self.target_latency:
+                self.size = max(self.minimum, self.size // 2)
+            elif stats["batchsize"] >= self.size:
+                # Seul un lot plein renseigne sur la capacité du cluster
+                self.size = min(self.maximum, self.size + self.step)
+            return self.size
+
+
+class BulkWriter(Sink):
+    """Indexe des lots dans OpenSearch avec un nombre borné de requêtes en vol.
+
+    Le résultat de chaque item est remonté individuellement : seuls les
+    items refusés temporairement (429, 5xx, erreur réseau) sont renvoyés,
+    avec un délai croissant entre les tentatives.
+    """
+
+    def __init__(
+        self,
+        es: OpenSearch,
+        concurrency: int = BULK_CONCURRENCY,
+        retries: int = BULK_RETRIES,
+        on_batch: Optional[Callable[[dict], None]] = None,
+    ) -> None:
+        """Prépare le pool de requêtes bulk.
+
+        :param OpenSearch es: client OpenSearch
+        :param int concurrency: nombre maximal de requêtes bulk simultanées
+        :param int retries: renvois maximum d'un item refusé temporairement
+        :param Optional[Callable] on_batch: reçoit les statistiques de chaque lot
+        :return: ``None``
+        :rtype: None
+        """
+        self.es = es
+        self.retries = retries
+        self.on_batch = on_batch
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+    def _send(self, actions: list[dict]) -> list[tuple[bool, object]]:
+        """Envoie une requête bulk et retourne le résultat de chaque item.
+
+        :param list[dict] actions: actions bulk
+        :return: ``(ok, statut)`` de chaque action, dans l'ordre
+        :rtype: list[tuple[bool, object]]
+        """
+        results = []
+        for ok, item in helpers.streaming_bulk(
+            self.es,
+            actions,
+            chunk_size=len(actions),
+            max_retries=0,
+            raise_on_error=False,
+            raise_on_exception=False,
+            yield_ok=True,
+        ):
+            op_type, info = next(iter(item.items()))
+            # create d'un identifiant existant : document déjà indexé à l'identique
+            if not ok and op_type == "create" and info.get("status") == 409:
+                ok = True
+            results.append((ok, info.get("status")))
+            if not ok:
+                logging.warning(f"Item bulk refusé ({info.get('status')}): {info.get('error')}")
+        return results
+
+    def write(self, actions: list[dict]) -> list[Optional[bool]]:
+        """Indexe un lot et renvoie uniquement les items en échec temporaire.
+
+        :param list[dict] actions: actions bulk
+        :return: pour chaque action, ``True`` si indexée, ``False`` si refusée
+            définitivement, ``None`` si encore en échec après ``retries`` renvois
+        :rtype: list[Optional[bool]]
+        """
+        start = time.time()
+        results: list[Optional[bool]] = [None] * len(actions)
+        pending = list(range(len(actions)))
+        retried = 0
+        throttled = 0
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(retry_delay(attempt - 1))
+                retried += len(pending)
+            outcomes = self._send([actions[index] for index in pending])
+            retry = []
+            for index, (ok, status) in zip(pending, outcomes):
+                if ok:
+                    results[index] = True
+                elif is_retryable(status):
+                    retry.append(index)
+                    throttled += status == 429
+                else:
+                    results[index] = False
+            pending = retry
+            if not pending:
+                break
+        if self.on_batch:
+            self.on_batch({
+                "batchsize": len(actions),
+                "batch_time": time.time() - start,
+                "indexed": sum(1 for result in results if result),
+                "rejected": sum(1 for result in results if result is False),
+                "unconfirmed": len(pending),
+                "retried": retried,
+                "throttled": throttled,
+            })
+        return results
+
+    def submit(
+        self, actions: list[dict], on_done: Callable[[list[Optional[bool]]], None]
+    ) -> None:
+        """Indexe un lot en arrière-plan.
+
+        Bloque tant que ``concurrency`` requêtes sont déjà en vol.
+        ``on_done`` est appelé depuis un thread du pool avec le résultat
+        de ``write`` ; si la requête lève une exception, tous les items sont
+        considérés non confirmés (``None``).
+
+        :param list[dict] actions: actions bulk
+        :param Callable on_done: reçoit le résultat de chaque action
+        :return: ``None``
+        :rtype: None
+        """
+        self.slots.acquire()
+        self.executor.submit(self._run, actions, on_done)
+
+    def try_submit(
+        self, actions: list[dict], on_done: Callable[[list[Optional[bool]]], None]
+    ) -> bool:
+        """Indexe un lot en arrière-plan si une requête peut encore partir.
+
+        Ne bloque jamais : à utiliser depuis le thread pika, qui doit
+        continuer à servir les heartbeats.
+
+        :param list[dict] actions: actions bulk
+        :param Callable on_done: reçoit le résultat de chaque action
+        :return: ``False`` si ``concurrency`` requêtes sont déjà en vol
+        :rtype: bool
+        """
+        if not self.slots.acquire(blocking=False):
+            return False
+        self.executor.submit(self._run, actions, on_done)
+        return True
+
+    def _run(
+        self, actions: list[dict], on_done: Callable[[list[Optional[bool]]], None]
+    ) -> None:
+        """Exécute ``write`` dans le pool puis libère la place occupée.
+
+        :param list[dict] actions: actions bulk
+        :param Callable on_done: reçoit le résultat de chaque action
+        :return: ``None``
+        :rtype: None
+        """
+        try:
+            results = self.write(actions)
+        except Exception as e:
+            logging.error(f"Erreur bulk de {len(actions)} docs: {e!r}")
+            results = [None] * len(actions)
+        finally:
+            self.slots.release()
+        on_done(results)
+
+    def close(self) -> None:
+        """Attend la fin des requêtes en vol.
+
+        :return: ``None``
+        :rtype: None
+        """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,73 @@
+import json
+import struct
+import hashlib
+import pika
+import numpy as np
+from typing import Optional
+from config import EMBEDDING_WIRE_FORMAT
+
+JSON_CONTENT_TYPE = "application/json"
+# Corps binaire : longueur de l'en-tête (uint32 little-endian), en-tête JSON
+# (url, h1, ...), puis l'embedding en float32 little-endian
+BINARY_CONTENT_TYPE = "application/x-ysearch-embedding"
+
+HEADER_LENGTH = struct.Struct("<I")
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+def content_hash(text: str) -> str:
+    """Empreinte du texte d'une page, transmise à l'indexer avec l'embedding.
+
+    :param str text: texte extrait de la page
+    :return: SHA-1 hexadécimal
+    :rtype: str
+    """
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def encode_embedding_message(
+    message: dict, embedding: np.ndarray, wire_format: str = EMBEDDING_WIRE_FORMAT
+) -> tuple[bytes, pika.BasicProperties]:
+    """Sérialise un message d'indexation et son embedding.
+
+    :param dict message: champs du document (url, h1, content_hash, ...)
+    :param numpy.ndarray embedding: vecteur du document
+    :param str wire_format: ``binary`` ou ``json`` (format historique)
+    :return: corps du message et propriétés AMQP
+    :rtype: tuple[bytes, pika.BasicProperties]
+    """
+    if wire_format == "binary":
+        header = json.dumps(message).encode()
+        vector = np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPE)
+        body = HEADER_LENGTH.pack(len(header)) + header + vector.tobytes()
+        content_type = BINARY_CONTENT_TYPE
+    else:
+        body = json.dumps({**message, "embedding": embedding.tolist()}).encode()
+        content_type = JSON_CONTENT_TYPE
+    return body, pika.BasicProperties(delivery_mode=2, content_type=content_type)
+
+
+def decode_embedding_message(
+    body: bytes, properties: Optional[pika.BasicProperties]
+) -> dict:
+    """Désérialise un message d'indexation selon son ``content_type``.
+
+    Les deux formats cohabitent : un message sans ``content_type`` binaire
+    est lu comme du JSON.
+
+    :param bytes body: corps du message
+    :param Optional[pika.BasicProperties] properties: propriétés AMQP
+    :return: champs du document ; ``embedding`` est un ``numpy.ndarray``
+        float32 pour le format binaire, une liste pour le JSON
+    :rtype: dict
+    """
+    content_type = properties.content_type if properties else None
+    if content_type != BINARY_CONTENT_TYPE:
+        return json.loads(body)
+    (header_length,) = HEADER_LENGTH.unpack_from(body)
+    start = HEADER_LENGTH.size
+    message = json.loads(body[start:start + header_length])
+    message["embedding"] = np.frombuffer(
+        body, dtype=EMBEDDING_DTYPE, offset=start + header_length
+    )
+    return message
@@ -15,12 +15,116 @@ VECTORIZATION_QUEUE  = os.getenv("VECTORIZATION_QUEUE")
 INDEXING_QUEUE       = os.getenv("INDEXING_QUEUE")
 DOWNLOAD_QUEUE       = os.getenv("DOWNLOAD_QUEUE")
 RABBITMQ_RETRY_DELAY = int(os.getenv("RABBITMQ_RETRY_DELAY", 5))
-MAX_WORKERS          = int(os.getenv("MAX_WORKERS", 1))
+RABBITMQ_MAX_RETRY_DELAY = int(os.getenv("RABBITMQ_MAX_RETRY_DELAY", 60))
+RABBITMQ_HEARTBEAT   = int(os.getenv("RABBITMQ_HEARTBEAT", 60))
+ASYNC_RUNTIME        = os.getenv("ASYNC_RUNTIME", "false").lower() == "true"
+ASYNC_CONCURRENCY    = int(os.getenv("ASYNC_CONCURRENCY", 4))
+MAX_WORKERS          = int(os.getenv("MAX_WORKERS", os.cpu_count() or 1))
+PUBLISH_WINDOW       = int(os.getenv("PUBLISH_WINDOW", 500))
+PUBLISH_BATCH_SIZE   = int(os.getenv("PUBLISH_BATCH_SIZE", 1))
+
+# Vectorisation CPU : messages encodés ensemble (N messages ou T millisecondes)
+VECTORIZE_BATCH_SIZE       = int(os.getenv("VECTORIZE_BATCH_SIZE", 32))
+VECTORIZE_BATCH_TIMEOUT_MS = int(os.getenv("VECTORIZE_BATCH_TIMEOUT_MS", 200))
+# Processus d'encodage du vectoriseur CPU et threads torch par processus
+ENCODE_WORKERS             = int(os.getenv("ENCODE_WORKERS", 1))
+ENCODE_THREADS             = int(os.getenv("ENCODE_THREADS", 1))
+
+# Découpage en phrases : "sentencizer", "senter" ou "parser" (historique)
+SEGMENTER_MODE       = os.getenv("SEGMENTER_MODE", "parser")
+SEGMENTER_N_PROCESS  = int(os.getenv("SEGMENTER_N_PROCESS", 1))
+SEGMENTER_BATCH_SIZE = int(os.getenv("SEGMENTER_BATCH_SIZE", 64))
+# Modèle d'embedding des vectoriseurs
+EMBEDDING_MODEL      = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# Backend d'inférence : "torch", "onnx" ou "onnx-int8" (quantification dynamique)
+EMBEDDING_BACKEND        = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_QUANTIZATION   = os.getenv("EMBEDDING_QUANTIZATION", "avx2")
+EMBEDDING_ONNX_DIR       = os.getenv("EMBEDDING_ONNX_DIR", "models/onnx")
+EMBEDDING_ACCURACY_CHECK = os.getenv("EMBEDDING_ACCURACY_CHECK", "true").lower() == "true"
+EMBEDDING_MIN_COSINE     = float(os.getenv("EMBEDDING_MIN_COSINE", 0.99))
+# Cache des embeddings de segments : entrées en mémoire et base SQLite partagée (optionnelle)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 100_000))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+# Unité de taille des segments : "words" (150 mots) ou "tokens" (max_seq_length du modèle)
+SEGMENT_UNIT         = os.getenv("SEGMENT_UNIT", "words")
+
+# Encodage par lots de segments de longueurs proches, sous un budget de tokens
+ENCODE_BUCKETING     = os.getenv("ENCODE_BUCKETING", "true").lower() == "true"
+ENCODE_TOKEN_BUDGET  = int(os.getenv("ENCODE_TOKEN_BUDGET", 32768))
+
+# Téléchargement WARC
+WARC_STREAM_DOWNLOAD = os.getenv("WARC_STREAM_DOWNLOAD", "false").lower() == "true"
+WARC_TEE_TO_DISK     = os.getenv("WARC_TEE_TO_DISK", "false").lower() == "true"
+EXTRACT_CHUNK_SIZE   = int(os.getenv("EXTRACT_CHUNK_SIZE", 64))
+
+# Pré-filtre des enregistrements WARC (avant trafilatura)
+PREFILTER_ENABLED   = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_MIN_BYTES = int(os.getenv("PREFILTER_MIN_BYTES", 512))
+PREFILTER_MAX_BYTES = int(os.getenv("PREFILTER_MAX_BYTES", 5_000_000))
+
+# Identification de langue
+LANGID_BACKEND        = os.getenv("LANGID_BACKEND", "langdetect")
+LANGID_MAX_CHARS      = int(os.getenv("LANGID_MAX_CHARS", 2000))
+LANGID_MIN_CONFIDENCE = float(os.getenv("LANGID_MIN_CONFIDENCE", 0.4))
+LANGID_FASTTEXT_MODEL = os.getenv("LANGID_FASTTEXT_MODEL", "lid.176.ftz")
+LANGID_STOPWORDS_PREFILTER = os.getenv("LANGID_STOPWORDS_PREFILTER", "false").lower() == "true"
 
 # Elasticsearch
 ES_HOSTS = ast.literal_eval(os.getenv("ES_HOSTS", "[]"))
 ES_INDEX = os.getenv("ES_INDEX")
 ES_DIMS  = int(os.getenv("ES_DIMS", 384))
+# Identifiant des documents : "url", "url+content" ou "none" (identifiant aléatoire)
+INDEX_ID_MODE    = os.getenv("INDEX_ID_MODE", "url")
+INDEX_DEDUP_SIZE = int(os.getenv("INDEX_DEDUP_SIZE", 100_000))
+# Index k-NN : moteur, espace et paramètres HNSW de l'index créé par l'indexer
+KNN_ENGINE          = os.getenv("KNN_ENGINE", "nmslib")
+KNN_SPACE           = os.getenv("KNN_SPACE", "l2")
+KNN_M               = int(os.getenv("KNN_M", 16))
+KNN_EF_CONSTRUCTION = int(os.getenv("KNN_EF_CONSTRUCTION", 512))
+KNN_EF_SEARCH       = int(os.getenv("KNN_EF_SEARCH", 512))
+# Réglages de recherche, rétablis après un chargement massif (--ingest)
+INDEX_REPLICAS         = int(os.getenv("INDEX_REPLICAS", 1))
+INDEX_REFRESH_INTERVAL = os.getenv("INDEX_REFRESH_INTERVAL", "1s")
+INGEST_IDLE_SECONDS         = int(os.getenv("INGEST_IDLE_SECONDS", 300))
+INGEST_FORCE_MERGE_SEGMENTS = int(os.getenv("INGEST_FORCE_MERGE_SEGMENTS", 0))
+# Générations d'index : ES_INDEX devient un alias de lecture sur toutes les
+# générations, l'indexer écrit via un alias d'écriture basculé automatiquement
+INDEX_ROLLOVER                = os.getenv("INDEX_ROLLOVER", "false").lower() == "true"
+INDEX_GENERATION              = os.getenv("INDEX_GENERATION", "")
+INDEX_ROLLOVER_MAX_DOCS       = int(os.getenv("INDEX_ROLLOVER_MAX_DOCS", 5_000_000))
+INDEX_ROLLOVER_MAX_SIZE       = os.getenv("INDEX_ROLLOVER_MAX_SIZE", "")
+INDEX_ROLLOVER_CHECK_SECONDS  = int(os.getenv("INDEX_ROLLOVER_CHECK_SECONDS", 60))
+# Requêtes bulk simultanées et renvois des items refusés temporairement
+BULK_CONCURRENCY        = int(os.getenv("BULK_CONCURRENCY", 2))
+BULK_RETRIES            = int(os.getenv("BULK_RETRIES", 3))
+BULK_RETRY_DELAY_MS     = int(os.getenv("BULK_RETRY_DELAY_MS", 200))
+BULK_MAX_RETRY_DELAY_MS = int(os.getenv("BULK_MAX_RETRY_DELAY_MS", 5000))
+# Lots de l'indexer : taille adaptative (AIMD) et seuils de flush
+INDEX_BATCH_INITIAL     = int(os.getenv("INDEX_BATCH_INITIAL", 1000))
+INDEX_BATCH_MIN         = int(os.getenv("INDEX_BATCH_MIN", 100))
+INDEX_BATCH_MAX         = int(os.getenv("INDEX_BATCH_MAX", 10000))
+INDEX_BATCH_MAX_BYTES   = int(os.getenv("INDEX_BATCH_MAX_BYTES", 10_000_000))
+INDEX_LINGER_MS         = int(os.getenv("INDEX_LINGER_MS", 2000))
+INDEX_TARGET_LATENCY_MS = int(os.getenv("INDEX_TARGET_LATENCY_MS", 1000))
+
+# Destination de l'indexer : "opensearch" ou "file" (shards .npy + parquet)
+INDEX_SINK             = os.getenv("INDEX_SINK", "opensearch")
+EXPORT_DIR             = os.getenv("EXPORT_DIR", "export")
+EXPORT_SHARD_MAX_BYTES = int(os.getenv("EXPORT_SHARD_MAX_BYTES", 256_000_000))
+
+# Index FAISS local construit depuis EXPORT_DIR (faiss_service.py)
+FAISS_DIR              = os.getenv("FAISS_DIR", "faiss")
+FAISS_INDEX_FACTORY    = os.getenv("FAISS_INDEX_FACTORY", "HNSW32")
+FAISS_SEARCH_PARAMS    = os.getenv("FAISS_SEARCH_PARAMS", "")
+FAISS_EF_CONSTRUCTION  = int(os.getenv("FAISS_EF_CONSTRUCTION", 200))
+FAISS_TRAIN_SIZE       = int(os.getenv("FAISS_TRAIN_SIZE", 200_000))
+FAISS_HOLDOUT          = int(os.getenv("FAISS_HOLDOUT", 1000))
+FAISS_TOP_K            = int(os.getenv("FAISS_TOP_K", 10))
+SEARCH_HOST            = os.getenv("SEARCH_HOST", "0.0.0.0")
+SEARCH_PORT            = int(os.getenv("SEARCH_PORT", 8000))
+
+# Format des embeddings publiés dans INDEXING_QUEUE : "json" ou "binary"
+EMBEDDING_WIRE_FORMAT = os.getenv("EMBEDDING_WIRE_FORMAT", "json")
 
 # Logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -1,34 +1,11 @@
 import pika
 import json
 import logging
-import time
-from config import RABBITMQ_HOST, RABBITMQ_USER, RABBITMQ_PASSWORD, DOWNLOAD_QUEUE, RABBITMQ_RETRY_DELAY
+from rabbit import RabbitConnectionManager
+from config import DOWNLOAD_QUEUE
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_rabbit_connection() -> pika.BlockingConnection:
-    """Ouvre une connexion RabbitMQ.
-
-    Cette fonction tente de se connecter en boucle jusqu'à ce que la
-    connexion aboutisse.
-
-    :return: objet de connexion ouvert
-    :rtype: pika.BlockingConnection
-    """
-    while True:
-        try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-            )
-            logging.info("Connecté à RabbitMQ")
-            return connection
-        except Exception as e:
-            logging.error(
-                f"Erreur de connexion à RabbitMQ : {e}. Nouvelle tentative dans {RABBITMQ_RETRY_DELAY} secondes."
-            )
-            time.sleep(RABBITMQ_RETRY_DELAY)
-
 def main() -> None:
     """Publie les URLs WARC dans RabbitMQ.
 
@@ -37,8 +14,8 @@ def main() -> None:
     :return: ``None``
     :rtype: None
     """
-    connection = get_rabbit_connection()
-    channel = connection.channel()
+    rabbit = RabbitConnectionManager()
+    channel = rabbit.channel("publish")
     channel.queue_declare(queue=DOWNLOAD_QUEUE, durable=True)
     
     # Suppose que vos URLs sont stockées dans un fichier "download_urls.txt"
@@ -64,7 +41,7 @@ def main() -> None:
         except Exception as e:
             logging.error(f"Erreur lors de l'envoi de l'URL {url}: {e}")
     
-    connection.close()
+    rabbit.close()
 
 if __name__ == "__main__":
     main()
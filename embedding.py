@@ -0,0 +1,229 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from typing import Optional
+from sentence_transformers import SentenceTransformer
+from sequencer import segment_texts, segment_texts_by_tokens
+from embedding_cache import EmbeddingCache
+from config import SEGMENT_UNIT, ENCODE_BUCKETING, ENCODE_TOKEN_BUDGET
+
+# Taille des segments en mode "words" (historique)
+SEGMENT_MAX_WORDS = 150
+SEGMENT_OVERLAP = 2
+
+
+def token_budget(model: SentenceTransformer) -> int:
+    """Nombre de tokens de texte qu'un segment peut contenir sans troncature.
+
+    :param SentenceTransformer model: modèle d'embedding
+    :return: ``max_seq_length`` moins les tokens spéciaux ([CLS], [SEP])
+    :rtype: int
+    """
+    return model.max_seq_length - model.tokenizer.num_special_tokens_to_add(pair=False)
+
+
+def segment_documents(
+    model: SentenceTransformer, texts: list[str]
+) -> tuple[list[list[str]], Optional[list[list[list[int]]]]]:
+    """Découpe des documents selon ``SEGMENT_UNIT``.
+
+    En mode ``tokens``, les segments remplissent la longueur maximale du
+    modèle et leur tokenisation est conservée pour ``encode_segments``.
+
+    :param SentenceTransformer model: modèle d'embedding
+    :param list[str] texts: textes des documents
+    :return: segments de chaque document et, en mode ``tokens``, leurs
+        identifiants de tokens (``None`` sinon)
+    :rtype: tuple[list[list[str]], Optional[list[list[list[int]]]]]
+    """
+    if SEGMENT_UNIT == "tokens":
+        documents = segment_texts_by_tokens(
+            texts, model.tokenizer, token_budget(model), SEGMENT_OVERLAP
+        )
+        return (
+            [[text for text, _ in segments] for segments in documents],
+            [[ids for _, ids in segments] for segments in documents],
+        )
+    return segment_texts(texts, SEGMENT_MAX_WORDS, SEGMENT_OVERLAP), None
+
+
+def plan_batches(lengths: list[int], max_batch_size: int, token_budget: int) -> list[list[int]]:
+    """Regroupe des segments de longueurs proches en lots de taille dynamique.
+
+    Les segments sont triés du plus long au plus court ; un lot est fermé
+    dès qu'il atteint ``max_batch_size`` segments ou que sa taille une fois
+    complétée (nombre de segments × longueur du plus long) dépasserait
+    ``token_budget``. Les lots de segments courts sont donc plus grands, et
+    les plus longs passent en premier : un dépassement mémoire apparaît
+    dès le début du lot de documents.
+
+    :param list[int] lengths: longueur en tokens de chaque segment
+    :param int max_batch_size: nombre maximal de segments par lot
+    :param int token_budget: nombre maximal de tokens (padding compris) par lot
+    :return: indices des segments de chaque lot
+    :rtype: list[list[int]]
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True)
+    batches = []
+    batch = []
+    for index in order:
+        # Le premier segment du lot est le plus long : il fixe le padding
+        width = lengths[batch[0]] if batch else lengths[index]
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * width > token_budget):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def tokenize_segments(model: SentenceTransformer, segments: list[str]) -> list[list[int]]:
+    """Tokenise des segments comme ``model.encode`` (troncature comprise).
+
+    :param SentenceTransformer model: modèle d'embedding
+    :param list[str] segments: textes des segments
+    :return: identifiants de tokens sans tokens spéciaux
+    :rtype: list[list[int]]
+    """
+    if not segments:
+        return []
+    return model.tokenizer(
+        segments, add_special_tokens=False, truncation=True, max_length=token_budget(model)
+    )["input_ids"]
+
+
+def encode_token_ids(
+    model: SentenceTransformer, token_ids: list[list[int]], batch_size: int
+) -> torch.Tensor:
+    """Encode des segments déjà tokenisés, sans repasser par le tokenizer.
+
+    Avec ``ENCODE_BUCKETING``, les segments sont encodés par lots de
+    longueurs proches (``plan_batches``) sous ``ENCODE_TOKEN_BUDGET``, puis
+    les embeddings sont remis dans l'ordre d'origine.
+
+    :param SentenceTransformer model: modèle d'embedding
+    :param list[list[int]] token_ids: identifiants de tokens sans tokens spéciaux
+    :param int batch_size: nombre maximal de segments par passe du modèle
+    :return: embeddings des segments, dans l'ordre
+    :rtype: torch.Tensor
+    """
+    tokenizer = model.tokenizer
+    inputs = [tokenizer.build_inputs_with_special_tokens(ids) for ids in token_ids]
+    if ENCODE_BUCKETING:
+        batches = plan_batches([len(ids) for ids in inputs], batch_size, ENCODE_TOKEN_BUDGET)
+    else:
+        batches = [
+            list(range(start, min(start + batch_size, len(inputs))))
+            for start in range(0, len(inputs), batch_size)
+        ]
+    embeddings = torch.empty(
+        (len(inputs), model.get_sentence_embedding_dimension()), device=model.device
+    )
+    for batch in batches:
+        features = tokenizer.pad(
+            {"input_ids": [inputs[index] for index in batch]}, return_tensors="pt"
+        )
+        # Comme model.encode ; requis par les graphes ONNX exportés
+        if "token_type_ids" in tokenizer.model_input_names:
+            features["token_type_ids"] = torch.zeros_like(features["input_ids"])
+        features = {name: tensor.to(model.device) for name, tensor in features.items()}
+        with torch.no_grad():
+            output = model(features)["sentence_embedding"]
+        embeddings[torch.tensor(batch, device=model.device)] = output.to(embeddings.dtype)
+    return embeddings
+
+
+def _encode_uncached(
+    model: SentenceTransformer,
+    segments: list[str],
+    batch_size: int,
+    token_ids: Optional[list[list[int]]] = None,
+) -> torch.Tensor:
+    """Encode des segments sans consulter le cache.
+
+    Sans ``ENCODE_BUCKETING`` ni tokenisation fournie, ``model.encode``
+    est appelé directement comme auparavant.
+
+    :param SentenceTransformer model: modèle d'embedding
+    :param list[str] segments: textes des segments
+    :param int batch_size: nombre maximal de segments par passe du modèle
+    :param Optional[list[list[int]]] token_ids: identifiants de tokens des segments
+    :return: embeddings des segments, dans l'ordre
+    :rtype: torch.Tensor
+    """
+    if token_ids is None and not ENCODE_BUCKETING:
+        return model.encode(
+            segments,
+            batch_size=batch_size,
+            convert_to_tensor=True,
+            show_progress_bar=False,
+        )
+    if token_ids is None:
+        token_ids = tokenize_segments(model, segments)
+    return encode_token_ids(model, token_ids, batch_size)
+
+
+def encode_segments(
+    model: SentenceTransformer,
+    segments: list[str],
+    batch_size: int,
+    token_ids: Optional[list[list[int]]] = None,
+    cache: Optional[EmbeddingCache] = None,
+) -> torch.Tensor:
+    """Encode des segments, en réutilisant leur tokenisation si elle est fournie.
+
+    Avec un cache, seuls les segments inconnus sont encodés, une seule fois
+    chacun même s'ils se répètent dans le lot.
+
+    :param SentenceTransformer model: modèle d'embedding
+    :param list[str] segments: textes des segments
+    :param int batch_size: nombre maximal de segments par passe du modèle
+    :param Optional[list[list[int]]] token_ids: identifiants de tokens des segments
+    :param Optional[EmbeddingCache] cache: cache des embeddings de segments
+    :return: embeddings des segments, dans l'ordre
+    :rtype: torch.Tensor
+    """
+    if cache is None:
+        return _encode_uncached(model, segments, batch_size, token_ids)
+    if not segments:
+        return torch.empty(
+            (0, model.get_sentence_embedding_dimension()), device=model.device
+        )
+    keys = cache.keys(segments)
+    found = cache.get_many(keys)
+    # Première occurrence de chaque segment absent du cache
+    missing = {}
+    for index, key in enumerate(keys):
+        if key not in found and key not in missing:
+            missing[key] = index
+    if missing:
+        indices = list(missing.values())
+        computed = _encode_uncached(
+            model,
+            [segments[index] for index in indices],
+            batch_size,
+            [token_ids[index] for index in indices] if token_ids is not None else None,
+        ).cpu().numpy()
+        new = dict(zip(missing, computed))
+        cache.put_many(new)
+        found.update(new)
+    vectors = np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
+    return torch.from_numpy(vectors).to(model.device)
+
+
+def mean_pool(embeddings: torch.Tensor, counts: list[int]) -> list[np.ndarray]:
+    """Calcule l'embedding normalisé de chaque document.
+
+    :param torch.Tensor embeddings: embeddings des segments de tous les documents
+    :param list[int] counts: nombre de segments de chaque document, dans l'ordre
+    :return: moyenne normalisée des segments de chaque document
+    :rtype: list[numpy.ndarray]
+    """
+    doc_embeddings = []
+    idx = 0
+    for count in counts:
+        mean_emb = torch.mean(embeddings[idx: idx + count], dim=0)
+        doc_embeddings.append(F.normalize(mean_emb, p=2, dim=0).cpu().numpy())
+        idx += count
+    return doc_embeddings
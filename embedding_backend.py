@@ -0,0 +1,190 @@
+import time
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Callable, Optional
+from sentence_transformers import SentenceTransformer
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BACKEND,
+    EMBEDDING_QUANTIZATION,
+    EMBEDDING_ONNX_DIR,
+    EMBEDDING_ACCURACY_CHECK,
+    EMBEDDING_MIN_COSINE,
+)
+
+# Suffixe des fichiers produits par export_dynamic_quantized_onnx_model
+QUANTIZED_FILES = {
+    "arm64": "qint8_arm64",
+    "avx2": "quint8_avx2",
+    "avx512": "qint8_avx512",
+    "avx512_vnni": "qint8_avx512_vnni",
+}
+
+# Corpus fixe de contrôle : pages courtes et segments longs, français et boilerplate
+ACCURACY_CORPUS = [
+    "Le conseil municipal a voté le budget de la commune pour l'année prochaine.",
+    "Nous utilisons des cookies pour améliorer votre expérience sur notre site.",
+    "La recette de la tarte aux pommes demande une pâte brisée, des pommes et du sucre.",
+    "Les chercheurs ont observé une hausse des températures moyennes dans les Alpes.",
+    "Livraison gratuite dès 50 euros d'achat, retours sous 30 jours.",
+    "Le match s'est terminé sur un score nul après une seconde période très disputée.",
+    "Accueil > Actualités > Culture",
+    "La loi prévoit une exonération partielle pour les entreprises de moins de dix salariés, "
+    "sous réserve que leur chiffre d'affaires annuel ne dépasse pas le seuil fixé par décret "
+    "et que les déclarations sociales aient été déposées dans les délais.",
+    "Inscrivez-vous à notre newsletter pour recevoir nos offres.",
+    "Le musée présente une exposition consacrée aux peintres impressionnistes normands.",
+]
+
+
+def load_torch(device: str) -> SentenceTransformer:
+    """Charge le modèle sous PyTorch (backend historique).
+
+    :param str device: périphérique (``cpu``, ``cuda``, ``mps``)
+    :return: modèle prêt à l'emploi
+    :rtype: SentenceTransformer
+    """
+    return SentenceTransformer(EMBEDDING_MODEL, device=device)
+
+
+def load_onnx(device: str) -> SentenceTransformer:
+    """Charge le modèle exporté en ONNX, exécuté par ONNX Runtime.
+
+    :param str device: périphérique (``cpu`` ou ``cuda``)
+    :return: modèle prêt à l'emploi
+    :rtype: SentenceTransformer
+    """
+    return SentenceTransformer(EMBEDDING_MODEL, backend="onnx", device=device)
+
+
+def load_onnx_int8(device: str) -> SentenceTransformer:
+    """Charge la variante ONNX quantifiée dynamiquement en int8.
+
+    Le modèle quantifié est exporté une fois dans ``EMBEDDING_ONNX_DIR``
+    pour le jeu d'instructions ``EMBEDDING_QUANTIZATION``, puis réutilisé.
+
+    :param str device: périphérique (``cpu``)
+    :return: modèle prêt à l'emploi
+    :rtype: SentenceTransformer
+    """
+    # Dépendance optionnelle (optimum[onnxruntime]), chargée uniquement ici
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    path = Path(EMBEDDING_ONNX_DIR)
+    file_name = f"onnx/model_{QUANTIZED_FILES[EMBEDDING_QUANTIZATION]}.onnx"
+    if not (path / file_name).exists():
+        logging.info(f"Export ONNX int8 ({EMBEDDING_QUANTIZATION}) vers {path}")
+        model = load_onnx(device)
+        model.save(str(path))
+        export_dynamic_quantized_onnx_model(model, EMBEDDING_QUANTIZATION, str(path))
+    return SentenceTransformer(
+        str(path), backend="onnx", device=device, model_kwargs={"file_name": file_name}
+    )
+
+
+BACKENDS: dict[str, Callable[[str], SentenceTransformer]] = {
+    "torch": load_torch,
+    "onnx": load_onnx,
+    "onnx-int8": load_onnx_int8,
+}
+
+
+def backend_id(backend: str = EMBEDDING_BACKEND) -> str:
+    """Identifie le modèle et son backend (clé du cache d'embeddings).
+
+    :param str backend: nom du backend
+    :return: identifiant stable, par exemple ``all-MiniLM-L6-v2:onnx-int8:avx2``
+    :rtype: str
+    """
+    if backend == "torch":
+        return EMBEDDING_MODEL
+    if backend == "onnx-int8":
+        return f"{EMBEDDING_MODEL}:{backend}:{EMBEDDING_QUANTIZATION}"
+    return f"{EMBEDDING_MODEL}:{backend}"
+
+
+def check_accuracy(
+    model: SentenceTransformer,
+    reference: Optional[SentenceTransformer] = None,
+    corpus: list[str] = ACCURACY_CORPUS,
+) -> dict:
+    """Compare les embeddings d'un backend à ceux de PyTorch sur un corpus fixe.
+
+    :param SentenceTransformer model: modèle à contrôler
+    :param Optional[SentenceTransformer] reference: modèle PyTorch de référence
+        (chargé sur CPU si absent)
+    :param list[str] corpus: textes de contrôle
+    :return: similarités cosinus minimale et moyenne, débits des deux modèles
+    :rtype: dict
+    """
+    reference = reference or load_torch("cpu")
+    results = {}
+    embeddings = {}
+    for name, candidate in (("reference", reference), ("candidate", model)):
+        start = time.time()
+        embeddings[name] = candidate.encode(
+            corpus, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        )
+        results[f"{name}_texts_per_s"] = len(corpus) / max(time.time() - start, 1e-9)
+    cosines = np.sum(embeddings["reference"] * embeddings["candidate"], axis=1)
+    results["min_cosine"] = float(cosines.min())
+    results["mean_cosine"] = float(cosines.mean())
+    return results
+
+
+def verify_backend(model: SentenceTransformer, backend: str = EMBEDDING_BACKEND) -> None:
+    """Contrôle les vecteurs d'un backend autre que PyTorch.
+
+    Une similarité cosinus inférieure à ``EMBEDDING_MIN_COSINE`` sur
+    ``ACCURACY_CORPUS`` empêche le consumer de démarrer. Sans effet pour
+    ``torch`` ou si ``EMBEDDING_ACCURACY_CHECK`` est désactivé.
+
+    :param SentenceTransformer model: modèle chargé avec ``backend``
+    :param str backend: ``torch``, ``onnx`` ou ``onnx-int8``
+    :return: ``None``
+    :rtype: None
+    :raises ValueError: si le backend s'écarte trop de PyTorch
+    """
+    if backend == "torch" or not EMBEDDING_ACCURACY_CHECK:
+        return
+    results = check_accuracy(model)
+    logging.info(f"Contrôle du backend {backend_id(backend)} : {results}")
+    if results["min_cosine"] < EMBEDDING_MIN_COSINE:
+        raise ValueError(
+            f"Backend {backend_id(backend)} trop éloigné de PyTorch : "
+            f"cosinus minimal {results['min_cosine']:.4f} < {EMBEDDING_MIN_COSINE}"
+        )
+
+
+def load_model(
+    device: str, backend: str = EMBEDDING_BACKEND, verify: bool = True
+) -> SentenceTransformer:
+    """Charge le modèle d'embedding avec le backend configuré.
+
+    Hors PyTorch, les vecteurs sont contrôlés au chargement
+    (``verify_backend``), sauf avec ``verify=False`` : un processus qui va
+    créer un pool par fork ne doit faire aucune inférence avant, le contrôle
+    est alors fait dans un worker.
+
+    :param str device: périphérique
+    :param str backend: ``torch``, ``onnx`` ou ``onnx-int8``
+    :param bool verify: contrôle la précision du backend
+    :return: modèle prêt à l'emploi
+    :rtype: SentenceTransformer
+    :raises ValueError: si le backend est inconnu ou s'écarte trop de PyTorch
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend d'embedding inconnu : {backend}")
+    model = BACKENDS[backend](device)
+    if verify:
+        verify_backend(model, backend)
+    return model
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    reference = load_torch("cpu")
+    for name in BACKENDS:
+        if name != "torch":
+            print(name, check_accuracy(BACKENDS[name]("cpu"), reference))
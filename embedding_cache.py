@@ -0,0 +1,189 @@
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Optional
+from logger import logger
+from config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH, MACHINE
+
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+def normalize_segment(text: str) -> str:
+    """Normalise un segment avant hachage (Unicode NFC, espaces réduits).
+
+    :param str text: texte du segment
+    :return: texte normalisé
+    :rtype: str
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def segment_key(model_id: str, text: str) -> bytes:
+    """Clé de cache d'un segment : empreinte du modèle et du texte normalisé.
+
+    :param str model_id: identifiant du modèle d'embedding
+    :param str text: texte du segment
+    :return: empreinte SHA-1
+    :rtype: bytes
+    """
+    return hashlib.sha1(f"{model_id}\0{normalize_segment(text)}".encode()).digest()
+
+
+class EmbeddingCache:
+    """Cache des embeddings de segments, en mémoire et optionnellement sur disque.
+
+    Un LRU de ``size`` entrées est consulté en premier ; si ``path`` est
+    renseigné, une base SQLite partagée par les consumers d'une même machine
+    sert de second niveau. Les vecteurs sont stockés en float32.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        size: int = EMBEDDING_CACHE_SIZE,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+    ) -> None:
+        """Prépare le cache et ouvre la base persistante si demandée.
+
+        :param str model_id: identifiant du modèle, inclus dans chaque clé
+        :param int size: nombre maximal d'entrées en mémoire
+        :param Optional[str] path: fichier SQLite partagé (désactivé si vide)
+        :return: ``None``
+        :rtype: None
+        """
+        self.model_id = model_id
+        self.size = size
+        self.entries: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            # WAL : lectures concurrentes entre consumers pendant les écritures
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB)"
+            )
+            self.db.commit()
+
+    def keys(self, segments: list[str]) -> list[bytes]:
+        """Calcule les clés de cache d'une liste de segments.
+
+        :param list[str] segments: textes des segments
+        :return: clé de chaque segment
+        :rtype: list[bytes]
+        """
+        return [segment_key(self.model_id, segment) for segment in segments]
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        """Retourne les embeddings connus parmi ``keys``.
+
+        :param list[bytes] keys: clés recherchées
+        :return: embeddings trouvés, par clé
+        :rtype: dict[bytes, numpy.ndarray]
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                vector = self.entries.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self.entries.move_to_end(key)
+                    found[key] = vector
+            if self.db is not None and missing:
+                # Limite SQLite du nombre de paramètres par requête
+                for start in range(0, len(missing), 500):
+                    part = missing[start: start + 500]
+                    rows = self.db.execute(
+                        "SELECT key, vector FROM embeddings WHERE key IN "
+                        f"({','.join('?' * len(part))})",
+                        part,
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+                        found[key] = vector
+                        self._remember(key, vector)
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: dict[bytes, np.ndarray]) -> None:
+        """Enregistre des embeddings calculés.
+
+        :param dict[bytes, numpy.ndarray] items: embeddings par clé
+        :return: ``None``
+        :rtype: None
+        """
+        vectors = {
+            key: np.ascontiguousarray(vector, dtype=EMBEDDING_DTYPE)
+            for key, vector in items.items()
+        }
+        with self.lock:
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+            if self.db is not None and vectors:
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in vectors.items()],
+                )
+                self.db.commit()
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        """Ajoute une entrée au LRU en évinçant la plus ancienne si besoin.
+
+        :param bytes key: clé du segment
+        :param numpy.ndarray vector: embedding du segment
+        :return: ``None``
+        :rtype: None
+        """
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def log_metrics(self, step: str) -> None:
+        """Publie les compteurs de succès et d'échecs via ``logger``.
+
+        Les compteurs sont remis à zéro après publication.
+
+        :param str step: nom de l'étape dans les métriques
+        :return: ``None``
+        :rtype: None
+        """
+        with self.lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+            size = len(self.entries)
+        total = hits + misses
+        logger({
+            "step": step,
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "cache_hit_rate": hits / total if total else 0.0,
+            "cache_size": size,
+            "computer": MACHINE,
+        })
+
+
+def create_cache(model_id: str, workers: int = 1) -> Optional[EmbeddingCache]:
+    """Crée le cache configuré, ou ``None`` s'il est désactivé.
+
+    ``EMBEDDING_CACHE_SIZE`` borne la mémoire de toute la machine : avec
+    ``workers`` processus d'encodage, chacun garde ``1/workers`` des
+    segments en mémoire ; le fichier ``EMBEDDING_CACHE_PATH`` reste commun.
+
+    :param str model_id: identifiant du modèle d'embedding
+    :param int workers: processus qui créent chacun leur cache
+    :return: cache prêt à l'emploi
+    :rtype: Optional[EmbeddingCache]
+    """
+    size = EMBEDDING_CACHE_SIZE // max(workers, 1)
+    if size <= 0 and not EMBEDDING_CACHE_PATH:
+        return None
+    return EmbeddingCache(model_id, size=max(size, 0))
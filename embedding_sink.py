@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import logging
+import threading
+import duckdb
+import numpy as np
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+from config import (
+    ES_DIMS,
+    EXPORT_DIR,
+    EXPORT_SHARD_MAX_BYTES,
+    INDEX_BATCH_INITIAL,
+)
+
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+class Sink(ABC):
+    """Destination des lots de l'indexer.
+
+    Les implémentations reçoivent les actions bulk construites par
+    ``indexer_consumer.build_action`` et renvoient le résultat de chaque
+    document : ``True`` écrit, ``False`` refusé définitivement, ``None`` non
+    confirmé (remis en file).
+    """
+
+    @abstractmethod
+    def write(self, actions: list[dict]) -> list[Optional[bool]]:
+        """Écrit un lot.
+
+        :param list[dict] actions: actions bulk
+        :return: résultat de chaque action
+        :rtype: list[Optional[bool]]
+        """
+
+    def submit(
+        self, actions: list[dict], on_done: Callable[[list[Optional[bool]]], None]
+    ) -> None:
+        """Écrit un lot puis transmet le résultat à ``on_done``.
+
+        L'implémentation par défaut est synchrone.
+
+        :param list[dict] actions: actions bulk
+        :param Callable on_done: reçoit le résultat de chaque action
+        :return: ``None``
+        :rtype: None
+        """
+        try:
+            results = self.write(actions)
+        except Exception as e:
+            logging.error(f"Erreur d'écriture de {len(actions)} docs: {e!r}")
+            results = [None] * len(actions)
+        on_done(results)
+
+    def try_submit(
+        self, actions: list[dict], on_done: Callable[[list[Optional[bool]]], None]
+    ) -> bool:
+        """Comme ``submit``, sans jamais attendre une place libre.
+
+        L'implémentation par défaut écrit toujours le lot.
+
+        :param list[dict] actions: actions bulk
+        :param Callable on_done: reçoit le résultat de chaque action
+        :return: ``False`` si le lot n'a pas été pris en charge
+        :rtype: bool
+        """
+        self.submit(actions, on_done)
+        return True
+
+    def close(self) -> None:
+        """Termine les écritures en cours.
+
+        :return: ``None``
+        :rtype: None
+        """
+
+
+class FileSink(Sink):
+    """Écrit les embeddings dans des fichiers locaux au lieu d'OpenSearch.
+
+    Chaque shard ``shard-NNNNN`` se compose d'un ``.npy`` float32
+    (``N x ES_DIMS``, chargeable avec ``mmap_mode="r"``) et d'un
+    ``.parquet`` (``row``, ``id``, ``url``, ``h1``) qui sert de manifeste.
+    Les lots sont d'abord ajoutés et synchronisés sur disque dans des
+    fichiers ``.part`` : un message n'est acquitté qu'une fois son document
+    persisté. Quand le shard dépasse ``max_bytes``, il est finalisé ; le
+    parquet est écrit en dernier et marque un shard complet. Un répertoire
+    ne doit être utilisé que par un seul indexer.
+    """
+
+    def __init__(
+        self,
+        directory: str = EXPORT_DIR,
+        max_bytes: int = EXPORT_SHARD_MAX_BYTES,
+        on_batch: Optional[Callable[[dict], None]] = None,
+    ) -> None:
+        """Prépare le répertoire et finalise un shard interrompu.
+
+        :param str directory: répertoire d'export
+        :param int max_bytes: taille des vecteurs d'un shard avant rotation
+        :param Optional[Callable] on_batch: reçoit les statistiques de chaque lot
+        :return: ``None``
+        :rtype: None
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.on_batch = on_batch
+        self.lock = threading.Lock()
+        self.vectors = None
+        self.rows = None
+        self.count = 0
+        # Shard laissé incomplet par un arrêt brutal : ses documents sont acquittés
+        for part in sorted(self.directory.glob("shard-*.f32.part")):
+            self._finalize(part.name[:-len(".f32.part")])
+        shards = sorted(self.directory.glob("shard-*.npy"))
+        self.shard = int(shards[-1].stem.split("-")[1]) + 1 if shards else 0
+
+    def _name(self) -> str:
+        """Nom du shard courant.
+
+        :return: ``shard-NNNNN``
+        :rtype: str
+        """
+        return f"shard-{self.shard:05d}"
+
+    def _open(self) -> None:
+        """Ouvre les fichiers ``.part`` du shard courant.
+
+        :return: ``None``
+        :rtype: None
+        """
+        name = self._name()
+        # Sans tampon : un lot en échec ne laisse rien à écrire plus tard
+        self.vectors = open(self.directory / f"{name}.f32.part", "ab", buffering=0)
+        self.rows = open(self.directory / f"{name}.jsonl.part", "ab", buffering=0)
+        self.count = 0
+
+    def write(self, actions: list[dict]) -> list[Optional[bool]]:
+        """Ajoute un lot au shard courant et le synchronise sur disque.
+
+        :param list[dict] actions: actions bulk
+        :return: ``True`` pour chaque action persistée
+        :rtype: list[Optional[bool]]
+        """
+        start = time.time()
+        vectors = np.stack([
+            np.asarray(action["_source"]["embedding"], dtype=EMBEDDING_DTYPE)
+            for action in actions
+        ])
+        if vectors.shape[1] != ES_DIMS:
+            raise ValueError(f"Embeddings de dimension {vectors.shape[1]}, ES_DIMS={ES_DIMS}")
+        with self.lock:
+            if self.vectors is None:
+                self._open()
+            rows = "".join(
+                json.dumps({
+                    "row": self.count + position,
+                    "id": action.get("_id"),
+                    "url": action["_source"]["url"],
+                    "h1": action["_source"]["h1"],
+                }) + "\n"
+                for position, action in enumerate(actions)
+            ).encode()
+            offsets = (self.vectors.tell(), self.rows.tell())
+            try:
+                # Vecteurs puis lignes : une ligne persistée a toujours son vecteur
+                for handle, data in ((self.vectors, vectors.tobytes()), (self.rows, rows)):
+                    handle.write(data)
+                    os.fsync(handle.fileno())
+            except Exception:
+                # Lot relivré : les fichiers reviennent à leur état précédent
+                for handle, offset in zip((self.vectors, self.rows), offsets):
+                    handle.truncate(offset)
+                    handle.seek(offset)
+                raise
+            self.count += len(actions)
+            if self.vectors.tell() >= self.max_bytes:
+                self._rotate()
+        if self.on_batch:
+            self.on_batch({
+                "batchsize": len(actions),
+                "batch_time": time.time() - start,
+                "indexed": len(actions),
+                "rejected": 0,
+                "unconfirmed": 0,
+                "retried": 0,
+                "throttled": 0,
+            })
+        return [True] * len(actions)
+
+    def _rotate(self) -> None:
+        """Ferme et finalise le shard courant ; le suivant s'ouvrira au prochain lot.
+
+        :return: ``None``
+        :rtype: None
+        """
+        self.vectors.close()
+        self.rows.close()
+        self.vectors = self.rows = None
+        self._finalize(self._name())
+        self.shard += 1
+
+    def _finalize(self, name: str) -> None:
+        """Convertit les fichiers ``.part`` d'un shard en ``.npy`` et ``.parquet``.
+
+        :param str name: nom du shard
+        :return: ``None``
+        :rtype: None
+        """
+        vectors_part = self.directory / f"{name}.f32.part"
+        rows_part = self.directory / f"{name}.jsonl.part"
+        vectors = np.fromfile(vectors_part, dtype=EMBEDDING_DTYPE)
+        # Après un arrêt brutal, seuls les documents dont le vecteur et la ligne
+        # sont complets sont gardés ; les suivants n'ont pas été acquittés et
+        # seront relivrés
+        vectors = vectors[: len(vectors) // ES_DIMS * ES_DIMS].reshape(-1, ES_DIMS)
+        count = 0
+        if len(vectors) and rows_part.exists():
+            columns = "{row: 'BIGINT', id: 'VARCHAR', url: 'VARCHAR', h1: 'VARCHAR'}"
+            rows = (
+                f"SELECT row, id, url, h1 FROM read_json('{rows_part}', "
+                f"format='newline_delimited', ignore_errors=true, columns={columns}) "
+                f"WHERE row < {len(vectors)}"
+            )
+            (count,) = duckdb.sql(f"SELECT count(*) FROM ({rows})").fetchone()
+        if count:
+            np.save(self.directory / f"{name}.npy", vectors[:count])
+            duckdb.sql(
+                f"COPY ({rows} ORDER BY row) "
+                f"TO '{self.directory / (name + '.parquet')}' (FORMAT parquet)"
+            )
+        vectors_part.unlink()
+        rows_part.unlink(missing_ok=True)
+        logging.info(f"Shard {name} exporté : {count} documents")
+
+    def close(self) -> None:
+        """Finalise le shard en cours.
+
+        :return: ``None``
+        :rtype: None
+        """
+        with self.lock:
+            if self.vectors is not None:
+                self._rotate()
+
+
+def shard_manifests(directory: str = EXPORT_DIR) -> list[Path]:
+    """Manifestes des shards complets d'un export, dans l'ordre d'écriture.
+
+    :param str directory: répertoire d'export
+    :return: chemins des ``.parquet`` (le ``.npy`` associé porte le même nom)
+    :rtype: list[pathlib.Path]
+    """
+    return sorted(Path(directory).glob("shard-*.parquet"))
+
+
+def read_shards(directory: str = EXPORT_DIR) -> Iterator[tuple[np.ndarray, list[tuple]]]:
+    """Parcourt les shards complets d'un export.
+
+    :param str directory: répertoire d'export
+    :return: pour chaque shard, vecteurs mappés en mémoire et lignes
+        ``(id, url, h1)`` dans le même ordre
+    :rtype: Iterator[tuple[numpy.ndarray, list[tuple]]]
+    """
+    for manifest in shard_manifests(directory):
+        vectors = np.load(manifest.with_suffix(".npy"), mmap_mode="r")
+        rows = duckdb.sql(
+            f"SELECT id, url, h1 FROM read_parquet('{manifest}') ORDER BY row"
+        ).fetchall()
+        yield vectors, rows
+
+
+def load_shards(
+    writer: Sink,
+    index: str,
+    directory: str = EXPORT_DIR,
+    chunk_size: int = INDEX_BATCH_INITIAL,
+) -> dict:
+    """Indexe un export dans OpenSearch sans revectoriser.
+
+    Les lots passent par ``writer`` (``BulkWriter``) : requêtes en vol
+    bornées, renvoi avec délai des items refusés temporairement (429, 5xx,
+    erreur réseau). Une requête en échec ne stoppe pas le chargement, ses
+    documents sont comptés non confirmés.
+
+    :param Sink writer: destination des lots
+    :param str index: index (ou alias d'écriture) cible
+    :param str directory: répertoire d'export
+    :param int chunk_size: documents par requête bulk
+    :return: documents indexés, refusés définitivement et non confirmés
+    :rtype: dict
+    """
+    counts = {"indexed": 0, "rejected": 0, "unconfirmed": 0}
+    lock = threading.Lock()
+
+    def on_done(results: list[Optional[bool]]) -> None:
+        with lock:
+            for result in results:
+                if result:
+                    counts["indexed"] += 1
+                elif result is None:
+                    counts["unconfirmed"] += 1
+                else:
+                    counts["rejected"] += 1
+
+    start = time.time()
+    batch = []
+    sent = 0
+    for vectors, rows in read_shards(directory):
+        for vector, (doc_id, url, h1) in zip(vectors, rows):
+            action = {
+                "_index": index,
+                "_source": {"url": url, "h1": h1, "embedding": vector.tolist()},
+            }
+            if doc_id is not None:
+                action["_id"] = doc_id
+            batch.append(action)
+            if len(batch) >= chunk_size:
+                writer.submit(batch, on_done)
+                sent += len(batch)
+                batch = []
+                if sent % 100_000 < chunk_size:
+                    logging.info(f"{sent} documents envoyés en {time.time() - start:.0f}s")
+    if batch:
+        writer.submit(batch, on_done)
+    writer.close()
+    logging.info(
+        f"Export {directory} chargé dans {index} : {counts['indexed']} indexés, "
+        f"{counts['rejected']} refusés, {counts['unconfirmed']} non confirmés "
+        f"en {time.time() - start:.0f}s"
+    )
+    return counts
@@ -0,0 +1,346 @@
+import time
+import argparse
+import logging
+import duckdb
+import faiss
+import numpy as np
+import uvicorn
+from pathlib import Path
+from typing import Optional
+from fastapi import FastAPI
+from pydantic import BaseModel, Field
+from embedding_backend import load_model
+from embedding_sink import shard_manifests
+from config import (
+    ES_DIMS,
+    EXPORT_DIR,
+    FAISS_DIR,
+    FAISS_INDEX_FACTORY,
+    FAISS_SEARCH_PARAMS,
+    FAISS_EF_CONSTRUCTION,
+    FAISS_TRAIN_SIZE,
+    FAISS_HOLDOUT,
+    FAISS_TOP_K,
+    SEARCH_HOST,
+    SEARCH_PORT,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.duckdb"
+HOLDOUT_FILE = "holdout.npy"
+# Vecteurs ajoutés à l'index par appel à ``add``
+ADD_CHUNK = 100_000
+
+
+def load_vectors(directory: str = EXPORT_DIR) -> list[np.ndarray]:
+    """Mappe en mémoire les vecteurs des shards d'un export.
+
+    :param str directory: répertoire d'export (``INDEX_SINK=file``)
+    :return: vecteurs de chaque shard, dans l'ordre des positions de l'index
+    :rtype: list[numpy.ndarray]
+    """
+    return [
+        np.load(manifest.with_suffix(".npy"), mmap_mode="r")
+        for manifest in shard_manifests(directory)
+    ]
+
+
+def sample_vectors(shards: list[np.ndarray], size: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Tire un échantillon uniforme de vecteurs sur l'ensemble des shards.
+
+    :param list[numpy.ndarray] shards: vecteurs de chaque shard
+    :param int size: taille de l'échantillon
+    :param int seed: graine du tirage
+    :return: positions tirées (triées) et vecteurs correspondants
+    :rtype: tuple[numpy.ndarray, numpy.ndarray]
+    """
+    total = sum(len(vectors) for vectors in shards)
+    positions = np.sort(np.random.default_rng(seed).choice(total, min(size, total), replace=False))
+    return positions, gather_vectors(shards, positions)
+
+
+def gather_vectors(shards: list[np.ndarray], positions: np.ndarray) -> np.ndarray:
+    """Lit les vecteurs de l'export à des positions données.
+
+    :param list[numpy.ndarray] shards: vecteurs de chaque shard
+    :param numpy.ndarray positions: positions dans l'export
+    :return: vecteurs correspondants
+    :rtype: numpy.ndarray
+    """
+    offsets = np.cumsum([0] + [len(vectors) for vectors in shards])
+    sample = np.empty((len(positions), ES_DIMS), dtype=np.float32)
+    for shard, vectors in enumerate(shards):
+        mask = (positions >= offsets[shard]) & (positions < offsets[shard + 1])
+        sample[mask] = vectors[positions[mask] - offsets[shard]]
+    return sample
+
+
+def build_index(directory: str = EXPORT_DIR, output: str = FAISS_DIR) -> faiss.Index:
+    """Construit l'index FAISS d'un export et la table de ses documents.
+
+    Le type d'index suit ``FAISS_INDEX_FACTORY`` (``HNSW32``,
+    ``IVF4096,PQ48``, ...) en produit scalaire : les embeddings étant
+    normalisés, le score est la similarité cosinus. Les index à entraîner
+    (IVF, PQ) le sont sur ``FAISS_TRAIN_SIZE`` vecteurs tirés au hasard.
+    ``FAISS_HOLDOUT`` vecteurs tirés au hasard sont exclus de l'index et
+    servent de requêtes au benchmark (``holdout.npy``). L'identifiant d'un
+    vecteur dans l'index est sa position dans l'export, qui renvoie à la
+    colonne ``pos`` de ``docs.duckdb``.
+
+    :param str directory: répertoire d'export
+    :param str output: répertoire de l'index
+    :return: index construit
+    :rtype: faiss.Index
+    """
+    shards = load_vectors(directory)
+    total = sum(len(vectors) for vectors in shards)
+    if not total:
+        raise ValueError(f"Aucun shard complet dans {directory}")
+    base = faiss.index_factory(ES_DIMS, FAISS_INDEX_FACTORY, faiss.METRIC_INNER_PRODUCT)
+    if hasattr(base, "hnsw"):
+        base.hnsw.efConstruction = FAISS_EF_CONSTRUCTION
+    start = time.time()
+    if not base.is_trained:
+        _, sample = sample_vectors(shards, FAISS_TRAIN_SIZE)
+        base.train(sample)
+        logging.info(f"Index entraîné sur {len(sample)} vecteurs en {time.time() - start:.1f}s")
+    # Identifiants explicites : les positions réservées au benchmark manquent
+    index = faiss.IndexIDMap(base)
+    holdout, _ = sample_vectors(shards, min(FAISS_HOLDOUT, total - 1), seed=1)
+    offset = 0
+    for vectors in shards:
+        for chunk in range(0, len(vectors), ADD_CHUNK):
+            ids = np.arange(offset + chunk, offset + min(chunk + ADD_CHUNK, len(vectors)))
+            keep = ~np.isin(ids, holdout)
+            index.add_with_ids(
+                np.ascontiguousarray(vectors[chunk: chunk + ADD_CHUNK][keep], dtype=np.float32),
+                ids[keep],
+            )
+        offset += len(vectors)
+    logging.info(
+        f"{index.ntotal} vecteurs indexés ({FAISS_INDEX_FACTORY}), {len(holdout)} réservés "
+        f"au benchmark, en {time.time() - start:.1f}s"
+    )
+
+    path = Path(output)
+    path.mkdir(parents=True, exist_ok=True)
+    faiss.write_index(index, str(path / INDEX_FILE))
+    np.save(path / HOLDOUT_FILE, holdout)
+    (path / DOCS_FILE).unlink(missing_ok=True)
+    con = duckdb.connect(str(path / DOCS_FILE))
+    con.execute("CREATE TABLE docs (pos BIGINT, id VARCHAR, url VARCHAR, h1 VARCHAR)")
+    offset = 0
+    for manifest, vectors in zip(shard_manifests(directory), shards):
+        con.execute(
+            f"INSERT INTO docs SELECT row + {offset}, id, url, h1 "
+            f"FROM read_parquet('{manifest}') ORDER BY row"
+        )
+        offset += len(vectors)
+    con.close()
+    return index
+
+
+def search_params(factory: str = FAISS_INDEX_FACTORY) -> str:
+    """Paramètres de recherche : ``FAISS_SEARCH_PARAMS`` ou ceux du type d'index.
+
+    :param str factory: chaîne ``index_factory`` de l'index
+    :return: ``nprobe=16`` pour un index IVF, ``efSearch=64`` pour HNSW, sinon vide
+    :rtype: str
+    """
+    if FAISS_SEARCH_PARAMS:
+        return FAISS_SEARCH_PARAMS
+    if "IVF" in factory:
+        return "nprobe=16"
+    if "HNSW" in factory:
+        return "efSearch=64"
+    return ""
+
+
+def open_index(directory: str = FAISS_DIR, params: Optional[str] = None) -> faiss.Index:
+    """Ouvre l'index en lecture seule.
+
+    Avec ``IO_FLAG_MMAP``, seules les listes inversées d'un index IVF sont
+    mappées au lieu d'être chargées, et partagées entre processus ; le graphe
+    et les vecteurs d'un index HNSW sont lus entièrement en mémoire.
+
+    :param str directory: répertoire de l'index
+    :param Optional[str] params: paramètres de recherche (``nprobe=16``,
+        ``efSearch=64``), ``search_params()`` si absent
+    :return: index prêt à interroger
+    :rtype: faiss.Index
+    """
+    index = faiss.read_index(
+        str(Path(directory) / INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    )
+    params = search_params() if params is None else params
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+    return index
+
+
+class SearchRequest(BaseModel):
+    """Requêtes texte cherchées ensemble."""
+
+    queries: list[str] = Field(min_length=1)
+    k: int = Field(FAISS_TOP_K, ge=1)
+
+
+def create_app(directory: str = FAISS_DIR) -> FastAPI:
+    """Application FastAPI de recherche sur l'index FAISS.
+
+    Les requêtes sont encodées par le modèle de ``EMBEDDING_MODEL`` (avec
+    le backend configuré) et normalisées comme les documents.
+
+    :param str directory: répertoire de l'index
+    :return: application prête à servir
+    :rtype: FastAPI
+    """
+    index = open_index(directory)
+    model = load_model("cpu")
+    db = duckdb.connect(str(Path(directory) / DOCS_FILE), read_only=True)
+    logging.info(f"Index {directory} ouvert : {index.ntotal} vecteurs")
+    app = FastAPI()
+
+    @app.post("/search")
+    def search(request: SearchRequest) -> dict:
+        """Retourne les ``k`` documents les plus proches de chaque requête."""
+        start = time.time()
+        embeddings = model.encode(
+            request.queries,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+        scores, positions = index.search(embeddings, request.k)
+        found = [int(pos) for pos in np.unique(positions) if pos >= 0]
+        docs = {}
+        if found:
+            # Connexion DuckDB propre au thread qui sert la requête
+            docs = {
+                pos: {"id": doc_id, "url": url, "h1": h1}
+                for pos, doc_id, url, h1 in db.cursor().execute(
+                    "SELECT pos, id, url, h1 FROM docs WHERE pos IN "
+                    f"({','.join('?' * len(found))})",
+                    found,
+                ).fetchall()
+            }
+        return {
+            "results": [
+                [
+                    {**docs[int(pos)], "score": float(score)}
+                    for pos, score in zip(row_positions, row_scores)
+                    if int(pos) in docs
+                ]
+                for row_positions, row_scores in zip(positions, scores)
+            ],
+            "time": time.time() - start,
+        }
+
+    return app
+
+
+def exact_search(
+    shards: list[np.ndarray], queries: np.ndarray, k: int, exclude: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Recherche exhaustive (produit scalaire) des ``k`` plus proches voisins.
+
+    :param list[numpy.ndarray] shards: vecteurs de chaque shard
+    :param numpy.ndarray queries: vecteurs requêtes
+    :param int k: voisins par requête
+    :param Optional[numpy.ndarray] exclude: positions absentes de l'index
+    :return: positions des voisins, par score décroissant
+    :rtype: numpy.ndarray
+    """
+    exact = faiss.IndexFlatIP(ES_DIMS)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_positions = np.full((len(queries), k), -1, dtype=np.int64)
+    offset = 0
+    for vectors in shards:
+        for chunk in range(0, len(vectors), ADD_CHUNK):
+            ids = np.arange(offset + chunk, offset + min(chunk + ADD_CHUNK, len(vectors)))
+            keep = ~np.isin(ids, exclude if exclude is not None else [])
+            if not keep.any():
+                continue
+            exact.reset()
+            exact.add(np.ascontiguousarray(vectors[chunk: chunk + ADD_CHUNK][keep], dtype=np.float32))
+            scores, positions = exact.search(queries, k)
+            positions = np.where(positions >= 0, ids[keep][positions], -1)
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_positions = np.concatenate([best_positions, positions], axis=1)
+            order = np.argsort(-merged_scores, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, order, axis=1)
+            best_positions = np.take_along_axis(merged_positions, order, axis=1)
+        offset += len(vectors)
+    return best_positions
+
+
+def benchmark(
+    directory: str = EXPORT_DIR,
+    index_dir: str = FAISS_DIR,
+    k: int = FAISS_TOP_K,
+    batch_size: int = 1,
+) -> dict:
+    """Mesure rappel et latence de l'index face à une recherche exhaustive.
+
+    Les requêtes sont les vecteurs réservés à la construction
+    (``FAISS_HOLDOUT``), absents de l'index ; le rappel est la part des
+    ``k`` voisins exacts retrouvés par l'index. Chaque appel de
+    ``batch_size`` requêtes est chronométré séparément : les percentiles
+    portent sur la latence de ces appels.
+
+    :param str directory: répertoire d'export
+    :param str index_dir: répertoire de l'index
+    :param int k: voisins par requête
+    :param int batch_size: requêtes par appel
+    :return: rappel@k, latences par appel (p50, p99) et débit
+    :rtype: dict
+    """
+    shards = load_vectors(directory)
+    index = open_index(index_dir)
+    holdout = np.load(Path(index_dir) / HOLDOUT_FILE)
+    sample = gather_vectors(shards, holdout)
+
+    latencies = []
+    found = []
+    start = time.time()
+    for chunk in range(0, len(sample), batch_size):
+        batch_start = time.perf_counter()
+        _, positions = index.search(sample[chunk: chunk + batch_size], k)
+        latencies.append(time.perf_counter() - batch_start)
+        found.append(positions)
+    elapsed = time.time() - start
+    found = np.concatenate(found)
+
+    expected = exact_search(shards, sample, k, exclude=holdout)
+    recall = np.mean([
+        len(set(row_found) & set(row_expected)) / k
+        for row_found, row_expected in zip(found.tolist(), expected.tolist())
+    ])
+    return {
+        "index": FAISS_INDEX_FACTORY,
+        "params": search_params(),
+        "vectors": index.ntotal,
+        "queries": len(sample),
+        "batch_size": batch_size,
+        f"recall@{k}": float(recall),
+        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "latency_p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "queries_per_s": len(sample) / max(elapsed, 1e-9),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index FAISS local sur un export d'embeddings.")
+    parser.add_argument("command", choices=["build", "serve", "bench"])
+    parser.add_argument("--export", default=EXPORT_DIR, help="répertoire d'export (INDEX_SINK=file)")
+    parser.add_argument("--index", default=FAISS_DIR, help="répertoire de l'index FAISS")
+    parser.add_argument("--batch-size", type=int, default=1, help="requêtes par appel du benchmark")
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(args.export, args.index)
+    elif args.command == "serve":
+        uvicorn.run(create_app(args.index), host=SEARCH_HOST, port=SEARCH_PORT)
+    else:
+        print(benchmark(args.export, args.index, batch_size=args.batch_size))
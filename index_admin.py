@@ -0,0 +1,380 @@
+import time
+import logging
+import threading
+from typing import Callable, Optional
+from opensearchpy import OpenSearch
+from config import (
+    ES_INDEX,
+    ES_DIMS,
+    KNN_ENGINE,
+    KNN_SPACE,
+    KNN_M,
+    KNN_EF_CONSTRUCTION,
+    KNN_EF_SEARCH,
+    INDEX_REPLICAS,
+    INDEX_REFRESH_INTERVAL,
+    INGEST_IDLE_SECONDS,
+    INGEST_FORCE_MERGE_SEGMENTS,
+    INDEX_ROLLOVER,
+    INDEX_GENERATION,
+    INDEX_ROLLOVER_MAX_DOCS,
+    INDEX_ROLLOVER_MAX_SIZE,
+    INDEX_ROLLOVER_CHECK_SECONDS,
+)
+
+# Paramètres appliqués pendant un chargement massif
+INGEST_SETTINGS = {"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+
+# Avec INDEX_ROLLOVER, ES_INDEX est l'alias de lecture de toutes les
+# générations ({ES_INDEX}-[{génération}-]000001, ...) et l'indexer écrit
+# dans l'alias WRITE_ALIAS, qui ne désigne que la génération courante.
+WRITE_ALIAS = f"{ES_INDEX}-write"
+WRITE_INDEX = WRITE_ALIAS if INDEX_ROLLOVER else ES_INDEX
+
+
+def index_body() -> dict:
+    """Réglages et mapping de l'index des embeddings.
+
+    Moteur, espace et paramètres HNSW viennent de la configuration
+    (``KNN_*``).
+
+    :return: corps de la requête de création d'index
+    :rtype: dict
+    """
+    return {
+        "settings": {
+            "index": {
+                "knn": True,
+                "knn.algo_param.ef_search": KNN_EF_SEARCH,
+                "number_of_replicas": INDEX_REPLICAS,
+                "refresh_interval": INDEX_REFRESH_INTERVAL,
+            }
+        },
+        "mappings": {
+            "properties": {
+                "url": {"type": "keyword"},
+                "h1": {"type": "text"},
+                "embedding": {
+                    "type": "knn_vector",
+                    "dimension": ES_DIMS,
+                    "method": {
+                        "name": "hnsw",
+                        "engine": KNN_ENGINE,
+                        "space_type": KNN_SPACE,
+                        "parameters": {
+                            "m": KNN_M,
+                            "ef_construction": KNN_EF_CONSTRUCTION,
+                        },
+                    },
+                }
+            }
+        }
+    }
+
+
+class IngestProfile:
+    """Réglages de chargement massif, appliqués tant que les messages affluent.
+
+    ``start`` coupe le rafraîchissement et les répliques ; après
+    ``idle_seconds`` sans document (ou à l'arrêt), ``finish`` rétablit les
+    réglages de ``config`` puis fusionne les segments si
+    ``INGEST_FORCE_MERGE_SEGMENTS`` est positif. Le profil est réappliqué
+    automatiquement si le flux reprend.
+    """
+
+    def __init__(
+        self, es: OpenSearch, index: str, idle_seconds: float = INGEST_IDLE_SECONDS
+    ) -> None:
+        """Prépare le profil sans modifier l'index.
+
+        :param OpenSearch es: client OpenSearch
+        :param str index: index ou alias d'écriture concerné
+        :param float idle_seconds: inactivité déclenchant ``finish``
+        :return: ``None``
+        :rtype: None
+        """
+        self.es = es
+        self.index = index
+        self.idle_seconds = idle_seconds
+        self.active = False
+        self.current = None   # index concret passé en mode chargement
+        self.last_activity = time.time()
+        self.lock = threading.Lock()
+        self.watcher = threading.Thread(target=self._watch, daemon=True)
+
+    def start(self) -> None:
+        """Passe l'index en mode chargement et lance la surveillance d'inactivité.
+
+        :return: ``None``
+        :rtype: None
+        """
+        self.touch()
+        if not self.watcher.is_alive():
+            self.watcher.start()
+
+    def touch(self) -> None:
+        """Signale l'arrivée de documents et réapplique le profil si besoin.
+
+        :return: ``None``
+        :rtype: None
+        """
+        with self.lock:
+            self.last_activity = time.time()
+            if self.active:
+                return
+            # L'alias d'écriture désigne aussi les anciennes générations
+            self.current = resolve_index(self.es, self.index)
+            self.es.indices.put_settings(index=self.current, body=INGEST_SETTINGS)
+            self.active = True
+        logging.info(f"Profil de chargement appliqué à {self.current}")
+
+    def finish(self) -> None:
+        """Rétablit les réglages de recherche et fusionne les segments.
+
+        :return: ``None``
+        :rtype: None
+        """
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+        restore_settings(self.es, self.current)
+
+    def rolled_over(self, old_index: str) -> None:
+        """Clôt le chargement d'une génération remplacée par un rollover.
+
+        Les réglages de recherche (et le force-merge) sont appliqués à
+        l'ancienne génération ; le profil sera réappliqué à la nouvelle au
+        prochain ``touch``.
+
+        :param str old_index: génération qui ne reçoit plus d'écritures
+        :return: ``None``
+        :rtype: None
+        """
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+        restore_settings(self.es, old_index)
+
+    def _watch(self) -> None:
+        """Termine le profil quand aucun document n'arrive pendant ``idle_seconds``.
+
+        :return: ``None``
+        :rtype: None
+        """
+        while True:
+            time.sleep(max(self.idle_seconds / 4, 1))
+            if self.active and time.time() - self.last_activity > self.idle_seconds:
+                logging.info(f"File inactive depuis {self.idle_seconds}s, fin du chargement")
+                try:
+                    self.finish()
+                except Exception as e:
+                    logging.error(f"Erreur en fin de chargement de {self.index}: {e!r}")
+
+
+def resolve_index(es: OpenSearch, index: str) -> str:
+    """Index concret visé par un nom d'index ou par l'alias d'écriture.
+
+    Après un rollover, les anciennes générations gardent l'alias d'écriture
+    (``is_write_index: false``) : réglages, refresh et force-merge doivent
+    viser la seule génération courante.
+
+    :param OpenSearch es: client OpenSearch
+    :param str index: index ou ``WRITE_ALIAS``
+    :return: nom de l'index concret
+    :rtype: str
+    :raises ValueError: si l'alias d'écriture n'existe pas
+    """
+    if index != WRITE_ALIAS:
+        return index
+    current = write_index(es)
+    if current is None:
+        raise ValueError(f"L'alias {WRITE_ALIAS} ne désigne aucun index")
+    return current
+
+
+def restore_settings(es: OpenSearch, index: str) -> None:
+    """Rétablit rafraîchissement et répliques, puis fusionne les segments.
+
+    Utilisable seul (``--finish-ingest``) après un arrêt brutal en mode
+    chargement.
+
+    :param OpenSearch es: client OpenSearch
+    :param str index: index ou alias d'écriture (résolu en génération courante)
+    :return: ``None``
+    :rtype: None
+    """
+    index = resolve_index(es, index)
+    es.indices.put_settings(index=index, body={"index": {
+        "refresh_interval": INDEX_REFRESH_INTERVAL,
+        "number_of_replicas": INDEX_REPLICAS,
+    }})
+    es.indices.refresh(index=index)
+    logging.info(f"Réglages de recherche rétablis sur {index}")
+    if INGEST_FORCE_MERGE_SEGMENTS > 0:
+        start = time.time()
+        es.indices.forcemerge(
+            index=index,
+            max_num_segments=INGEST_FORCE_MERGE_SEGMENTS,
+            request_timeout=3600,
+        )
+        logging.info(f"Force-merge de {index} terminé en {time.time() - start:.1f}s")
+
+
+def generation_prefix(generation: str = INDEX_GENERATION) -> str:
+    """Préfixe des index d'une génération.
+
+    :param str generation: identifiant de génération (crawl), vide par défaut
+    :return: préfixe commun des index de la génération
+    :rtype: str
+    """
+    if not generation:
+        return f"{ES_INDEX}-"
+    return f"{ES_INDEX}-{generation.lower()}-"
+
+
+def rollover_conditions() -> dict:
+    """Conditions de rollover configurées.
+
+    :return: conditions ``max_docs`` et ``max_size`` non désactivées
+    :rtype: dict
+    """
+    conditions = {}
+    if INDEX_ROLLOVER_MAX_DOCS > 0:
+        conditions["max_docs"] = INDEX_ROLLOVER_MAX_DOCS
+    if INDEX_ROLLOVER_MAX_SIZE:
+        conditions["max_size"] = INDEX_ROLLOVER_MAX_SIZE
+    return conditions
+
+
+def write_index(es: OpenSearch) -> Optional[str]:
+    """Génération désignée par l'alias d'écriture.
+
+    :param OpenSearch es: client OpenSearch
+    :return: nom de l'index courant, ``None`` si l'alias n'existe pas encore
+    :rtype: Optional[str]
+    """
+    if not es.indices.exists_alias(name=WRITE_ALIAS):
+        return None
+    for index, info in es.indices.get_alias(name=WRITE_ALIAS).items():
+        if info["aliases"][WRITE_ALIAS].get("is_write_index", True):
+            return index
+    return None
+
+
+def setup_generations(es: OpenSearch) -> None:
+    """Prépare le modèle d'index, l'alias de lecture et l'alias d'écriture.
+
+    Chaque index ``{ES_INDEX}-*`` reçoit le mapping k-NN et rejoint l'alias
+    de lecture ``ES_INDEX`` dès sa création. Si ``INDEX_GENERATION`` change
+    (nouveau crawl), l'alias d'écriture bascule immédiatement sur la
+    première génération de ce crawl.
+
+    :param OpenSearch es: client OpenSearch
+    :return: ``None``
+    :rtype: None
+    :raises ValueError: si un index ``ES_INDEX`` (non alias) existe déjà
+    """
+    if es.indices.exists(index=ES_INDEX) and not es.indices.exists_alias(name=ES_INDEX):
+        raise ValueError(
+            f"{ES_INDEX} est un index : l'alias de lecture ne peut pas porter ce nom, "
+            "changer ES_INDEX ou réindexer avant d'activer INDEX_ROLLOVER"
+        )
+    body = index_body()
+    es.indices.put_index_template(name=ES_INDEX, body={
+        "index_patterns": [f"{ES_INDEX}-*"],
+        "template": {**body, "aliases": {ES_INDEX: {}}},
+    })
+    first = f"{generation_prefix()}000001"
+    current = write_index(es)
+    if current is None:
+        es.indices.create(index=first, body={"aliases": {WRITE_ALIAS: {"is_write_index": True}}})
+        logging.info(f"Génération {first} créée, écriture via {WRITE_ALIAS}")
+    elif INDEX_GENERATION and not current.startswith(generation_prefix()):
+        es.indices.rollover(alias=WRITE_ALIAS, new_index=first)
+        logging.info(f"Nouvelle génération {first} (précédente : {current})")
+
+
+def drop_generation(es: OpenSearch, generation: str) -> list[str]:
+    """Supprime tous les index d'une génération (ancien crawl).
+
+    :param OpenSearch es: client OpenSearch
+    :param str generation: identifiant de génération
+    :return: index supprimés
+    :rtype: list[str]
+    :raises ValueError: si la génération reçoit encore les écritures
+    """
+    prefix = generation_prefix(generation)
+    current = write_index(es)
+    if current is not None and current.startswith(prefix):
+        raise ValueError(f"La génération {generation} reçoit encore les écritures ({current})")
+    indices = list(es.indices.get(index=f"{prefix}*", ignore_unavailable=True))
+    # Une génération vide ne doit pas englober les générations nommées
+    indices = [index for index in indices if index[len(prefix):].isdigit()]
+    if indices:
+        es.indices.delete(index=",".join(indices))
+    logging.info(f"Génération {generation or '(défaut)'} supprimée : {indices}")
+    return indices
+
+
+class RolloverWatcher(threading.Thread):
+    """Vérifie périodiquement les conditions de rollover de l'alias d'écriture.
+
+    La génération courante est rafraîchie avant chaque vérification de
+    ``max_docs``, y compris en mode chargement (``refresh_interval: -1``) :
+    un refresh toutes les ``interval`` secondes reste négligeable.
+    """
+
+    def __init__(
+        self,
+        es: OpenSearch,
+        on_rollover: Optional[Callable[[str], None]] = None,
+        interval: float = INDEX_ROLLOVER_CHECK_SECONDS,
+    ) -> None:
+        """Prépare la surveillance sans la démarrer.
+
+        :param OpenSearch es: client OpenSearch
+        :param Optional[Callable] on_rollover: reçoit le nom de la génération remplacée
+        :param float interval: délai entre deux vérifications (secondes)
+        :return: ``None``
+        :rtype: None
+        """
+        super().__init__(name="rollover", daemon=True)
+        self.es = es
+        self.on_rollover = on_rollover
+        self.interval = interval
+
+    def check(self) -> Optional[str]:
+        """Bascule l'alias d'écriture si une condition est atteinte.
+
+        :return: génération remplacée, ``None`` sans rollover
+        :rtype: Optional[str]
+        """
+        conditions = rollover_conditions()
+        if not conditions:
+            return None
+        if "max_docs" in conditions:
+            # max_docs ne compte que les documents rafraîchis : sans ce refresh,
+            # la condition ne se déclencherait jamais avec --ingest (refresh -1)
+            self.es.indices.refresh(index=resolve_index(self.es, WRITE_ALIAS))
+        response = self.es.indices.rollover(alias=WRITE_ALIAS, body={"conditions": conditions})
+        if not response.get("rolled_over"):
+            return None
+        logging.info(f"Rollover {response['old_index']} -> {response['new_index']}")
+        if self.on_rollover:
+            self.on_rollover(response["old_index"])
+        return response["old_index"]
+
+    def run(self) -> None:
+        """Vérifie les conditions toutes les ``interval`` secondes.
+
+        :return: ``None``
+        :rtype: None
+        """
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Erreur de rollover de {WRITE_ALIAS}: {e!r}")
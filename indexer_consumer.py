@@ -1,22 +1,52 @@
-import json
 import time
+import argparse
+import hashlib
 import logging
 import threading
-import pika
-from opensearchpy import OpenSearch, helpers
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from opensearchpy import OpenSearch
 from logger import logger
+from rabbit import RabbitConnectionManager
+from codec import decode_embedding_message
+from bulk_writer import BulkWriter, AdaptiveBatchSize
+from embedding_sink import Sink, FileSink, load_shards
+from index_admin import (
+    IngestProfile,
+    RolloverWatcher,
+    WRITE_INDEX,
+    index_body,
+    restore_settings,
+    setup_generations,
+    drop_generation,
+)
+from aio_consumer import AsyncConsumer, Delivery, run as run_async
 from config import (
-    RABBITMQ_HOST, INDEXING_QUEUE,
-    ES_HOSTS, ES_INDEX, ES_DIMS,
-    RABBITMQ_RETRY_DELAY, RABBITMQ_USER,
-    RABBITMQ_PASSWORD,
+    INDEXING_QUEUE,
+    ES_HOSTS, ES_INDEX,
+    INDEX_ID_MODE, INDEX_DEDUP_SIZE,
+    INDEX_ROLLOVER,
+    INDEX_SINK,
+    RABBITMQ_RETRY_DELAY,
+    ASYNC_RUNTIME,
+    ASYNC_CONCURRENCY,
+    BULK_CONCURRENCY,
+    INDEX_BATCH_MAX,
+    INDEX_BATCH_MAX_BYTES,
+    INDEX_LINGER_MS,
     MACHINE
 )
 
 # ------------------------------------
-# Ajuste ici la taille de ton batch.
-# 100, 1000 ou plus : un batch plus grand réduit la surcharge par message.
-BATCH_SIZE = 1000
+# Un lot part au premier seuil atteint : nombre de documents (adapté par
+# AdaptiveBatchSize entre INDEX_BATCH_MIN et INDEX_BATCH_MAX), taille en
+# octets (INDEX_BATCH_MAX_BYTES) ou attente maximale (INDEX_LINGER_MS).
+LINGER = INDEX_LINGER_MS / 1000
+# Attente avant de retenter un lot quand toutes les requêtes bulk sont en vol
+SLOT_RETRY = 0.05
+# Limite AMQP du prefetch_count (entier 16 bits)
+MAX_PREFETCH = 65535
 # ------------------------------------
 
 logging.basicConfig(
@@ -26,9 +56,11 @@ logging.basicConfig(
 
 time_es_connection = 0
 time_indexation = 0
-time_rabbitmq_connection = 0
 time_indexation_lock = threading.Lock()
 
+# Connexion de consommation longue durée
+rabbit = RabbitConnectionManager()
+
 
 def get_es_connection() -> OpenSearch:
     """Ouvre une connexion au cluster OpenSearch.
@@ -65,114 +97,421 @@ def get_es_connection() -> OpenSearch:
 def create_index(es: OpenSearch) -> None:
     """Crée l'index OpenSearch s'il n'existe pas.
 
+    Paramètres k-NN et réglages de recherche : voir ``index_admin.index_body``.
+    Avec ``INDEX_ROLLOVER``, prépare plutôt les générations et leurs alias.
+
     :param OpenSearch es: client OpenSearch prêt à l'emploi
     :return: ``None``
     :rtype: None
     """
+    if INDEX_ROLLOVER:
+        setup_generations(es)
+        return
     if not es.indices.exists(index=ES_INDEX):
-        mapping = {
-            "settings": {
-                "index": {
-                    "knn": True,
-                    "knn.algo_param.ef_search": 512,
-                    "knn.algo_param.ef_construction": 512,
-                    "knn.algo_param.m": 16
-                }
-            },
-            "mappings": {
-                "properties": {
-                    "url": {"type": "keyword"},
-                    "h1": {"type": "text"},
-                    "embedding": {
-                        "type": "knn_vector",
-                        "dimension": ES_DIMS
-                    }
-                }
-            }
-        }
         try:
-            es.indices.create(index=ES_INDEX, body=mapping)
+            es.indices.create(index=ES_INDEX, body=index_body())
             logging.info(f"Index {ES_INDEX} créé.")
         except Exception as e:
             logging.error(f"Erreur création index {ES_INDEX}: {e}")
 
 
-def get_rabbit_connection() -> pika.BlockingConnection:
-    """Retourne une connexion RabbitMQ.
+def normalize_url(url: str) -> str:
+    """Normalise une URL pour que ses variantes donnent le même identifiant.
+
+    Schéma et hôte en minuscules, port par défaut, fragment et paramètres de
+    suivi (``utm_*``) retirés, paramètres de requête triés. Une URL
+    malformée (port invalide) est conservée telle quelle.
 
-    :return: connexion ouverte
-    :rtype: pika.BlockingConnection
+    :param str url: URL de la page
+    :return: URL normalisée
+    :rtype: str
     """
-    global time_rabbitmq_connection
-    start = time.time()
-    while True:
-        try:
-            creds = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            conn = pika.BlockingConnection(
-                pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=creds)
-            )
-            time_rabbitmq_connection = time.time() - start
-            logging.info(
-                f"Connecté à RabbitMQ en {time_rabbitmq_connection:.3f}s"
-            )
-            return conn
-        except Exception as e:
-            logging.error(
-                f"Erreur connexion RabbitMQ: {e}. "
-                f"Nouvel essai dans {RABBITMQ_RETRY_DELAY}s."
-            )
-            time.sleep(RABBITMQ_RETRY_DELAY)
+    parts = urlsplit(url.strip())
+    try:
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        # Adresse IPv6 : hostname retire les crochets
+        host = f"[{host}]"
+    if port and (scheme, port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{port}"
+    query = urlencode(sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_")
+    ))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def document_id(msg: dict) -> Optional[str]:
+    """Identifiant déterministe d'un document selon ``INDEX_ID_MODE``.
+
+    :param dict msg: message décodé (url, content_hash, ...)
+    :return: empreinte de l'URL normalisée (et du contenu en mode
+        ``url+content`` quand le message porte ``content_hash``), ``None``
+        en mode ``none``
+    :rtype: Optional[str]
+    """
+    if INDEX_ID_MODE == "none":
+        return None
+    key = normalize_url(msg["url"])
+    if INDEX_ID_MODE == "url+content" and msg.get("content_hash"):
+        key = f"{key}\0{msg['content_hash']}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def build_action(msg: dict) -> dict:
+    """Construit l'action bulk d'un message d'indexation.
+
+    En mode ``url``, une nouvelle version d'une page remplace l'ancienne
+    (``index``) ; en mode ``url+content``, l'identifiant change avec le
+    contenu et un contenu déjà indexé est ignoré par le cluster (``create``).
+    Un message sans ``content_hash`` (producteur antérieur) est traité comme
+    en mode ``url``. Avec ``INDEX_ROLLOVER``, ce remplacement se limite à la génération
+    courante.
+
+    :param dict msg: message décodé (url, h1, embedding)
+    :return: action pour ``helpers.bulk``
+    :rtype: dict
+    """
+    action = {
+        "_index": WRITE_INDEX,
+        "_source": {
+            "url": msg["url"],
+            "h1": msg["h1"],
+            "embedding": msg["embedding"]
+        }
+    }
+    doc_id = document_id(msg)
+    if doc_id is not None:
+        action["_id"] = doc_id
+        create = INDEX_ID_MODE == "url+content" and bool(msg.get("content_hash"))
+        action["_op_type"] = "create" if create else "index"
+    return action
+
+
+def dedup_key(action: dict, msg: dict) -> Optional[str]:
+    """Clé de déduplication locale d'un document.
+
+    :param dict action: action bulk construite par ``build_action``
+    :param dict msg: message décodé
+    :return: identifiant et empreinte du contenu, ``None`` sans identifiant
+        ou sans empreinte (le contenu a pu changer)
+    :rtype: Optional[str]
+    """
+    if "_id" not in action or not msg.get("content_hash"):
+        return None
+    return f"{action['_id']}:{msg.get('content_hash', '')}"
 
 
-def background_bulk(
-    es_client: OpenSearch, docs: list[dict], batch_size: int
-) -> None:
-    """Indexe un lot de documents dans un thread séparé.
+class RecentIds:
+    """Documents indexés récemment (LRU), pour ne pas renvoyer les doublons."""
 
-    :param OpenSearch es_client: client OpenSearch destiné à l'indexation
-    :param list docs: documents à indexer
-    :param int batch_size: taille effective du lot
+    def __init__(self, size: int = INDEX_DEDUP_SIZE) -> None:
+        """Prépare le LRU.
+
+        :param int size: nombre maximal de clés conservées (0 : désactivé)
+        :return: ``None``
+        :rtype: None
+        """
+        self.size = size
+        self.keys: OrderedDict[str, None] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def seen(self, key: Optional[str]) -> bool:
+        """Indique si un document identique a déjà été indexé.
+
+        :param Optional[str] key: clé de déduplication
+        :return: ``True`` si la clé est connue
+        :rtype: bool
+        """
+        if key is None or self.size <= 0:
+            return False
+        with self.lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key: Optional[str]) -> None:
+        """Mémorise un document confirmé par OpenSearch.
+
+        :param Optional[str] key: clé de déduplication
+        :return: ``None``
+        :rtype: None
+        """
+        if key is None or self.size <= 0:
+            return
+        with self.lock:
+            self.keys[key] = None
+            self.keys.move_to_end(key)
+            while len(self.keys) > self.size:
+                self.keys.popitem(last=False)
+
+
+# Documents confirmés récemment (redélivrances, pages recrawlées inchangées)
+recent_ids = RecentIds()
+
+
+def create_sink(es: Optional[OpenSearch], on_batch) -> Sink:
+    """Crée la destination des lots selon ``INDEX_SINK``.
+
+    :param Optional[OpenSearch] es: client OpenSearch (inutile pour ``file``)
+    :param on_batch: reçoit les statistiques de chaque lot
+    :return: ``BulkWriter`` (``opensearch``) ou ``FileSink`` (``file``)
+    :rtype: Sink
+    :raises ValueError: si ``INDEX_SINK`` est inconnu
+    """
+    if INDEX_SINK == "opensearch":
+        return BulkWriter(es, on_batch=on_batch)
+    if INDEX_SINK == "file":
+        return FileSink(on_batch=on_batch)
+    raise ValueError(f"INDEX_SINK inconnu : {INDEX_SINK}")
+
+
+def log_batch(stats: dict, step: str) -> None:
+    """Publie les métriques d'un lot indexé.
+
+    :param dict stats: statistiques fournies par ``BulkWriter.write``
+    :param str step: nom de l'étape dans les métriques
     :return: ``None``
     :rtype: None
     """
     global time_indexation
-    start_batch = time.time()
+    # Met à jour de façon thread-safe le temps d'indexation cumulé
+    with time_indexation_lock:
+        time_indexation += stats["batch_time"]
+        cumulative_time = time_indexation
+
+    data = {
+        "step": step,
+        **stats,
+        "cumulative_index_time": cumulative_time,
+        "time_rabbitmq_connection": rabbit.connect_time,
+        "time_es_connection": time_es_connection,
+        "machine": MACHINE
+    }
+    logger(data)
+    logging.info(
+        f"Batch de {stats['batchsize']} docs indexé en {stats['batch_time']:.3f}s "
+        f"({stats['rejected']} refusés, {stats['unconfirmed']} non confirmés)"
+    )
+
+
+def settle(delivery, result: Optional[bool], key: Optional[str] = None) -> None:
+    """Acquitte un message selon le résultat OpenSearch de son document.
+
+    :param delivery: message à acquitter (``Delivery`` ou équivalent)
+    :param Optional[bool] result: ``True`` indexé, ``False`` refusé
+        définitivement, ``None`` non confirmé
+    :param Optional[str] key: clé de déduplication du document
+    :return: ``None``
+    :rtype: None
+    """
+    if result:
+        recent_ids.add(key)
+        delivery.ack()
+    else:
+        # Un refus définitif (mapping, document invalide) n'est pas remis en file
+        delivery.nack(requeue=result is None)
+
+
+def main_async(es: Optional[OpenSearch], profile: Optional[IngestProfile] = None) -> None:
+    """Consomme et indexe avec le runtime asyncio.
+
+    Plusieurs requêtes bulk sont en vol (``ASYNC_CONCURRENCY``) et chaque
+    message n'est acquitté qu'après la confirmation de son document par
+    OpenSearch.
+
+    :param Optional[OpenSearch] es: client OpenSearch (``None`` pour ``INDEX_SINK=file``)
+    :param Optional[IngestProfile] profile: profil de chargement massif
+    :return: ``None``
+    :rtype: None
+    """
+    batch_size = AdaptiveBatchSize()
+
+    def on_batch(stats: dict) -> None:
+        log_batch(stats, "index_batch_async")
+        batch_size.update(stats)
+
+    writer = create_sink(es, on_batch)
+
+    async def handle(consumer: AsyncConsumer, deliveries: list[Delivery]) -> None:
+        docs, keys, pending = [], [], []
+        for delivery in deliveries:
+            try:
+                msg = decode_embedding_message(delivery.body, delivery.properties)
+                action = build_action(msg)
+                key = dedup_key(action, msg)
+            except (ValueError, KeyError, TypeError) as e:
+                # Message invalide : il échouerait à chaque relivraison
+                logging.error(f"Message d'indexation rejeté: {e!r}")
+                delivery.nack(requeue=False)
+                continue
+            if recent_ids.seen(key):
+                # Doublon déjà confirmé : inutile de l'envoyer au cluster
+                delivery.ack()
+                continue
+            docs.append(action)
+            keys.append(key)
+            pending.append(delivery)
+        if not docs:
+            return
+        if profile is not None:
+            await consumer.run_blocking(profile.touch)
+        results = await consumer.run_blocking(writer.write, docs)
+        for delivery, result, key in zip(pending, results, keys):
+            settle(delivery, result, key)
+        # Les lots suivants suivent la taille ajustée
+        consumer.batch_size = batch_size.size
+
     try:
-        helpers.bulk(es_client, docs)
-        batch_time = time.time() - start_batch
-
-        # Met à jour de façon thread-safe le temps d'indexation cumulé
-        with time_indexation_lock:
-            time_indexation += batch_time
-            cumulative_time = time_indexation
-
-        data = {
-            "step": "index_batch_async",
-            "batchsize": batch_size,
-            "batch_time": batch_time,
-            "cumulative_index_time": cumulative_time,
-            "time_rabbitmq_connection": time_rabbitmq_connection,
-            "time_es_connection": time_es_connection,
-            "machine": MACHINE
-        }
-        logger(data)
-        logging.info(f"Batch async de {batch_size} docs indexé en {batch_time:.3f}s")
-    except Exception as e:
-        logging.error(f"Erreur bulk async: {e}")
-        # Ici, les documents sont déjà ackés, donc ils sont perdus en cas d'erreur.
+        run_async(
+            AsyncConsumer(
+                INDEXING_QUEUE,
+                handle,
+                batch_size=batch_size.size,
+                batch_timeout=LINGER,
+                batch_bytes=INDEX_BATCH_MAX_BYTES,
+                prefetch_count=min(ASYNC_CONCURRENCY * INDEX_BATCH_MAX, MAX_PREFETCH),
+            )
+        )
+    finally:
+        writer.close()
+
+
+class PikaDelivery:
+    """Message reçu par le consumer bloquant, acquitté depuis le thread pika."""
+
+    def __init__(self, channel, delivery_tag: int) -> None:
+        """Conserve le canal de réception et l'étiquette du message.
 
+        :param channel: canal pika de consommation
+        :param int delivery_tag: étiquette de livraison
+        :return: ``None``
+        :rtype: None
+        """
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+
+    def ack(self) -> None:
+        """Acquitte le message si son canal est toujours ouvert."""
+        if self.channel.is_open:
+            self.channel.basic_ack(delivery_tag=self.delivery_tag)
+
+    def nack(self, requeue: bool = True) -> None:
+        """Rejette le message si son canal est toujours ouvert."""
+        if self.channel.is_open:
+            self.channel.basic_nack(delivery_tag=self.delivery_tag, requeue=requeue)
 
-def main() -> None:
+
+def main(ingest: bool = False) -> None:
     """Consomme les messages de vecteurs et les indexe par lots.
 
+    Au plus ``BULK_CONCURRENCY`` requêtes bulk sont en vol ; le
+    ``prefetch_count``, recalculé quand la taille de lot change, limite les
+    messages non acquittés à ce nombre de lots, si bien que le broker cesse
+    de livrer quand OpenSearch ralentit. Un lot (incomplet après
+    ``INDEX_LINGER_MS`` ou limité en octets) qui ne trouve aucune requête
+    libre reste en attente et est retenté après ``SLOT_RETRY`` : le thread
+    pika ne bloque jamais et continue de servir les heartbeats. Chaque
+    message est acquitté après la confirmation de son document.
+
+    En mode chargement massif (``ingest``), le rafraîchissement et les
+    répliques sont coupés tant que des documents arrivent, puis rétablis
+    après ``INGEST_IDLE_SECONDS`` d'inactivité ou à l'arrêt.
+
+    Avec ``INDEX_SINK=file``, les documents sont écrits dans ``EXPORT_DIR``
+    sans connexion à OpenSearch.
+
+    :param bool ingest: applique le profil de chargement massif
     :return: ``None``
     :rtype: None
     """
-    es = get_es_connection()
-    create_index(es)
+    es = None
+    profile = None
+    if INDEX_SINK == "opensearch":
+        es = get_es_connection()
+        create_index(es)
+        profile = IngestProfile(es, WRITE_INDEX) if ingest else None
+        if profile is not None:
+            profile.start()
+        if INDEX_ROLLOVER:
+            RolloverWatcher(es, profile.rolled_over if profile else None).start()
+    if ASYNC_RUNTIME:
+        try:
+            main_async(es, profile)
+        finally:
+            if profile is not None:
+                profile.finish()
+        return
+
+    batch_size = AdaptiveBatchSize()
+
+    def on_batch(stats: dict) -> None:
+        log_batch(stats, "index_batch")
+        batch_size.update(stats)
 
+    writer = create_sink(es, on_batch)
     actions = []
-    delivery_tags = []
+    deliveries = []
+    keys = []
+    batch_bytes = 0
+    timer = None      # flush planifié après INDEX_LINGER_MS
+    prefetch = None   # prefetch_count appliqué au canal
+
+    def prefetch_count() -> int:
+        """Messages non acquittés autorisés pour la taille de lot courante."""
+        return min(batch_size.size * BULK_CONCURRENCY, MAX_PREFETCH)
+
+    def flush(wait: bool = False) -> None:
+        """Confie le lot courant au writer ; les acquittements reviennent au thread pika.
+
+        :param bool wait: attend une requête libre (arrêt) au lieu de retenter plus tard
+        """
+        nonlocal batch_bytes, timer, prefetch
+        connection = rabbit.connection("consume")
+        if timer is not None:
+            connection.remove_timeout(timer)
+            timer = None
+        if not actions:
+            return
+        docs = actions.copy()
+        batch = deliveries.copy()
+        batch_keys = keys.copy()
+
+        def on_done(results: list[Optional[bool]]) -> None:
+            def settle_batch() -> None:
+                for delivery, result, key in zip(batch, results, batch_keys):
+                    settle(delivery, result, key)
+            try:
+                connection.add_callback_threadsafe(settle_batch)
+            except Exception as e:
+                # Connexion perdue : les messages seront relivrés
+                logging.warning(f"Acquittement impossible de {len(batch)} messages: {e!r}")
+
+        if wait:
+            writer.submit(docs, on_done)
+        elif not writer.try_submit(docs, on_done):
+            # Toutes les requêtes sont en vol : le lot reste en attente
+            timer = connection.call_later(SLOT_RETRY, on_linger)
+            return
+        actions.clear()
+        deliveries.clear()
+        keys.clear()
+        batch_bytes = 0
+        if prefetch != prefetch_count():
+            prefetch = prefetch_count()
+            rabbit.channel("consume").basic_qos(prefetch_count=prefetch)
+
+    def on_linger() -> None:
+        """Envoie un lot incomplet après ``INDEX_LINGER_MS``."""
+        nonlocal timer
+        timer = None
+        flush()
 
     def callback(ch, method, properties, body):
         """Traite un message d'indexation.
@@ -182,88 +521,105 @@ def main() -> None:
         :param properties: propriétés AMQP
         :param body: message JSON encodé
         """
-
-        nonlocal actions, delivery_tags
-
+        nonlocal batch_bytes, timer
         try:
-            msg = json.loads(body)
-            action = {
-                "_index": ES_INDEX,
-                "_source": {
-                    "url": msg["url"],
-                    "h1": msg["h1"],
-                    "embedding": msg["embedding"]
-                }
-            }
+            msg = decode_embedding_message(body, properties)
+            action = build_action(msg)
+            key = dedup_key(action, msg)
+            if recent_ids.seen(key):
+                # Doublon déjà confirmé : inutile de l'envoyer au cluster
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            if profile is not None:
+                profile.touch()
             actions.append(action)
-            delivery_tags.append(method.delivery_tag)
-
-            if len(actions) >= BATCH_SIZE:
-                # Snapshot du batch à envoyer
-                docs_to_send = actions.copy()
-                batch_count = len(docs_to_send)
-
-                # Récupère le dernier delivery_tag
-                last_tag = delivery_tags[-1]
-
-                # Réinitialisation immédiate avant de lancer l'index async
-                actions.clear()
-                delivery_tags.clear()
-
-                # Ack multiple pour libérer RabbitMQ
-                ch.basic_ack(delivery_tag=last_tag, multiple=True)
-
-                # Lancer le bulk en arrière-plan
-                thread = threading.Thread(
-                    target=background_bulk,
-                    args=(es, docs_to_send, batch_count),
-                    daemon=True
-                )
-                thread.start()
-
+            keys.append(key)
+            deliveries.append(PikaDelivery(ch, method.delivery_tag))
+            batch_bytes += len(body)
         except Exception as e:
+            # Message invalide : il échouerait à chaque relivraison
             logging.error(f"Erreur traitement message: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
-    connection = get_rabbit_connection()
-    channel = connection.channel()
-    channel.queue_declare(queue=INDEXING_QUEUE, durable=True)
-    channel.basic_qos(prefetch_count=BATCH_SIZE)
-    channel.basic_consume(queue=INDEXING_QUEUE, on_message_callback=callback)
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+
+        if len(actions) >= batch_size.size or batch_bytes >= INDEX_BATCH_MAX_BYTES:
+            flush()
+        elif timer is None:
+            timer = rabbit.connection("consume").call_later(LINGER, on_linger)
+
+    def on_reconnect():
+        """Oublie les messages de l'ancien canal, qui seront relivrés."""
+        nonlocal batch_bytes, timer, prefetch
+        actions.clear()
+        deliveries.clear()
+        keys.clear()
+        batch_bytes = 0
+        timer = None
+        prefetch = None
 
     logging.info("Consumer en attente de messages...")
     try:
-        channel.start_consuming()
+        rabbit.consume(
+            INDEXING_QUEUE,
+            callback,
+            prefetch_count=prefetch_count(),
+            on_reconnect=on_reconnect,
+        )
 
     except KeyboardInterrupt:
         logging.info("Interruption manuelle, arrêt du consumer.")
 
     finally:
-        # Flush final pour les messages restants (< BATCH_SIZE)
-        if actions:
-            docs_to_send = actions.copy()
-            batch_count = len(docs_to_send)
-            last_tag = delivery_tags[-1]
-
-            # Ack avant le flush final
-            channel.basic_ack(delivery_tag=last_tag, multiple=True)
-            actions.clear()
-            delivery_tags.clear()
-
-            # Lancer le flush final en arrière-plan
-            thread = threading.Thread(
-                target=background_bulk,
-                args=(es, docs_to_send, batch_count),
-                daemon=True
-            )
-            thread.start()
-
-            # Attendre brièvement que le thread démarre (optionnel)
-            time.sleep(0.1)
-
-        channel.stop_consuming()
-        connection.close()
+        # Flush final des messages restants (lot incomplet), puis attente des
+        # requêtes en vol et envoi de leurs acquittements
+        try:
+            connection = rabbit.connections.get("consume")
+            alive = connection is not None and connection.is_open
+            if alive:
+                flush(wait=True)
+            writer.close()
+            if alive:
+                connection.process_data_events(time_limit=0)
+        except Exception as e:
+            logging.error(f"Erreur lors du flush final: {e!r}")
+        rabbit.close()
+        if profile is not None:
+            profile.finish()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Indexe les embeddings dans OpenSearch.")
+    parser.add_argument(
+        "--ingest", action="store_true",
+        help="coupe refresh et répliques pendant le chargement, rétablis quand la file est inactive",
+    )
+    parser.add_argument(
+        "--finish-ingest", action="store_true",
+        help="rétablit les réglages de recherche (et force-merge) puis quitte",
+    )
+    parser.add_argument(
+        "--load-export", metavar="DIRECTORY",
+        help="indexe un export INDEX_SINK=file (avec --ingest si demandé) puis quitte",
+    )
+    parser.add_argument(
+        "--drop-generation", metavar="GENERATION",
+        help="supprime les index d'une ancienne génération (INDEX_ROLLOVER) puis quitte",
+    )
+    args = parser.parse_args()
+    if args.drop_generation is not None:
+        drop_generation(get_es_connection(), args.drop_generation)
+    elif args.load_export is not None:
+        es = get_es_connection()
+        create_index(es)
+        profile = IngestProfile(es, WRITE_INDEX) if args.ingest else None
+        if profile is not None:
+            profile.start()
+        try:
+            load_shards(BulkWriter(es), WRITE_INDEX, args.load_export)
+        finally:
+            if profile is not None:
+                profile.finish()
+    elif args.finish_ingest:
+        restore_settings(get_es_connection(), WRITE_INDEX)
+    else:
+        main(ingest=args.ingest)
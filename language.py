@@ -0,0 +1,221 @@
+import re
+import sys
+from typing import Iterable, Optional, Tuple
+from langdetect import DetectorFactory, detect_langs
+from config import (
+    LANGID_BACKEND,
+    LANGID_MAX_CHARS,
+    LANGID_MIN_CONFIDENCE,
+    LANGID_FASTTEXT_MODEL,
+    LANGID_STOPWORDS_PREFILTER,
+)
+
+# langdetect est aléatoire tant que sa graine n'est pas fixée
+DetectorFactory.seed = 0
+
+WORD_RE = re.compile(r"[^\W\d_]+")
+
+# Mots-outils les plus fréquents par langue. Ce n'est pas un identifiant de
+# langue (le polonais ou le latin y sont mal classés) : il ne sert qu'à
+# écarter plus vite un texte nettement dans une autre langue que la cible.
+STOPWORDS = {
+    "fr": frozenset(
+        "le la les un une des du de et est en que qui dans pour pas sur au aux "
+        "avec ce cette ces il elle ils nous vous sont ont mais ou où par plus "
+        "son sa ses leur leurs je tu on se ne été être avoir fait très aussi".split()
+    ),
+    "en": frozenset(
+        "the and of to in is that for it with as was on are be by this have "
+        "from or at an not but they you he she we his her their which were "
+        "has been will would there what all can more".split()
+    ),
+    "es": frozenset(
+        "el la los las un una de del y en que es por para con no se su sus "
+        "al lo como más pero o este esta está son fue ha muy también sin "
+        "sobre entre cuando todo ya".split()
+    ),
+    "de": frozenset(
+        "der die das und ist in zu den von mit sich des auf für nicht ein eine "
+        "dem als auch es an werden aus er hat dass sie nach wird bei einer um "
+        "noch wie über so zum war".split()
+    ),
+    "it": frozenset(
+        "il lo la i gli le un una di del della e è in che per con non si da "
+        "al alla sono come più ma anche questo questa nel nella dei delle "
+        "ha essere tra se".split()
+    ),
+    "pt": frozenset(
+        "o a os as um uma de do da dos das e é em que para com não se por "
+        "mais como mas ao foi ele ela são seu sua também no na nos nas "
+        "muito já quando".split()
+    ),
+    "nl": frozenset(
+        "de het een en van in is dat op te zijn voor met niet die er aan als "
+        "ook bij maar om of door over wordt dan naar heeft hij zij wij worden "
+        "deze nog".split()
+    ),
+}
+
+MIN_WORDS = 5
+
+_fasttext_model = None
+
+
+def detect_stopwords(text: str) -> Tuple[Optional[str], float]:
+    """Estime la langue d'après les mots-outils les plus fréquents.
+
+    Heuristique limitée aux langues de ``STOPWORDS``, utilisée uniquement
+    comme pré-filtre (``LANGID_STOPWORDS_PREFILTER``).
+
+    :param str text: texte à analyser (déjà tronqué)
+    :return: code ISO 639-1 et confiance entre 0 et 1
+    :rtype: Tuple[Optional[str], float]
+    """
+    words = WORD_RE.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None, 0.0
+    hits = {lang: 0 for lang in STOPWORDS}
+    for word in words:
+        for lang, stopwords in STOPWORDS.items():
+            if word in stopwords:
+                hits[lang] += 1
+    # Ordre des langues fixe : en cas d'égalité la décision reste stable
+    lang = max(hits, key=hits.get)
+    if hits[lang] == 0:
+        return None, 0.0
+    # Confiance : avance relative sur la deuxième langue (mots-outils partagés)
+    second = sorted(hits.values())[-2]
+    return lang, 1 - second / hits[lang]
+
+
+def detect_fasttext(text: str) -> Tuple[Optional[str], float]:
+    """Identifie la langue avec le modèle compact fastText ``lid.176.ftz``.
+
+    :param str text: texte à analyser (déjà tronqué)
+    :return: code ISO 639-1 et confiance entre 0 et 1
+    :rtype: Tuple[Optional[str], float]
+    """
+    global _fasttext_model
+    if _fasttext_model is None:
+        # Dépendance optionnelle, chargée uniquement si ce backend est choisi
+        import fasttext
+
+        _fasttext_model = fasttext.load_model(LANGID_FASTTEXT_MODEL)
+    labels, scores = _fasttext_model.predict(text.replace("\n", " "), k=1)
+    if not labels:
+        return None, 0.0
+    return labels[0].replace("__label__", ""), float(scores[0])
+
+
+def detect_langdetect(text: str) -> Tuple[Optional[str], float]:
+    """Identifie la langue avec langdetect (graine fixée).
+
+    :param str text: texte à analyser (déjà tronqué)
+    :return: code ISO 639-1 et confiance entre 0 et 1
+    :rtype: Tuple[Optional[str], float]
+    """
+    try:
+        best = detect_langs(text)[0]
+    except Exception:
+        return None, 0.0
+    return best.lang, best.prob
+
+
+BACKENDS = {
+    "fasttext": detect_fasttext,
+    "langdetect": detect_langdetect,
+}
+
+# Échantillon multilingue de ``python language.py`` ; les textes réels
+# (une page par ligne) se passent en argument
+SAMPLE_TEXTS = [
+    "Le conseil municipal a voté hier soir le budget de la ville pour l'année prochaine, "
+    "avec une hausse des dépenses consacrées aux écoles et aux transports.",
+    "Nous vous remercions de votre confiance. Votre commande sera expédiée sous 48 heures "
+    "et vous recevrez un courriel de confirmation.",
+    "The city council voted last night on next year's budget, with more money going "
+    "to schools and public transport.",
+    "El ayuntamiento aprobó anoche el presupuesto del próximo año, con más gasto en "
+    "escuelas y transporte público.",
+    "Der Stadtrat hat gestern Abend den Haushalt für das kommende Jahr beschlossen, mit "
+    "höheren Ausgaben für Schulen und Nahverkehr.",
+    "Il consiglio comunale ha approvato ieri sera il bilancio del prossimo anno, con più "
+    "fondi per le scuole e i trasporti pubblici.",
+    "A câmara municipal aprovou ontem à noite o orçamento do próximo ano, com mais gastos "
+    "em escolas e transportes públicos.",
+    "De gemeenteraad heeft gisteravond de begroting voor volgend jaar goedgekeurd, met "
+    "meer geld voor scholen en openbaar vervoer.",
+    "Rada miasta przyjęła wczoraj wieczorem budżet na przyszły rok, z większymi wydatkami "
+    "na szkoły i transport publiczny.",
+    "Gallia est omnis divisa in partes tres, quarum unam incolunt Belgae, aliam Aquitani, "
+    "tertiam qui ipsorum lingua Celtae, nostra Galli appellantur.",
+    "Kaupunginvaltuusto hyväksyi eilen illalla ensi vuoden talousarvion, ja kouluihin "
+    "sekä joukkoliikenteeseen käytetään enemmän rahaa.",
+]
+
+
+def detect_language(text: str, target: Optional[str] = None) -> Tuple[Optional[str], float]:
+    """Identifie la langue d'un texte sur un préfixe borné.
+
+    Le backend ``LANGID_BACKEND`` est appliqué aux ``LANGID_MAX_CHARS``
+    premiers caractères ; si sa confiance est inférieure à
+    ``LANGID_MIN_CONFIDENCE``, langdetect tranche sur le même préfixe. Avec
+    ``LANGID_STOPWORDS_PREFILTER`` et une langue ``target``, un texte que les
+    mots-outils placent nettement dans une autre langue est écarté sans
+    appeler le backend ; le pré-filtre ne confirme jamais la cible. Tous les
+    backends sont déterministes : un même texte donne toujours la même
+    décision.
+
+    :param str text: texte extrait de la page
+    :param Optional[str] target: langue recherchée (ISO 639-1) pour le pré-filtre
+    :return: code ISO 639-1 (ou ``None``) et confiance entre 0 et 1
+    :rtype: Tuple[Optional[str], float]
+    """
+    prefix = text[:LANGID_MAX_CHARS]
+    if LANGID_STOPWORDS_PREFILTER and target is not None:
+        lang, confidence = detect_stopwords(prefix)
+        if lang is not None and lang != target and confidence >= LANGID_MIN_CONFIDENCE:
+            return lang, confidence
+    lang, confidence = BACKENDS[LANGID_BACKEND](prefix)
+    if confidence < LANGID_MIN_CONFIDENCE and LANGID_BACKEND != "langdetect":
+        lang, confidence = detect_langdetect(prefix)
+    return lang, confidence
+
+
+def compare_with_langdetect(texts: Iterable[str], target: str = "fr") -> dict:
+    """Compare les décisions de ``detect_language`` à langdetect seul.
+
+    :param Iterable[str] texts: textes à classer
+    :param str target: langue cible des décisions d'acceptation
+    :return: taux d'accord sur la langue et sur l'acceptation de la cible,
+        et désaccords ``(début du texte, langdetect, detect_language)``
+    :rtype: dict
+    """
+    same_lang = same_decision = total = 0
+    disagreements = []
+    for text in texts:
+        prefix = text[:LANGID_MAX_CHARS]
+        expected = detect_langdetect(prefix)[0]
+        found = detect_language(text, target)[0]
+        total += 1
+        same_lang += expected == found
+        same_decision += (expected == target) == (found == target)
+        if expected != found:
+            disagreements.append((text[:60], expected, found))
+    return {
+        "backend": LANGID_BACKEND,
+        "prefilter": LANGID_STOPWORDS_PREFILTER,
+        "texts": total,
+        "language_agreement": same_lang / max(total, 1),
+        "decision_agreement": same_decision / max(total, 1),
+        "disagreements": disagreements,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            sample = [line.strip() for line in f if line.strip()]
+    else:
+        sample = SAMPLE_TEXTS
+    print(compare_with_langdetect(sample))
@@ -1,41 +1,21 @@
 import json
-import time
 import logging
 import pika
 import data_searcher as data_search
-from config import RABBITMQ_HOST, VECTORIZATION_QUEUE, RABBITMQ_RETRY_DELAY, RABBITMQ_USER, RABBITMQ_PASSWORD
+from rabbit import RabbitConnectionManager
+from config import VECTORIZATION_QUEUE
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_rabbit_connection() -> pika.BlockingConnection:
-    """Établit une connexion RabbitMQ persistante.
-
-    :return: connexion ouverte
-    :rtype: pika.BlockingConnection
-    """
-    while True:
-        try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-            )
-            logging.info("Connecté à RabbitMQ")
-            return connection
-        except Exception as e:
-            logging.error(
-                f"Erreur de connexion à RabbitMQ : {e}. Nouvelle tentative dans {RABBITMQ_RETRY_DELAY} secondes."
-            )
-            time.sleep(RABBITMQ_RETRY_DELAY)
-
 def main() -> None:
     """Lit des fichiers WARC locaux et publie le texte à vectoriser.
 
     :return: ``None``
     :rtype: None
     """
-    connection = get_rabbit_connection()
-    channel = connection.channel()
+    rabbit = RabbitConnectionManager()
+    channel = rabbit.channel("publish")
     channel.queue_declare(queue=VECTORIZATION_QUEUE, durable=True)
 
     # Lecture des chemins de fichiers WARC
@@ -74,7 +54,7 @@ def main() -> None:
             except Exception as e:
                 logging.error(f"Erreur lors de l'envoi du message pour {message['url']}: {e}")
 
-    connection.close()
+    rabbit.close()
 
 if __name__ == "__main__":
     main()
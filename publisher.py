@@ -0,0 +1,173 @@
+import json
+import time
+import logging
+import pika
+from typing import Any, Optional
+from pika.exceptions import AMQPError
+from rabbit import RabbitConnectionManager, backoff_delay
+from config import PUBLISH_WINDOW, PUBLISH_BATCH_SIZE
+
+# En-tête AMQP signalant un message contenant plusieurs pages
+BATCH_HEADER = "x-batch"
+
+
+class PublishError(Exception):
+    """Levée lorsqu'une fenêtre n'a pas pu être confirmée par le broker."""
+
+
+def pack_pages(pages: list[dict]) -> tuple[bytes, pika.BasicProperties]:
+    """Sérialise une ou plusieurs pages en un message AMQP.
+
+    Une page seule garde le format historique (un objet JSON) ; plusieurs
+    pages sont regroupées dans une enveloppe ``{"pages": [...]}`` signalée
+    par l'en-tête ``x-batch``.
+
+    :param list[dict] pages: pages à publier
+    :return: corps du message et propriétés AMQP
+    :rtype: tuple[bytes, pika.BasicProperties]
+    """
+    if len(pages) == 1:
+        return json.dumps(pages[0]).encode(), pika.BasicProperties(
+            delivery_mode=2, content_type="application/json"
+        )
+    return json.dumps({"pages": pages}).encode(), pika.BasicProperties(
+        delivery_mode=2,
+        content_type="application/json",
+        headers={BATCH_HEADER: len(pages)},
+    )
+
+
+def unpack_pages(body: bytes, properties: Optional[pika.BasicProperties]) -> list[dict]:
+    """Désérialise un message en liste de pages, enveloppe ou non.
+
+    :param bytes body: corps du message
+    :param Optional[pika.BasicProperties] properties: propriétés AMQP
+    :return: pages contenues dans le message
+    :rtype: list[dict]
+    """
+    message = json.loads(body)
+    headers = properties.headers if properties and properties.headers else {}
+    if BATCH_HEADER in headers:
+        return message["pages"]
+    return [message]
+
+
+def is_valid_message(body: bytes, properties) -> bool:
+    """Vérifie qu'un message se décode en pages vectorisables.
+
+    :param bytes body: corps du message
+    :param properties: propriétés AMQP
+    :return: ``True`` si chaque page a un ``url``, un ``h1`` et un ``text``
+    :rtype: bool
+    """
+    try:
+        pages = unpack_pages(body, properties)
+    except (ValueError, TypeError, KeyError) as e:
+        logging.error(f"Message illisible rejeté: {e!r}")
+        return False
+    for page in pages:
+        if not isinstance(page, dict) or not all(
+            isinstance(page.get(field), str) for field in ("url", "h1", "text")
+        ):
+            logging.error("Message rejeté : page sans url, h1 ou text")
+            return False
+    return True
+
+
+class BatchPublisher:
+    """Publie des pages avec confirmation du broker, message par message.
+
+    Les pages sont accumulées jusqu'à ``window`` puis publiées en messages
+    de ``batch_size`` pages sur le canal ``publish`` du gestionnaire, en
+    mode *publisher confirms*. Le canal bloquant attend la confirmation de
+    chaque message avant le suivant : les confirmations ne sont pas
+    pipelinées, seul ``batch_size`` amortit l'aller-retour avec le broker.
+    En cas d'échec, seules les pages non confirmées de la fenêtre sont
+    republiées après reconnexion.
+    """
+
+    def __init__(
+        self,
+        rabbit: RabbitConnectionManager,
+        queue: str,
+        window: int = PUBLISH_WINDOW,
+        batch_size: int = PUBLISH_BATCH_SIZE,
+        retries: int = 3,
+    ) -> None:
+        """Prépare le publisher sur le canal ``publish`` partagé.
+
+        :param RabbitConnectionManager rabbit: gestionnaire de connexions
+        :param str queue: file de destination
+        :param int window: nombre de pages par fenêtre de confirmation
+        :param int batch_size: nombre de pages par message
+        :param int retries: tentatives par fenêtre avant abandon
+        :return: ``None``
+        :rtype: None
+        """
+        self.rabbit = rabbit
+        self.queue = queue
+        self.window = max(window, batch_size)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.pending: list[dict] = []
+        self.published = 0
+        self.rabbit.channel("publish", confirm=True).queue_declare(
+            queue=self.queue, durable=True
+        )
+
+    def publish(self, page: dict[str, Any]) -> None:
+        """Ajoute une page à la fenêtre courante et la publie si elle est pleine.
+
+        :param dict page: page à publier
+        :return: ``None``
+        :rtype: None
+        :raises PublishError: si la fenêtre n'a pas pu être confirmée
+        """
+        self.pending.append(page)
+        if len(self.pending) >= self.window:
+            self.flush()
+
+    def flush(self) -> None:
+        """Publie la fenêtre courante, chaque message attendant sa confirmation.
+
+        :return: ``None``
+        :rtype: None
+        :raises PublishError: si la fenêtre n'a pas pu être confirmée
+        """
+        attempt = 0
+        while self.pending:
+            try:
+                channel = self.rabbit.channel("publish", confirm=True)
+                # Chaque message retiré de la fenêtre a été confirmé
+                while self.pending:
+                    pages = self.pending[: self.batch_size]
+                    body, properties = pack_pages(pages)
+                    channel.basic_publish(
+                        exchange="",
+                        routing_key=self.queue,
+                        body=body,
+                        properties=properties,
+                        mandatory=True,
+                    )
+                    del self.pending[: len(pages)]
+                    self.published += len(pages)
+            except (AMQPError, OSError) as e:
+                attempt += 1
+                logging.error(
+                    f"Échec de la fenêtre de publication ({len(self.pending)} pages "
+                    f"non confirmées), tentative {attempt}/{self.retries}: {e!r}"
+                )
+                self.rabbit.reset("publish")
+                if attempt >= self.retries:
+                    raise PublishError(
+                        f"{len(self.pending)} pages non confirmées vers {self.queue}"
+                    ) from e
+                time.sleep(backoff_delay(attempt - 1))
+
+    def abort(self) -> None:
+        """Abandonne les pages en attente de publication.
+
+        :return: ``None``
+        :rtype: None
+        """
+        self.pending = []
@@ -0,0 +1,224 @@
+import time
+import random
+import logging
+import pika
+from typing import Callable, Iterable, Optional
+from pika.exceptions import AMQPConnectionError, AMQPChannelError
+from config import (
+    RABBITMQ_HOST,
+    RABBITMQ_USER,
+    RABBITMQ_PASSWORD,
+    RABBITMQ_RETRY_DELAY,
+    RABBITMQ_MAX_RETRY_DELAY,
+    RABBITMQ_HEARTBEAT,
+)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Calcule l'attente avant une nouvelle tentative de connexion.
+
+    Le délai double à chaque échec jusqu'à ``RABBITMQ_MAX_RETRY_DELAY`` ; une
+    part aléatoire évite que tous les consumers se reconnectent ensemble
+    après une coupure du broker.
+
+    :param int attempt: numéro de la tentative échouée (à partir de 0)
+    :return: délai en secondes
+    :rtype: float
+    """
+    delay = min(RABBITMQ_RETRY_DELAY * 2 ** attempt, RABBITMQ_MAX_RETRY_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+class RabbitConnectionManager:
+    """Connexions et canaux RabbitMQ longue durée partagés par un processus.
+
+    Une connexion est ouverte par rôle (``consume``, ``publish``) afin que le
+    contrôle de flux appliqué aux publications ne bloque jamais la
+    consommation. Connexions et canaux sont réutilisés d'une unité de
+    travail à l'autre et recréés uniquement lorsqu'ils sont fermés.
+    """
+
+    def __init__(
+        self,
+        heartbeat: int = RABBITMQ_HEARTBEAT,
+        blocked_connection_timeout: int = 300,
+    ) -> None:
+        """Prépare le gestionnaire sans ouvrir de connexion.
+
+        :param int heartbeat: intervalle de heartbeat négocié (secondes)
+        :param int blocked_connection_timeout: délai avant abandon d'une
+            connexion bloquée par le broker
+        :return: ``None``
+        :rtype: None
+        """
+        self.heartbeat = heartbeat
+        self.blocked_connection_timeout = blocked_connection_timeout
+        self.connections: dict[str, pika.BlockingConnection] = {}
+        self.channels: dict = {}
+        # Temps cumulé passé à (re)connecter, pour les métriques
+        self.connect_time = 0.0
+
+    def _open(self) -> pika.BlockingConnection:
+        """Ouvre une connexion en réessayant avec un délai exponentiel.
+
+        :return: connexion ouverte
+        :rtype: pika.BlockingConnection
+        """
+        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+        parameters = pika.ConnectionParameters(
+            host=RABBITMQ_HOST,
+            credentials=credentials,
+            heartbeat=self.heartbeat,
+            blocked_connection_timeout=self.blocked_connection_timeout,
+        )
+        attempt = 0
+        start = time.time()
+        while True:
+            try:
+                connection = pika.BlockingConnection(parameters)
+                self.connect_time += time.time() - start
+                logging.info("Connecté à RabbitMQ")
+                return connection
+            except AMQPConnectionError as e:
+                delay = backoff_delay(attempt)
+                logging.error(
+                    f"Erreur de connexion à RabbitMQ : {e!r}. Nouvelle tentative dans {delay:.1f} secondes."
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    def connection(self, role: str = "consume") -> pika.BlockingConnection:
+        """Retourne la connexion d'un rôle, rouverte si elle a été perdue.
+
+        :param str role: ``consume`` ou ``publish``
+        :return: connexion ouverte
+        :rtype: pika.BlockingConnection
+        """
+        connection = self.connections.get(role)
+        if connection is None or not connection.is_open:
+            self.channels.pop(role, None)
+            connection = self._open()
+            self.connections[role] = connection
+        return connection
+
+    def channel(self, role: str = "consume", confirm: bool = False):
+        """Retourne le canal d'un rôle, recréé s'il a été fermé.
+
+        :param str role: ``consume`` ou ``publish``
+        :param bool confirm: active les *publisher confirms* à la création
+        :return: canal ouvert
+        :rtype: pika.adapters.blocking_connection.BlockingChannel
+        """
+        connection = self.connection(role)
+        channel = self.channels.get(role)
+        if channel is None or not channel.is_open:
+            channel = connection.channel()
+            if confirm:
+                channel.confirm_delivery()
+            self.channels[role] = channel
+        return channel
+
+    def reset(self, role: str) -> None:
+        """Ferme la connexion d'un rôle après une erreur.
+
+        :param str role: rôle à réinitialiser
+        :return: ``None``
+        :rtype: None
+        """
+        self.channels.pop(role, None)
+        connection = self.connections.pop(role, None)
+        try:
+            if connection and connection.is_open:
+                connection.close()
+        except Exception:
+            pass
+
+    def keepalive(self, exclude: Optional[pika.BlockingConnection] = None) -> None:
+        """Traite les heartbeats des connexions inactives.
+
+        Une ``BlockingConnection`` ne répond aux heartbeats que lorsqu'elle
+        traite ses événements : une connexion de publication inutilisée
+        pendant plus de deux intervalles serait sinon fermée par le broker.
+
+        :param Optional[pika.BlockingConnection] exclude: connexion à ignorer
+        :return: ``None``
+        :rtype: None
+        """
+        for role, connection in list(self.connections.items()):
+            if connection is exclude:
+                continue
+            try:
+                if connection.is_open:
+                    connection.process_data_events(time_limit=0)
+            except Exception as e:
+                logging.warning(f"Connexion RabbitMQ {role} perdue: {e!r}")
+                self.reset(role)
+
+    def _schedule_keepalive(self, connection: pika.BlockingConnection) -> None:
+        """Planifie ``keepalive`` dans la boucle de la connexion de consommation.
+
+        :param pika.BlockingConnection connection: connexion de consommation
+        :return: ``None``
+        :rtype: None
+        """
+        interval = max(self.heartbeat / 2, 1)
+
+        def tick() -> None:
+            self.keepalive(exclude=connection)
+            if connection.is_open:
+                connection.call_later(interval, tick)
+
+        connection.call_later(interval, tick)
+
+    def consume(
+        self,
+        queue: str,
+        on_message_callback: Callable,
+        prefetch_count: int = 1,
+        declare: Iterable[str] = (),
+        on_reconnect: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Consomme une file en se reconnectant après chaque coupure.
+
+        :param str queue: file à consommer
+        :param Callable on_message_callback: callback pika du consumer
+        :param int prefetch_count: nombre de messages non acquittés autorisés
+        :param Iterable[str] declare: autres files à déclarer
+        :param Optional[Callable] on_reconnect: appelé après une reconnexion,
+            les livraisons en attente de l'ancien canal étant invalides
+        :return: ``None``
+        :rtype: None
+        """
+        attempt = 0
+        first = True
+        while True:
+            try:
+                channel = self.channel("consume")
+                if not first and on_reconnect:
+                    on_reconnect()
+                first = False
+                for name in (queue, *declare):
+                    channel.queue_declare(queue=name, durable=True)
+                channel.basic_qos(prefetch_count=prefetch_count)
+                channel.basic_consume(queue=queue, on_message_callback=on_message_callback)
+                self._schedule_keepalive(self.connection("consume"))
+                attempt = 0
+                channel.start_consuming()
+                return
+            except (AMQPConnectionError, AMQPChannelError) as e:
+                delay = backoff_delay(attempt)
+                logging.error(
+                    f"Connexion RabbitMQ perdue ({e!r}), reprise dans {delay:.1f} secondes."
+                )
+                self.reset("consume")
+                time.sleep(delay)
+                attempt += 1
+
+    def close(self) -> None:
+        """Ferme toutes les connexions.
+
+        :return: ``None``
+        :rtype: None
+        """
+        for role in list(self.connections):
+            self.reset(role)
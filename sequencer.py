@@ -1,38 +1,213 @@
 import spacy
+from config import SEGMENTER_MODE, SEGMENTER_N_PROCESS, SEGMENTER_BATCH_SIZE
 
-nlp = spacy.load("fr_core_news_sm")
+# Composants inutiles pour obtenir doc.sents
+HEAVY_COMPONENTS = ["tagger", "morphologizer", "attribute_ruler", "lemmatizer", "ner"]
 
+_nlp = None
 
-def segment_text(text: str, max_words: int, overlap_sentences: int) -> list[str]:
-    """Découpe un texte en segments de longueur maximale.
 
-    :param str text: texte source à segmenter
+def load_nlp(mode: str = SEGMENTER_MODE) -> spacy.language.Language:
+    """Charge le pipeline spaCy de découpage en phrases.
+
+    Modes disponibles :
+
+    - ``sentencizer`` : découpage à base de règles sur la ponctuation, sans
+      modèle statistique (le plus rapide) ;
+    - ``senter`` : ``fr_core_news_sm`` réduit à son composant ``senter`` ;
+    - ``parser`` : ``fr_core_news_sm`` avec le parser de dépendances,
+      découpage historique, sans les autres composants lourds.
+
+    :param str mode: mode de découpage
+    :return: pipeline prêt à l'emploi
+    :rtype: spacy.language.Language
+    :raises ValueError: si le mode est inconnu
+    """
+    if mode == "sentencizer":
+        nlp = spacy.blank("fr")
+        nlp.add_pipe("sentencizer")
+    elif mode == "senter":
+        nlp = spacy.load("fr_core_news_sm", exclude=HEAVY_COMPONENTS + ["parser"])
+        nlp.enable_pipe("senter")
+    elif mode == "parser":
+        nlp = spacy.load("fr_core_news_sm", exclude=HEAVY_COMPONENTS)
+    else:
+        raise ValueError(f"Mode de segmentation inconnu : {mode}")
+    return nlp
+
+
+def get_nlp() -> spacy.language.Language:
+    """Retourne le pipeline du processus, chargé au premier appel.
+
+    :return: pipeline configuré par ``SEGMENTER_MODE``
+    :rtype: spacy.language.Language
+    """
+    global _nlp
+    if _nlp is None:
+        _nlp = load_nlp()
+    return _nlp
+
+
+def build_segments(sentences: list[str], max_words: int, overlap_sentences: int) -> list[str]:
+    """Regroupe des phrases en segments de longueur maximale.
+
+    Le nombre de mots de chaque phrase est calculé une seule fois et le
+    total du segment courant est tenu à jour de façon incrémentale.
+
+    :param list[str] sentences: phrases du texte, dans l'ordre
     :param int max_words: nombre maximal de mots par segment
     :param int overlap_sentences: nombre de phrases réutilisées entre deux segments
     :return: liste des segments produits
     :rtype: list[str]
     """
-    doc = nlp(text)
-    sentences = [sent.text for sent in doc.sents]
     segments = []
     actual_segment = []
+    actual_counts = []
     words_count = 0
 
-    i = 0
-    while i < len(sentences):
-        mots = sentences[i].split()
+    for sentence in sentences:
+        count = len(sentence.split())
 
-        if words_count + len(mots) > max_words:
+        if words_count + count > max_words:
             segments.append(" ".join(actual_segment))
 
             actual_segment = actual_segment[-overlap_sentences:]
-            words_count = sum(len(sent.split()) for sent in actual_segment)
+            actual_counts = actual_counts[-overlap_sentences:]
+            words_count = sum(actual_counts)
 
-        actual_segment.append(sentences[i])
-        words_count += len(mots)
-        i += 1
+        actual_segment.append(sentence)
+        actual_counts.append(count)
+        words_count += count
 
     if actual_segment:
         segments.append(" ".join(actual_segment))
 
     return segments
+
+
+def segment_texts(
+    texts: list[str],
+    max_words: int,
+    overlap_sentences: int,
+    n_process: int = SEGMENTER_N_PROCESS,
+    batch_size: int = SEGMENTER_BATCH_SIZE,
+) -> list[list[str]]:
+    """Découpe plusieurs textes en segments avec ``nlp.pipe``.
+
+    Pour une configuration donnée, le résultat est identique à des appels
+    successifs de ``segment_text``.
+
+    :param list[str] texts: textes sources à segmenter
+    :param int max_words: nombre maximal de mots par segment
+    :param int overlap_sentences: nombre de phrases réutilisées entre deux segments
+    :param int n_process: nombre de processus spaCy
+    :param int batch_size: nombre de textes par lot ``nlp.pipe``
+    :return: segments de chaque texte, dans l'ordre des textes
+    :rtype: list[list[str]]
+    """
+    docs = get_nlp().pipe(texts, n_process=n_process, batch_size=batch_size)
+    return [
+        build_segments([sent.text for sent in doc.sents], max_words, overlap_sentences)
+        for doc in docs
+    ]
+
+
+def segment_text(text: str, max_words: int, overlap_sentences: int) -> list[str]:
+    """Découpe un texte en segments de longueur maximale.
+
+    :param str text: texte source à segmenter
+    :param int max_words: nombre maximal de mots par segment
+    :param int overlap_sentences: nombre de phrases réutilisées entre deux segments
+    :return: liste des segments produits
+    :rtype: list[str]
+    """
+    doc = get_nlp()(text)
+    return build_segments([sent.text for sent in doc.sents], max_words, overlap_sentences)
+
+
+def pack_token_segments(
+    pieces: list[tuple[str, list[int]]], max_tokens: int, overlap_sentences: int
+) -> list[tuple[str, list[int]]]:
+    """Regroupe des phrases tokenisées en segments d'au plus ``max_tokens``.
+
+    Les identifiants d'un segment sont la concaténation de ceux de ses
+    phrases, ce qui correspond à la tokenisation du texte joint par des
+    espaces pour un tokenizer WordPiece.
+
+    :param list pieces: texte et identifiants de chaque phrase, chacune
+        d'au plus ``max_tokens`` tokens
+    :param int max_tokens: nombre maximal de tokens par segment
+    :param int overlap_sentences: nombre de phrases réutilisées entre deux segments
+    :return: texte et identifiants de chaque segment
+    :rtype: list[tuple[str, list[int]]]
+    """
+    segments = []
+    actual_segment = []
+    tokens_count = 0
+
+    def close() -> None:
+        segments.append((
+            " ".join(text for text, _ in actual_segment),
+            [token for _, ids in actual_segment for token in ids],
+        ))
+
+    for text, ids in pieces:
+        if actual_segment and tokens_count + len(ids) > max_tokens:
+            close()
+            actual_segment = actual_segment[-overlap_sentences:] if overlap_sentences else []
+            tokens_count = sum(len(piece_ids) for _, piece_ids in actual_segment)
+            # Le recouvrement est réduit si la phrase suivante ne tient pas
+            while actual_segment and tokens_count + len(ids) > max_tokens:
+                tokens_count -= len(actual_segment.pop(0)[1])
+
+        actual_segment.append((text, ids))
+        tokens_count += len(ids)
+
+    if actual_segment:
+        close()
+
+    return segments
+
+
+def segment_texts_by_tokens(
+    texts: list[str],
+    tokenizer,
+    max_tokens: int,
+    overlap_sentences: int,
+    n_process: int = SEGMENTER_N_PROCESS,
+    batch_size: int = SEGMENTER_BATCH_SIZE,
+) -> list[list[tuple[str, list[int]]]]:
+    """Découpe plusieurs textes en segments mesurés en tokens du modèle.
+
+    Toutes les phrases du lot sont tokenisées en un seul appel au tokenizer
+    rapide ; une phrase plus longue que ``max_tokens`` est coupée en
+    morceaux afin qu'aucun texte ne soit tronqué par l'encodeur.
+
+    :param list[str] texts: textes sources à segmenter
+    :param tokenizer: tokenizer rapide (``transformers``) du modèle
+    :param int max_tokens: nombre maximal de tokens par segment, hors tokens spéciaux
+    :param int overlap_sentences: nombre de phrases réutilisées entre deux segments
+    :param int n_process: nombre de processus spaCy
+    :param int batch_size: nombre de textes par lot ``nlp.pipe``
+    :return: texte et identifiants de tokens de chaque segment, par texte
+    :rtype: list[list[tuple[str, list[int]]]]
+    """
+    docs = get_nlp().pipe(texts, n_process=n_process, batch_size=batch_size)
+    sentence_lists = [[sent.text for sent in doc.sents] for doc in docs]
+    flat = [sentence for sentences in sentence_lists for sentence in sentences]
+    flat_ids = tokenizer(flat, add_special_tokens=False)["input_ids"] if flat else []
+
+    results = []
+    idx = 0
+    for sentences in sentence_lists:
+        pieces = []
+        for sentence, ids in zip(sentences, flat_ids[idx: idx + len(sentences)]):
+            if len(ids) <= max_tokens:
+                pieces.append((sentence, ids))
+                continue
+            for start in range(0, len(ids), max_tokens):
+                chunk = ids[start: start + max_tokens]
+                pieces.append((tokenizer.decode(chunk), chunk))
+        idx += len(sentences)
+        results.append(pack_token_segments(pieces, max_tokens, overlap_sentences))
+    return results
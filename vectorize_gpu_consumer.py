@@ -1,19 +1,21 @@
-import json
 import time
-import pika
+import queue
 import torch
 import logging
-import torch.nn.functional as F
-from sequencer import segment_text
-from sentence_transformers import SentenceTransformer
+import threading
+from typing import Callable, Optional
+from embedding import segment_documents, encode_segments, mean_pool
+from embedding_cache import create_cache
+from embedding_backend import load_model, backend_id
 from logger import logger
+from publisher import unpack_pages, is_valid_message
+from codec import encode_embedding_message, content_hash
+from rabbit import RabbitConnectionManager
+from aio_consumer import TRANSIENT_ERRORS
+from pika.exceptions import AMQPError
 from config import (
-    RABBITMQ_HOST,
     VECTORIZATION_QUEUE,
     INDEXING_QUEUE,
-    RABBITMQ_RETRY_DELAY,
-    RABBITMQ_USER,
-    RABBITMQ_PASSWORD,
     MACHINE,
 )
 
@@ -24,150 +26,349 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 logging.info(f"Using device: {device}")
 
 # Initialize the SentenceTransformer model on the GPU
-model = SentenceTransformer("all-MiniLM-L6-v2", device=device)
+model = load_model(device)
+# Embeddings of already seen segments (duplicate pages, boilerplate)
+cache = create_cache(backend_id())
 
-time_encode = 0
-time_embeding=0
-time_get_rabbit_connection = 0
+# Consume connection (pika thread) and publish connection (publish stage thread):
+# a BlockingConnection must only be used from the thread that owns it
+rabbit = RabbitConnectionManager()
+publish_rabbit = RabbitConnectionManager()
 
 # Batch sizes
-DOC_BATCH_SIZE = 10000        # Number of documents to pull per RabbitMQ batch
+DOC_BATCH_SIZE = 1000         # Number of messages per pipeline batch
+BATCH_TIMEOUT = 1.0           # Max seconds to wait for a full batch
 EMBED_BATCH_SIZE = 512        # Number of segments per GPU encode batch
+QUEUE_SIZE = 2                # Batches waiting between two stages
+# Unacked messages the broker may push: every stage and queue can hold a batch
+PREFETCH_COUNT = DOC_BATCH_SIZE * (4 + 3 * QUEUE_SIZE)
+# Stage failures worth a retry (broker, network, GPU memory pressure): the
+# batch is requeued. Any other failure rejects its messages without requeue.
+STAGE_TRANSIENT_ERRORS = TRANSIENT_ERRORS + (torch.cuda.OutOfMemoryError,)
 
-def get_rabbit_connection() -> pika.BlockingConnection:
-    """Ouvre une connexion RabbitMQ et mesure le temps nécessaire.
 
-    :return: connexion ouverte
-    :rtype: pika.BlockingConnection
-    """
-    global time_get_rabbit_connection
-    start_time = time.time()
-    while True:
+class Batch:
+    """Lot de messages qui traverse les étapes du pipeline."""
+
+    def __init__(self, connection, messages: list) -> None:
+        """Conserve les messages reçus et la connexion qui doit les acquitter.
+
+        :param connection: connexion de consommation (thread pika)
+        :param list messages: tuples ``(channel, method, properties, body)``
+        :return: ``None``
+        :rtype: None
+        """
+        self.connection = connection
+        self.messages = messages
+        self.docs = []         # (message index, page)
+        self.last_page = {}    # message index -> index of its last page
+        self.settled = set()   # message indexes already acked or nacked
+        self.segments = []
+        self.counts = []       # number of segments per doc
+        self.token_ids = None  # reused by the encoder in "tokens" mode
+        self.embeddings = []
+        self.time_encode = 0.0
+        self.time_embeding = 0.0
+
+    def settle(self, index: int, ack: bool = True, requeue: bool = True) -> None:
+        """Acquitte ou rejette un message depuis n'importe quel thread.
+
+        L'opération est confiée au thread pika via ``add_callback_threadsafe`` ;
+        elle est ignorée si le canal a été fermé entre-temps (le message sera
+        relivré).
+
+        :param int index: position du message dans le lot
+        :param bool ack: ``True`` pour acquitter, ``False`` pour rejeter
+        :param bool requeue: remet en file un message rejeté
+        :return: ``None``
+        :rtype: None
+        """
+        if index in self.settled:
+            return
+        self.settled.add(index)
+        channel, method, _, _ = self.messages[index]
+
+        def settle_in_pika_thread() -> None:
+            if not channel.is_open:
+                return
+            if ack:
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+            else:
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=requeue)
+
         try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-            )
-            logging.info("Connected to RabbitMQ")
-            time_get_rabbit_connection = time.time() - start_time
-            return connection
+            self.connection.add_callback_threadsafe(settle_in_pika_thread)
         except Exception as e:
-            logging.error(
-                f"RabbitMQ connection error: {e}. Retrying in {RABBITMQ_RETRY_DELAY}s."
-            )
-            time.sleep(RABBITMQ_RETRY_DELAY)
+            logging.warning(f"Consume connection closed, message will be redelivered: {e!r}")
 
 
-def process_batch(channel: pika.adapters.blocking_connection.BlockingChannel) -> int:
-    """Traite un lot de documents et renvoie le nombre d'éléments traités.
+class Stage(threading.Thread):
+    """Étape du pipeline reliée aux autres par des files bornées.
 
-    :param pika.adapters.blocking_connection.BlockingChannel channel: canal RabbitMQ
-    :return: nombre de documents réellement traités
-    :rtype: int
+    Le temps de chaque étape est réparti entre travail (``busy``), attente
+    d'un lot en entrée (``starved``) et attente de place en sortie
+    (``blocked``) ; ces taux d'occupation sont publiés après chaque lot.
     """
-    global time_encode
-    global time_embeding
-    # 1) Pull a batch of messages
-    msgs = []
-    for _ in range(DOC_BATCH_SIZE):
-        method, properties, body = channel.basic_get(
-            queue=VECTORIZATION_QUEUE,
-            auto_ack=False
-        )
-        if method:
-            msgs.append((method, body))
-        else:
-            break
 
-    if not msgs:
-        return 0
+    def __init__(
+        self,
+        name: str,
+        work: Callable[[Batch], None],
+        inbox: queue.Queue,
+        outbox: Optional[queue.Queue] = None,
+        idle: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Prépare l'étape sans la démarrer.
+
+        :param str name: nom de l'étape dans les métriques
+        :param Callable work: traitement appliqué à chaque lot
+        :param queue.Queue inbox: lots en entrée
+        :param Optional[queue.Queue] outbox: lots en sortie (dernière étape : ``None``)
+        :param Optional[Callable] idle: appelé quand aucun lot n'arrive
+        :return: ``None``
+        :rtype: None
+        """
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.idle = idle
+        self.busy = self.starved = self.blocked = 0.0
+
+    def run(self) -> None:
+        """Traite les lots de ``inbox`` indéfiniment.
 
+        :return: ``None``
+        :rtype: None
+        """
+        while True:
+            start = time.time()
+            try:
+                batch = self.inbox.get(timeout=1)
+            except queue.Empty:
+                self.starved += time.time() - start
+                if self.idle:
+                    self.idle()
+                continue
+            received = time.time()
+            try:
+                self.work(batch)
+            except Exception as e:
+                logging.error(f"Stage {self.name} failed on a batch of {len(batch.messages)} messages: {e!r}")
+                # Messages not acked yet are requeued only if a retry may succeed
+                requeue = isinstance(e, STAGE_TRANSIENT_ERRORS)
+                for index in range(len(batch.messages)):
+                    batch.settle(index, ack=False, requeue=requeue)
+                continue
+            done = time.time()
+            if self.outbox is not None:
+                self.outbox.put(batch)
+            self.starved += received - start
+            self.busy += done - received
+            self.blocked += time.time() - done
+            self.log_metrics()
+
+    def log_metrics(self) -> None:
+        """Publie l'occupation de l'étape depuis la dernière publication.
+
+        :return: ``None``
+        :rtype: None
+        """
+        total = self.busy + self.starved + self.blocked
+        if total <= 0:
+            return
+        logger({
+            "step": "vector_pipeline",
+            "stage": self.name,
+            "busy": self.busy / total,
+            "starved": self.starved / total,
+            "blocked": self.blocked / total,
+            "queue_depth": self.inbox.qsize(),
+            "computer": MACHINE,
+        })
+        self.busy = self.starved = self.blocked = 0.0
+
+
+def segment_batch(batch: Batch) -> None:
+    """Étape 1 : décode les enveloppes et découpe les documents en segments.
+
+    :param Batch batch: lot à traiter
+    :return: ``None``
+    :rtype: None
+    """
     start_time = time.time()
-    # 2) Parse and segment text
-    all_segments = []
-    counts = []    # number of segments per doc
-    docs = []      # original messages
-    for method, body in msgs:
-        message = json.loads(body)
-        segments = segment_text(message['text'], 150, 2)
-        counts.append(len(segments))
-        all_segments.extend(segments)
-        docs.append((method, message))
-    time_encode = time.time() - start_time
-
-    # 3) Encode all segments in batches on GPU
+    for index, (_, _, properties, body) in enumerate(batch.messages):
+        # A message may carry several pages (x-batch envelope)
+        pages = unpack_pages(body, properties)
+        for message in pages:
+            batch.docs.append((index, message))
+        if pages:
+            batch.last_page[index] = len(batch.docs) - 1
+    # Segment every document in bulk with nlp.pipe
+    segment_lists, token_id_lists = segment_documents(
+        model, [message['text'] for _, message in batch.docs]
+    )
+    for segments in segment_lists:
+        batch.counts.append(len(segments))
+        batch.segments.extend(segments)
+    if token_id_lists is not None:
+        batch.token_ids = [ids for token_ids in token_id_lists for ids in token_ids]
+    batch.time_encode = time.time() - start_time
+
+
+def encode_batch(batch: Batch) -> None:
+    """Étape 2 : encode les segments sur le GPU et calcule la moyenne par document.
+
+    :param Batch batch: lot à traiter
+    :return: ``None``
+    :rtype: None
+    """
     start_time = time.time()
-    embeddings = model.encode(
-        all_segments,
-        batch_size=EMBED_BATCH_SIZE,
-        convert_to_tensor=True,
-        show_progress_bar=False,
-        device=device
+    embeddings = encode_segments(
+        model, batch.segments, EMBED_BATCH_SIZE, batch.token_ids, cache
     )
-    time_embeding = time.time() - start_time
-    # 4) Split embeddings by document and compute normalized mean
-    doc_embeddings = []
-    idx = 0
-    for count in counts:
-        chunk = embeddings[idx: idx + count]
-        mean_emb = torch.mean(chunk, dim=0)
-        norm_emb = F.normalize(mean_emb, p=2, dim=0)
-        doc_embeddings.append(norm_emb.cpu().numpy())
-        idx += count
-
-    # 5) Publish embeddings and ack messages
-    for (method, message), emb in zip(docs, doc_embeddings):
-        new_msg = {
-            "url": message["url"],
-            "h1": message["h1"],
-            "embedding": emb.tolist()
-        }
-        channel.basic_publish(
-            exchange='',
-            routing_key=INDEXING_QUEUE,
-            body=json.dumps(new_msg),
-            properties=pika.BasicProperties(delivery_mode=2)
+    batch.embeddings = mean_pool(embeddings, batch.counts)
+    batch.time_embeding = time.time() - start_time
+    if cache is not None:
+        cache.log_metrics("vector_cache")
+
+
+def publish_batch(batch: Batch) -> None:
+    """Étape 3 : publie les embeddings et acquitte chaque message publié.
+
+    :param Batch batch: lot à traiter
+    :return: ``None``
+    :rtype: None
+    """
+    publish_channel = publish_rabbit.channel("publish")
+    for i, ((index, message), emb) in enumerate(zip(batch.docs, batch.embeddings)):
+        body, properties = encode_embedding_message(
+            {
+                "url": message["url"],
+                "h1": message["h1"],
+                "content_hash": content_hash(message["text"]),
+            },
+            emb
         )
+        try:
+            publish_channel.basic_publish(
+                exchange='',
+                routing_key=INDEXING_QUEUE,
+                body=body,
+                properties=properties
+            )
+        except (AMQPError, OSError):
+            # Reopened on the next batch
+            publish_rabbit.reset("publish")
+            raise
 
-        channel.basic_ack(delivery_tag=method.delivery_tag)
-        logging.info(f"Processed and acked: {message['url']}")
+        # Ack once every page of the message has been published
+        if batch.last_page[index] == i:
+            batch.settle(index)
+        logging.info(f"Processed: {message['url']}")
         data = {
             "step": "vector",
             "url": message["url"],
-            "time_encode": time_encode,
-            "time_embeding": time_embeding,
-            "time_get_rabbit_connection": time_get_rabbit_connection,
+            "time_encode": batch.time_encode,
+            "time_embeding": batch.time_embeding,
+            "time_get_rabbit_connection": rabbit.connect_time,
             "computer": MACHINE,
         }
         logger(data)
+    # Messages without any page have nothing to publish
+    for index in range(len(batch.messages)):
+        if index not in batch.last_page:
+            batch.settle(index)
+
 
-    return len(msgs)
+def publish_idle() -> None:
+    """Sert les heartbeats de la connexion de publication quand elle est inactive.
+
+    :return: ``None``
+    :rtype: None
+    """
+    publish_rabbit.keepalive()
 
 
 def main() -> None:
     """Boucle principale du consumer vectorisation GPU.
 
+    Les messages sont poussés par le broker (``basic_consume``) et regroupés
+    en lots de ``DOC_BATCH_SIZE`` ou après ``BATCH_TIMEOUT`` secondes. Trois
+    threads (segmentation, encodage, publication) reliés par des files de
+    ``QUEUE_SIZE`` lots travaillent en parallèle : le lot N+1 est segmenté
+    pendant que le lot N est encodé et que le lot N-1 est publié. Les
+    messages invalides sont rejetés sans remise en file avant d'entrer dans
+    un lot.
+
     :return: ``None``
     :rtype: None
     """
-    connection = get_rabbit_connection()
-    channel = connection.channel()
-    channel.queue_declare(queue=VECTORIZATION_QUEUE, durable=True)
-    channel.queue_declare(queue=INDEXING_QUEUE, durable=True)
-    channel.basic_qos(prefetch_count=DOC_BATCH_SIZE)
-    logging.info("Batch Vectorizer Consumer awaiting messages...")
+    segment_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    encode_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    publish_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    stages = [
+        Stage("segment", segment_batch, segment_queue, encode_queue),
+        Stage("encode", encode_batch, encode_queue, publish_queue),
+        Stage("publish", publish_batch, publish_queue, idle=publish_idle),
+    ]
+    publish_rabbit.channel("publish").queue_declare(queue=INDEXING_QUEUE, durable=True)
+    for stage in stages:
+        stage.start()
+
+    pending = []   # (channel, method, properties, body) waiting for a batch
+    timer = None   # scheduled flush of the current batch
 
+    def flush() -> None:
+        """Passe le lot courant à la segmentation, sans bloquer le thread pika."""
+        nonlocal timer, pending
+        timer = None
+        if not pending:
+            return
+        connection = rabbit.connection("consume")
+        try:
+            segment_queue.put_nowait(Batch(connection, pending))
+        except queue.Full:
+            # Backpressure: keep buffering (bounded by the prefetch) and retry
+            timer = connection.call_later(0.1, flush)
+            return
+        pending = []
+
+    def callback(ch, method, properties, body) -> None:
+        """Ajoute un message poussé par le broker au lot courant."""
+        nonlocal timer
+        if not is_valid_message(body, properties):
+            # An invalid message would fail every batch it is redelivered in
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        pending.append((ch, method, properties, body))
+        if len(pending) >= DOC_BATCH_SIZE:
+            if timer is not None:
+                rabbit.connection("consume").remove_timeout(timer)
+            flush()
+        elif timer is None:
+            timer = rabbit.connection("consume").call_later(BATCH_TIMEOUT, flush)
+
+    def on_reconnect() -> None:
+        """Oublie les messages de l'ancien canal, qui seront relivrés."""
+        nonlocal timer, pending
+        pending = []
+        timer = None
+
+    logging.info("Batch Vectorizer Consumer awaiting messages...")
     try:
-        while True:
-            processed = process_batch(channel)
-            if processed == 0:
-                time.sleep(1)
+        rabbit.consume(
+            VECTORIZATION_QUEUE,
+            callback,
+            prefetch_count=PREFETCH_COUNT,
+            on_reconnect=on_reconnect,
+        )
     except KeyboardInterrupt:
         logging.info("Manual interruption, shutting down consumer.")
     except Exception as e:
         logging.error(f"Consumer error: {e}")
     finally:
-        connection.close()
+        rabbit.close()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,87 @@
-import json
+import os
 import time
 import pika
 import torch
 import logging
+import multiprocessing
 import numpy as np
-from sequencer import segment_text
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from embedding import segment_documents, encode_segments, mean_pool
+from embedding_cache import create_cache
+from embedding_backend import BACKENDS, load_model, backend_id, verify_backend
 from logger import logger
-from config import RABBITMQ_HOST, VECTORIZATION_QUEUE, INDEXING_QUEUE, RABBITMQ_RETRY_DELAY, RABBITMQ_USER, RABBITMQ_PASSWORD, MACHINE
+from publisher import unpack_pages, is_valid_message
+from codec import encode_embedding_message, content_hash
+from rabbit import RabbitConnectionManager
+from aio_consumer import AsyncConsumer, Delivery, run as run_async
+from config import (
+    VECTORIZATION_QUEUE,
+    INDEXING_QUEUE,
+    ASYNC_RUNTIME,
+    EMBEDDING_BACKEND,
+    VECTORIZE_BATCH_SIZE,
+    VECTORIZE_BATCH_TIMEOUT_MS,
+    ENCODE_WORKERS,
+    ENCODE_THREADS,
+    MACHINE,
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-device = "mps" if torch.backends.mps.is_available() else "cpu"
-model = SentenceTransformer("all-MiniLM-L6-v2", device=device)
+# ONNX Runtime n'exécute les backends onnx que sur CPU ici
+use_mps = EMBEDDING_BACKEND == "torch" and torch.backends.mps.is_available()
+device = "mps" if use_mps else "cpu"
+# Avec le pool, aucune inférence avant le fork : le contrôle de précision
+# est fait par un worker (create_encode_pool)
+model = load_model(device, verify=ENCODE_WORKERS <= 1)
+# Embeddings des segments déjà vus (pages dupliquées, boilerplate)
+cache = create_cache(backend_id())
+
+# Lot de messages encodés ensemble : N messages ou T millisecondes
+BATCH_SIZE = VECTORIZE_BATCH_SIZE
+BATCH_TIMEOUT = VECTORIZE_BATCH_TIMEOUT_MS / 1000
+EMBED_BATCH_SIZE = 64         # Segments par appel interne de model.encode
 
 time_encode = 0
-time_get_rabbit_connection = 0
+time_embeding = 0
+
+# Pool de workers d'encodage (ENCODE_WORKERS > 1), créé par main()
+_encode_pool = None
+
+# Connexions de consommation et de publication séparées et longue durée
+rabbit = RabbitConnectionManager()
+
+def vectorize_texts(
+    segment_lists: list[list[str]],
+    token_id_lists: Optional[list[list[list[int]]]] = None,
+) -> list[np.ndarray]:
+    """Vectorise plusieurs documents en un seul appel batché au modèle.
+
+    Les segments de tous les documents sont encodés ensemble, puis
+    l'embedding de chaque document est la moyenne normalisée de ses
+    segments, comme dans ``vectorize_gpu_consumer.process_batch``.
+
+    :param list[list[str]] segment_lists: segments de chaque document
+    :param Optional[list] token_id_lists: tokenisation des segments, réutilisée
+        par l'encodeur si elle est fournie
+    :return: embedding moyen normalisé de chaque document
+    :rtype: list[numpy.ndarray]
+    """
+    global time_embeding
+    start_time = time.time()
+    all_segments = [segment for segments in segment_lists for segment in segments]
+    all_token_ids = None
+    if token_id_lists is not None:
+        all_token_ids = [ids for token_ids in token_id_lists for ids in token_ids]
+    embeddings = encode_segments(
+        model, all_segments, EMBED_BATCH_SIZE, all_token_ids, cache
+    )
+    doc_embeddings = mean_pool(embeddings, [len(segments) for segments in segment_lists])
+    time_embeding = time.time() - start_time
+    if cache is not None:
+        cache.log_metrics("vector_cache")
+    return doc_embeddings
 
 def vectorize_text(segments: list[str]) -> np.ndarray:
     """Vectorise une liste de segments de texte.
@@ -24,85 +90,182 @@ def vectorize_text(segments: list[str]) -> np.ndarray:
     :return: embedding moyen normalisé
     :rtype: numpy.ndarray
     """
-    global time_encode  # track encoding time
-    start_time = time.time()
-    embeddings = []
-    # Vectorize each segment
-    for segment in segments:
+    return vectorize_texts([segments])[0]
 
-        embedding = model.encode(segment)
-        embeddings.append(embedding)
+def embed_texts(texts: list[str]) -> tuple[list[np.ndarray], float, float]:
+    """Segmente et vectorise des textes, dans ce processus ou un worker du pool.
 
-    # Compute the mean embedding
-    mean_embedding = np.mean(embeddings, axis=0)
+    :param list[str] texts: textes des documents
+    :return: embedding de chaque document, durées de segmentation et d'encodage
+    :rtype: tuple[list[numpy.ndarray], float, float]
+    """
+    start_time = time.time()
+    segment_lists, token_id_lists = segment_documents(model, texts)
+    segment_time = time.time() - start_time
+    embeddings = vectorize_texts(segment_lists, token_id_lists)
+    return embeddings, segment_time, time_embeding
 
-    # Normalize the mean embedding fot get ready for indexing
-    normalized_mean_embedding = mean_embedding / np.linalg.norm(mean_embedding)
-    time_encode = time.time() - start_time
-    return normalized_mean_embedding
+def init_encode_worker(counter) -> None:
+    """Initialise un worker d'encodage créé par fork après le chargement du modèle.
 
-def get_rabbit_connection() -> pika.BlockingConnection:
-    """Établit une connexion RabbitMQ et mesure la durée.
+    Les poids du modèle et le pipeline spaCy sont partagés avec le parent
+    (copy-on-write). Chaque worker est limité à ``ENCODE_THREADS`` threads
+    torch, épinglés sur des coeurs distincts quand le système le permet.
 
-    :return: connexion ouverte
-    :rtype: pika.BlockingConnection
+    :param counter: compteur partagé attribuant un rang à chaque worker
+    :return: ``None``
+    :rtype: None
     """
-    global time_get_rabbit_connection  # track connection time
-    start_time = time.time()
-    while True:
-        try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-            )
-            logging.info("Connecté à RabbitMQ")
-            time_get_rabbit_connection = time.time() - start_time
-            return connection
-        except Exception as e:
-            logging.error(f"Erreur de connexion à RabbitMQ: {e}. Nouvelle tentative dans {RABBITMQ_RETRY_DELAY} secondes.")
-            time.sleep(RABBITMQ_RETRY_DELAY)
+    global model, cache
+    with counter.get_lock():
+        rank = counter.value
+        counter.value += 1
+    torch.set_num_threads(ENCODE_THREADS)
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        first = rank * ENCODE_THREADS
+        os.sched_setaffinity(
+            0, {cores[(first + i) % len(cores)] for i in range(ENCODE_THREADS)}
+        )
+    if EMBEDDING_BACKEND != "torch":
+        # Une session ONNX Runtime ne peut pas être utilisée après un fork ;
+        # le contrôle de précision est fait une fois, par check_encode_worker
+        model = BACKENDS[EMBEDDING_BACKEND](device)
+    # Connexion SQLite propre au processus, LRU réparti entre les workers
+    cache = create_cache(backend_id(), ENCODE_WORKERS)
 
-def callback(ch, method, properties, body) -> None:
-    """Traite un message de texte, le vectorise et publie l'embedding.
+def check_encode_worker() -> None:
+    """Contrôle la précision du backend depuis un worker d'encodage.
 
-    :param ch: canal RabbitMQ
-    :param method: meta-données de livraison
-    :param properties: propriétés AMQP
-    :param body: contenu JSON encodé
     :return: ``None``
     :rtype: None
+    :raises ValueError: si le backend s'écarte trop de PyTorch
     """
-    try:
-        message = json.loads(body)
-        text = message['text']
-        segments = segment_text(text, 150, 2)
-        embedding = vectorize_text(segments)  # retourne un numpy array
-        new_message = {
-            "url": message["url"],
-            "h1": message["h1"],
-            "embedding": embedding.tolist()  # conversion pour JSON
-        }
-        ch.basic_publish(
-            exchange='',
-            routing_key=INDEXING_QUEUE,
-            body=json.dumps(new_message),
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
+    verify_backend(model)
+
+def create_encode_pool(workers: int = ENCODE_WORKERS) -> ProcessPoolExecutor:
+    """Crée le pool d'encodage par fork et démarre tous ses workers.
+
+    Le pool doit être créé avant toute inférence et avant l'ouverture des
+    connexions RabbitMQ, qui ne doivent pas être héritées par les workers.
+    Le contrôle de précision du backend est ensuite fait une fois, dans un
+    worker, sur la session qu'il a reconstruite.
+
+    :param int workers: nombre de processus d'encodage
+    :return: pool prêt à encoder des lots
+    :rtype: ProcessPoolExecutor
+    """
+    start = time.time()
+    context = multiprocessing.get_context("fork")
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=init_encode_worker,
+        initargs=(context.Value("i", 0),),
+    )
+    # Forcer le démarrage de chaque worker
+    for future in [executor.submit(embed_texts, []) for _ in range(workers)]:
+        future.result()
+    executor.submit(check_encode_worker).result()
+    logging.info(
+        f"Pool d'encodage prêt: {workers} workers de {ENCODE_THREADS} threads "
+        f"en {time.time() - start:.2f}s"
+    )
+    return executor
+
+def vectorize_batch(
+    messages: list[tuple[bytes, pika.BasicProperties]]
+) -> list[list[tuple[bytes, pika.BasicProperties]]]:
+    """Vectorise un lot de messages et retourne les messages d'indexation.
+
+    :param list messages: corps et propriétés AMQP des messages reçus
+    :return: pour chaque message reçu, corps et propriétés des messages à
+        publier dans ``INDEXING_QUEUE``
+    :rtype: list[list[tuple[bytes, pika.BasicProperties]]]
+    """
+    global time_encode, time_embeding
+    pages = []
+    # Un message peut contenir plusieurs pages (enveloppe x-batch)
+    for index, (body, properties) in enumerate(messages):
+        for message in unpack_pages(body, properties):
+            pages.append((index, message))
+    texts = [message['text'] for _, message in pages]
+
+    if _encode_pool is None:
+        embeddings, time_encode, time_embeding = embed_texts(texts)
+    else:
+        # Une part du lot par worker ; l'ordre des documents est conservé
+        chunk_size = max(1, -(-len(texts) // ENCODE_WORKERS))
+        futures = [
+            _encode_pool.submit(embed_texts, texts[start: start + chunk_size])
+            for start in range(0, len(texts), chunk_size)
+        ]
+        results = [future.result() for future in futures]
+        embeddings = [embedding for result in results for embedding in result[0]]
+        time_encode = max((result[1] for result in results), default=0.0)
+        time_embeding = max((result[2] for result in results), default=0.0)
+
+    new_messages = [[] for _ in messages]
+    for (index, message), embedding in zip(pages, embeddings):
+        new_messages[index].append(encode_embedding_message(
+            {
+                "url": message["url"],
+                "h1": message["h1"],
+                "content_hash": content_hash(message["text"]),
+            },
+            embedding
+        ))
         logging.info(f"Vectorisation terminée pour {message['url']}")
         data = {
             "step": "vector",
             "url": message["url"],
             "h1": message["h1"],
+            "batchsize": len(pages),
             "time_encode": time_encode,
-            "time_get_rabbit_connection": time_get_rabbit_connection,
+            "time_embeding": time_embeding,
+            "time_get_rabbit_connection": rabbit.connect_time,
             "computer": MACHINE,
         }
         logger(data)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-    except Exception as e:
-        logging.error(f"Erreur dans le callback de vectorisation pour le message {body}: {e}")
-        # En cas d'erreur, on peut requeue le message pour réessayer
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+    return new_messages
+
+def vectorize_message(body: bytes, properties) -> list[tuple[bytes, pika.BasicProperties]]:
+    """Vectorise les pages d'un message et retourne les messages d'indexation.
+
+    :param bytes body: contenu JSON encodé
+    :param properties: propriétés AMQP
+    :return: corps et propriétés des messages à publier dans ``INDEXING_QUEUE``
+    :rtype: list[tuple[bytes, pika.BasicProperties]]
+    """
+    return vectorize_batch([(body, properties)])[0]
+
+async def handle_async(consumer: AsyncConsumer, deliveries: list[Delivery]) -> None:
+    """Handler asyncio : le lot est encodé dans le pool de threads du consumer.
+
+    Les messages invalides sont rejetés sans remise en file ; chaque autre
+    message est acquitté dès que ses embeddings sont publiés.
+
+    :param AsyncConsumer consumer: consumer appelant
+    :param list[Delivery] deliveries: messages de texte à vectoriser
+    :return: ``None``
+    :rtype: None
+    """
+    valid = []
+    for delivery in deliveries:
+        if is_valid_message(delivery.body, delivery.properties):
+            valid.append(delivery)
+        else:
+            delivery.nack(requeue=False)
+    deliveries = valid
+    if not deliveries:
+        return
+    results = await consumer.run_blocking(
+        vectorize_batch, [(delivery.body, delivery.properties) for delivery in deliveries]
+    )
+    for delivery, new_messages in zip(deliveries, results):
+        for new_body, new_properties in new_messages:
+            consumer.publish(INDEXING_QUEUE, new_body, new_properties)
+        delivery.ack()
 
 def main() -> None:
     """Démarre le consumer de vectorisation CPU.
@@ -110,22 +273,114 @@ def main() -> None:
     :return: ``None``
     :rtype: None
     """
-    connection = get_rabbit_connection()
-    channel = connection.channel()
-    channel.queue_declare(queue=VECTORIZATION_QUEUE, durable=True)
-    channel.queue_declare(queue=INDEXING_QUEUE, durable=True)
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=VECTORIZATION_QUEUE, on_message_callback=callback)
+    global _encode_pool
+    if ENCODE_WORKERS > 1:
+        _encode_pool = create_encode_pool()
+    if ASYNC_RUNTIME:
+        run_async(
+            AsyncConsumer(
+                VECTORIZATION_QUEUE,
+                handle_async,
+                batch_size=BATCH_SIZE,
+                batch_timeout=BATCH_TIMEOUT,
+                declare=[INDEXING_QUEUE],
+            )
+        )
+        return
+    rabbit.channel("publish").queue_declare(queue=INDEXING_QUEUE, durable=True)
+
+    pending = []   # (method, properties, body) en attente d'encodage
+    timer = None   # flush planifié du lot courant
+
+    def flush(ch) -> None:
+        """Encode le lot courant, publie les embeddings et acquitte par message.
+
+        :param ch: canal RabbitMQ
+        :return: ``None``
+        :rtype: None
+        """
+        nonlocal timer
+        if timer is not None:
+            rabbit.connection("consume").remove_timeout(timer)
+            timer = None
+        batch = []
+        for method, properties, body in pending:
+            if is_valid_message(body, properties):
+                batch.append((method, properties, body))
+            else:
+                # Un message invalide échouerait à chaque relivraison
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        pending.clear()
+        if not batch:
+            return
+        acked = 0
+        try:
+            results = vectorize_batch([(body, properties) for _, properties, body in batch])
+            publish_channel = rabbit.channel("publish")
+            for (method, _, _), new_messages in zip(batch, results):
+                for new_body, new_properties in new_messages:
+                    publish_channel.basic_publish(
+                        exchange='',
+                        routing_key=INDEXING_QUEUE,
+                        body=new_body,
+                        properties=new_properties
+                    )
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                acked += 1
+        except Exception as e:
+            logging.error(f"Erreur de vectorisation d'un lot de {len(batch)} messages: {e}")
+            # Les messages non publiés sont remis en file pour réessayer
+            for method, _, _ in batch[acked:]:
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+    def callback(ch, method, properties, body) -> None:
+        """Ajoute un message au lot courant et l'encode s'il est plein.
+
+        :param ch: canal RabbitMQ
+        :param method: meta-données de livraison
+        :param properties: propriétés AMQP
+        :param body: contenu JSON encodé
+        :return: ``None``
+        :rtype: None
+        """
+        nonlocal timer
+        pending.append((method, properties, body))
+        if len(pending) >= BATCH_SIZE:
+            flush(ch)
+        elif timer is None:
+            timer = rabbit.connection("consume").call_later(
+                BATCH_TIMEOUT, lambda: on_timeout(ch)
+            )
+
+    def on_timeout(ch) -> None:
+        """Encode un lot incomplet après ``BATCH_TIMEOUT`` secondes."""
+        nonlocal timer
+        timer = None
+        flush(ch)
+
+    def on_reconnect() -> None:
+        """Oublie les messages de l'ancien canal, qui seront relivrés."""
+        nonlocal timer
+        pending.clear()
+        timer = None
+
     logging.info("Vectorizer Consumer en attente de messages...")
     try:
-        channel.start_consuming()
+        rabbit.consume(
+            VECTORIZATION_QUEUE,
+            callback,
+            prefetch_count=BATCH_SIZE,
+            declare=[INDEXING_QUEUE],
+            on_reconnect=on_reconnect,
+        )
     except KeyboardInterrupt:
         logging.info("Interruption manuelle, arrêt du consumer.")
-        channel.stop_consuming()
     except Exception as e:
         logging.error(f"Erreur dans le consumer: {e}")
     finally:
-        connection.close()
+        rabbit.close()
+        if _encode_pool is not None:
+            _encode_pool.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == "__main__":
     main()
@@ -1,83 +1,327 @@
 import os
+import re
 import sys
-import pika
 import json
 import time
 import logging
 import hashlib
+import threading
 import requests
+import urllib3
 import trafilatura
+from trafilatura.utils import load_html
 import logger as logger
-from bs4 import BeautifulSoup
-from langdetect import detect
+from publisher import BatchPublisher, PublishError
+from rabbit import RabbitConnectionManager
+from aio_consumer import AsyncConsumer, Delivery, TRANSIENT_ERRORS, run as run_async
+from language import detect_language
+from collections import Counter
 from warcio.archiveiterator import ArchiveIterator
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Optional, Tuple
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
 from config import (
-    RABBITMQ_HOST,
-    RABBITMQ_USER,
-    RABBITMQ_PASSWORD,
     DOWNLOAD_QUEUE,
     VECTORIZATION_QUEUE,
-    RABBITMQ_RETRY_DELAY,
+    WARC_STREAM_DOWNLOAD,
+    WARC_TEE_TO_DISK,
+    EXTRACT_CHUNK_SIZE,
+    MAX_WORKERS,
+    PREFILTER_ENABLED,
+    PREFILTER_MIN_BYTES,
+    PREFILTER_MAX_BYTES,
+    ASYNC_RUNTIME,
     MACHINE
 )
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
-time_thrait = 0
-time_download = 0
-time_load = 0
-time_get_rabbit_connection = 0
+# Streaming de l'extraction : nombre d'enregistrements par tâche envoyée au
+# pool et nombre maximal de tâches en vol (borne la mémoire utilisée).
+RECORD_CHUNK_SIZE = EXTRACT_CHUNK_SIZE
+MAX_PENDING_CHUNKS = 2 * MAX_WORKERS
+
+# Page minimale traitée par chaque worker à son démarrage
+WARMUP_HTML = (
+    "<html><head><title>Préchauffage</title></head><body><h1>Préchauffage</h1>"
+    "<p>Ce texte en français sert à initialiser les bibliothèques d'extraction "
+    "et de détection de langue avant le premier fichier WARC.</p></body></html>"
+)
+
+# Pré-filtre : types de contenu acceptés et langue cible (ISO 639-1 et 639-3)
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+TARGET_LANG = "fr"
+TARGET_LANG_ISO3 = "fra"
+HTML_LANG_RE = re.compile(rb"<html[^>]*?\slang\s*=\s*[\"']?([a-zA-Z_-]+)", re.IGNORECASE)
+
+# Pool d'extraction partagé entre tous les fichiers WARC traités
+_executor: Optional[ProcessPoolExecutor] = None
+
+# Connexions longue durée ; le heartbeat reste long car le callback bloque
+# la connexion de consommation pendant tout le traitement d'un WARC
+rabbit = RabbitConnectionManager(heartbeat=600)
+# Connexions propres à chaque thread du runtime asyncio
+_thread_state = threading.local()
 
 def process_record(record_data: Tuple[str, str]) -> Optional[list[list[str]]]:
     """Traite un enregistrement WARC.
 
+    Le HTML n'est parsé qu'une fois : le même arbre lxml sert à lire le
+    ``h1`` et le ``title`` puis à l'extraction du texte par trafilatura.
+
     :param Tuple[str, str] record_data: couple ``(url, html)``
-    :return: ``[[url], [h1], [texte_brut]]`` ou ``None`` si non français
+    :return: ``[[url], [h1], [texte_brut], [title], [lang]]`` ou ``None`` si
+        non français
     :rtype: Optional[list[list[str]]]
     """
     url, html = record_data
-    text_brut = trafilatura.extract(html)
+    tree = load_html(html)
+    if tree is None:
+        return None
+    # Lecture avant l'extraction, trafilatura nettoyant l'arbre en place
+    h1_nodes = tree.xpath("//h1")
+    h1 = h1_nodes[0].text_content() if h1_nodes else ""
+    title = tree.findtext(".//title") or ""
+    text_brut = trafilatura.extract(tree)
     if text_brut:
         try:
-            if detect(text_brut) == "fr":
-                # Utilisation de lxml pour un parsing plus rapide
-                soup = BeautifulSoup(html, "lxml")
-                h1 = soup.h1.get_text() if soup.h1 else ""
-                return [[url], [h1], [text_brut]]
+            lang = detect_language(text_brut, TARGET_LANG)[0]
+            if lang == TARGET_LANG:
+                return [[url], [h1], [text_brut], [title.strip()], [lang]]
         except Exception as e:
             sys.stderr.write(f"Skipping record due to error: {e}\n")
     return None
 
 
+def process_chunk(chunk: List[Tuple[str, str]]) -> list[list[list[str]]]:
+    """Traite un lot d'enregistrements WARC dans un worker.
+
+    :param list chunk: couples ``(url, html)`` à traiter
+    :return: résultats de ``process_record`` pour les pages françaises
+    :rtype: list[list[list[str]]]
+    """
+    results = []
+    for record_data in chunk:
+        result = process_record(record_data)
+        if result:
+            results.append(result)
+    return results
+
+
+def warmup_worker() -> None:
+    """Initialise un worker d'extraction.
+
+    Traite une page factice pour que trafilatura, lxml et le backend
+    d'identification de langue (chargés paresseusement) soient prêts avant
+    le premier lot.
+
+    :return: ``None``
+    :rtype: None
+    """
+    try:
+        process_record(("warmup", WARMUP_HTML))
+    except Exception as e:
+        sys.stderr.write(f"Warmup failed: {e}\n")
+
+
+def create_extraction_pool(max_workers: int = MAX_WORKERS) -> ProcessPoolExecutor:
+    """Crée le pool d'extraction et démarre tous ses workers.
+
+    :param int max_workers: nombre de processus d'extraction
+    :return: pool prêt à traiter des lots
+    :rtype: ProcessPoolExecutor
+    """
+    start = time.time()
+    executor = ProcessPoolExecutor(max_workers=max_workers, initializer=warmup_worker)
+    # Forcer le démarrage (et donc le préchauffage) de chaque worker
+    for future in [executor.submit(process_chunk, []) for _ in range(max_workers)]:
+        future.result()
+    logging.info(
+        f"Pool d'extraction prêt: {max_workers} workers en {time.time() - start:.2f}s"
+    )
+    return executor
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Retourne le pool d'extraction, créé au premier appel.
+
+    :return: pool de processus réutilisé d'un fichier WARC à l'autre
+    :rtype: ProcessPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        _executor = create_extraction_pool()
+    return _executor
+
+
+def is_target_language(languages: str, iso3: bool = False) -> bool:
+    """Indique si une liste de langues annoncées contient la langue cible.
+
+    :param str languages: valeurs séparées par des virgules (``fr-FR, en``)
+    :param bool iso3: ``True`` pour des codes ISO 639-3 (``fra,eng``)
+    :return: ``True`` si la langue cible figure dans la liste
+    :rtype: bool
+    """
+    target = TARGET_LANG_ISO3 if iso3 else TARGET_LANG
+    for lang in languages.split(","):
+        if lang.strip().lower().replace("_", "-").split("-")[0] == target:
+            return True
+    return False
+
+
+def prefilter_headers(record) -> Optional[str]:
+    """Rejette un enregistrement d'après ses seuls en-têtes WARC et HTTP.
+
+    :param record: enregistrement ``response`` produit par ``ArchiveIterator``
+    :return: nom du filtre qui rejette l'enregistrement, ``None`` s'il passe
+    :rtype: Optional[str]
+    """
+    http_headers = record.http_headers
+    content_type = (
+        http_headers.get_header("Content-Type") if http_headers else None
+    ) or record.rec_headers.get_header("WARC-Identified-Payload-Type")
+    if content_type and not content_type.lower().startswith(HTML_CONTENT_TYPES):
+        return "content_type"
+
+    length = record.rec_headers.get_header("Content-Length")
+    if length and length.isdigit():
+        if not PREFILTER_MIN_BYTES <= int(length) <= PREFILTER_MAX_BYTES:
+            return "size"
+
+    # Langue identifiée par Common Crawl (CLD2), la plus fiable
+    warc_lang = record.rec_headers.get_header("WARC-Identified-Content-Language")
+    if warc_lang:
+        return None if is_target_language(warc_lang, iso3=True) else "warc_language"
+
+    http_lang = http_headers.get_header("Content-Language") if http_headers else None
+    if http_lang and not is_target_language(http_lang):
+        return "http_language"
+    return None
+
+
+def prefilter_content(content: bytes) -> Optional[str]:
+    """Rejette un enregistrement d'après l'attribut ``lang`` de la balise html.
+
+    À n'appliquer qu'en l'absence de ``WARC-Identified-Content-Language`` :
+    l'attribut vient souvent du gabarit (``lang="en"`` sur des sites
+    français) et ne doit pas contredire la langue identifiée par CLD2.
+
+    :param bytes content: corps HTTP de la réponse
+    :return: nom du filtre qui rejette l'enregistrement, ``None`` s'il passe
+    :rtype: Optional[str]
+    """
+    match = HTML_LANG_RE.search(content, 0, 4096)
+    if match and not is_target_language(match.group(1).decode("ascii")):
+        return "html_lang"
+    return None
+
+
+def iter_records(
+    stream: BinaryIO, stats: Optional[Counter] = None
+) -> Iterator[Tuple[str, str]]:
+    """Parcourt paresseusement les réponses HTTP d'un flux WARC.
+
+    Si ``PREFILTER_ENABLED`` est actif, les enregistrements manifestement
+    hors sujet (type de contenu, taille, langue annoncée) sont écartés avant
+    d'être décodés et envoyés au pool d'extraction.
+
+    :param BinaryIO stream: flux binaire du fichier WARC (compressé ou non)
+    :param Optional[Counter] stats: compteurs par étape de filtrage
+    :return: générateur de couples ``(url, html)``
+    :rtype: Iterator[Tuple[str, str]]
+    """
+    if stats is None:
+        stats = Counter()
+    for record in ArchiveIterator(stream):
+        if record.rec_type != "response":
+            continue
+        stats["responses"] += 1
+        if PREFILTER_ENABLED:
+            reason = prefilter_headers(record)
+            if reason:
+                stats[reason] += 1
+                continue
+        url = record.rec_headers.get_header("WARC-Target-URI")
+        content = record.content_stream().read()
+        if PREFILTER_ENABLED and not record.rec_headers.get_header(
+            "WARC-Identified-Content-Language"
+        ):
+            reason = prefilter_content(content)
+            if reason:
+                stats[reason] += 1
+                continue
+        stats["extracted"] += 1
+        yield url, content.decode(errors="ignore")
+
+
+def iter_chunks(
+    items: Iterable[Tuple[str, str]], size: int
+) -> Iterator[List[Tuple[str, str]]]:
+    """Regroupe un itérable en lots de taille bornée.
+
+    :param Iterable items: éléments à regrouper
+    :param int size: taille maximale d'un lot
+    :return: générateur de lots
+    :rtype: Iterator[list]
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_data(
+    stream: BinaryIO,
+    executor: ProcessPoolExecutor,
+    stats: Optional[Counter] = None,
+) -> Iterator[list[list[str]]]:
+    """Extrait les pages françaises d'un flux WARC au fil de l'eau.
+
+    Les enregistrements sont lus paresseusement et envoyés au pool par lots
+    de ``RECORD_CHUNK_SIZE``. Au plus ``MAX_PENDING_CHUNKS`` lots sont en
+    vol : la mémoire reste constante quelle que soit la taille du fichier et
+    les premières pages sont disponibles dès les premiers lots traités.
+
+    :param BinaryIO stream: flux binaire du fichier WARC
+    :param ProcessPoolExecutor executor: pool chargé de l'extraction
+    :param Optional[Counter] stats: compteurs par étape de filtrage
+    :return: générateur de ``[[url], [h1], [texte], [title], [lang]]``
+    :rtype: Iterator[list[list[str]]]
+    """
+    pending: set[Future] = set()
+    for chunk in iter_chunks(iter_records(stream, stats), RECORD_CHUNK_SIZE):
+        pending.add(executor.submit(process_chunk, chunk))
+        if len(pending) >= MAX_PENDING_CHUNKS:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+    for future in as_completed(pending):
+        yield from future.result()
+
+
 def get_data(warc_file: str) -> List[list[str]]:
     """Extrait toutes les pages françaises d'un fichier WARC.
 
+    Variante non streaming conservée pour les usages hors pipeline : toutes
+    les pages sont matérialisées en mémoire.
+
     :param str warc_file: chemin local du fichier WARC
-    :return: liste des triplets ``[[url], [h1], [texte]]``
+    :return: liste des ``[[url], [h1], [texte], [title], [lang]]``
     :rtype: list[list[str]]
     """
-    data = []
-    records = []
-
-    # Lecture séquentielle du fichier et collecte des données brutes
     with open(warc_file, "rb") as f:
-        for record in ArchiveIterator(f):
-            if record.rec_type == "response":
-                url = record.rec_headers.get_header("WARC-Target-URI")
-                html = record.content_stream().read().decode(errors="ignore")
-                records.append((url, html))
-
-    # Traitement parallèle avec ProcessPoolExecutor
-    with ProcessPoolExecutor() as executor:
-        futures = [executor.submit(process_record, rec) for rec in records]
-        for i, future in enumerate(as_completed(futures), 1):
-            result = future.result()
-            if result:
-                data.append(result)
-            # print(f"Traitement de l'enregistrement n°{i}")
+        data = list(stream_data(f, get_executor()))
 
     # Sauvegarde des données dans un fichier pour garder une trace
     with open("data.txt", "w", encoding="utf-8") as f:
@@ -87,32 +331,70 @@ def get_data(warc_file: str) -> List[list[str]]:
     return data
 
 
-def get_rabbit_connection() -> pika.BlockingConnection:
-    """Ouvre une connexion RabbitMQ avec heartbeat prolongé.
+class TeeStream:
+    """Flux de lecture qui recopie sur disque les octets lus.
 
-    :return: connexion ouverte
-    :rtype: pika.BlockingConnection
+    Le fichier est écrit sous ``<chemin>.part`` puis renommé à la fermeture
+    uniquement si le flux source a été lu jusqu'au bout : un fichier présent
+    sous son nom final est donc toujours complet.
     """
-    global time_get_rabbit_connection  # track connection time
-    while True:
-        try:
-            time_start = time.time()
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            parameters = pika.ConnectionParameters(
-                host=RABBITMQ_HOST,
-                credentials=credentials,
-                heartbeat=600,  # augmenter le heartbeat
-                blocked_connection_timeout=300,  # délai de blocage
-            )
-            connection = pika.BlockingConnection(parameters)
-            logging.info("Connecté à RabbitMQ")
-            time_get_rabbit_connection = time.time() - time_start
-            return connection
-        except Exception as e:
-            logging.error(
-                f"Erreur de connexion à RabbitMQ : {e}. Nouvelle tentative dans {RABBITMQ_RETRY_DELAY} secondes."
-            )
-            time.sleep(RABBITMQ_RETRY_DELAY)
+
+    def __init__(self, raw: BinaryIO, local_file: str) -> None:
+        """Initialise la copie du flux.
+
+        :param BinaryIO raw: flux source (réponse HTTP)
+        :param str local_file: destination finale de la copie
+        :return: ``None``
+        :rtype: None
+        """
+        self.raw = raw
+        self.local_file = local_file
+        self.part_file = local_file + ".part"
+        self.file = open(self.part_file, "wb")
+        self.eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        """Lit un bloc du flux source et l'écrit dans la copie.
+
+        :param int size: nombre maximal d'octets à lire
+        :return: octets lus
+        :rtype: bytes
+        """
+        chunk = self.raw.read(size)
+        if chunk:
+            self.file.write(chunk)
+        else:
+            self.eof = True
+        return chunk
+
+    def drain(self, chunk_size: int = 8192) -> None:
+        """Termine le téléchargement sans parser le reste du flux.
+
+        :param int chunk_size: taille des blocs lus
+        :return: ``None``
+        :rtype: None
+        """
+        while self.read(chunk_size):
+            pass
+
+    def close(self) -> None:
+        """Ferme les flux et conserve la copie uniquement si elle est complète.
+
+        :return: ``None``
+        :rtype: None
+        """
+        self.file.close()
+        self.raw.close()
+        if self.eof:
+            os.replace(self.part_file, self.local_file)
+        elif os.path.exists(self.part_file):
+            os.remove(self.part_file)
+
+    def __enter__(self) -> "TeeStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
 
 def download_warc(warc_url: str, local_file: str) -> bool:
@@ -123,16 +405,18 @@ def download_warc(warc_url: str, local_file: str) -> bool:
     :return: ``True`` si succès
     :rtype: bool
     """
-    global time_download  # track download time
     start_download = time.time()
     try:
         url = "https://data.commoncrawl.org/" + warc_url
         response = requests.get(url, stream=True)
         if response.status_code == 200:
-            with open(local_file, "wb") as f:
+            # Écriture dans un fichier temporaire pour ne jamais laisser de
+            # fichier partiel sous le nom final
+            with open(local_file + ".part", "wb") as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     if chunk:
                         f.write(chunk)
+            os.replace(local_file + ".part", local_file)
             time_download = time.time() - start_download
             logging.info(f"WARC téléchargé: {local_file} en {time_download:.2f}s")
             return True
@@ -146,180 +430,248 @@ def download_warc(warc_url: str, local_file: str) -> bool:
         return False
 
 
-def callback(ch, method, properties, body) -> None:  # noqa: C901
-    """Traite un message contenant une URL WARC.
+def open_warc_stream(warc_url: str, tee_file: Optional[str] = None) -> Optional[BinaryIO]:
+    """Ouvre le flux HTTP d'un fichier WARC pour le parser pendant le téléchargement.
 
-    :param ch: canal RabbitMQ
-    :param method: meta-données de livraison
-    :param properties: propriétés AMQP
-    :param body: message JSON encodé
-    :return: ``None``
-    :rtype: None
+    :param str warc_url: chemin relatif du fichier WARC sur CommonCrawl
+    :param Optional[str] tee_file: copie locale facultative du flux
+    :return: flux binaire prêt pour ``ArchiveIterator`` ou ``None`` si échec
+    :rtype: Optional[BinaryIO]
     """
-    global time_load, time_thrait, time_download, time_get_rabbit_connection  # track load and processing times
+    url = "https://data.commoncrawl.org/" + warc_url
     try:
-        message = json.loads(body)
-        warc_url = message["warc_url"]
-        # Générer un nom de fichier unique à partir de l'URL pour éviter les collisions
-        file_hash = hashlib.md5(warc_url.encode()).hexdigest()
-        local_file = f"./warc/{file_hash}.warc.gz"
-
-        # Télécharger le fichier WARC
-        if not download_warc(warc_url, local_file):
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-            return
-
-        # Charger et mesurer le temps de chargement des données
-        start_load = time.time()
-        records = get_data(local_file)
-        time_load = time.time() - start_load
-        logging.info(f"Données chargées en {time_load:.2f}s")
-        # Démarrer le chronomètre de traitement
-        start_trait = time.time()
-
-        # Créer une connexion dédiée pour la publication
-        try:
-            publisher_connection = get_rabbit_connection()
-            publisher_channel = publisher_connection.channel()
-            publisher_channel.queue_declare(queue=VECTORIZATION_QUEUE, durable=True)
-        except Exception as pub_e:
+        response = requests.get(url, stream=True)
+        if response.status_code != 200:
             logging.error(
-                f"Erreur lors de la création de la connexion de publication: {pub_e}"
+                f"Échec du téléchargement pour {url}, status: {response.status_code}"
             )
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-            return
-
-        # Pour chaque record, tenter de publier en gérant les erreurs BrokenPipeError
-        for record in records:
-            out_message = {
-                "url": record[0][0],
-                "h1": record[1][0],
-                "text": record[2][0],
-            }
-            published = False
-            retry_count = 0
-            while not published and retry_count < 3:
-                try:
-                    publisher_channel.basic_publish(
-                        exchange="",
-                        routing_key=VECTORIZATION_QUEUE,
-                        body=json.dumps(out_message),
-                        properties=pika.BasicProperties(delivery_mode=2),
-                    )
-                    published = True
-                    # logging.info(f"Message envoyé pour {out_message['url']}")
-                except BrokenPipeError as bpe:
-                    logging.error(
-                        f"BrokenPipeError lors de l'envoi du message pour {out_message['url']}: {bpe}"
-                    )
-                    retry_count += 1
-                    time.sleep(2)
-                    try:
-                        publisher_channel.close()
-                    except Exception:
-                        pass
-                    try:
-                        publisher_connection.close()
-                    except Exception:
-                        pass
-                    # Recréer la connexion de publication
-                    try:
-                        publisher_connection = get_rabbit_connection()
-                        publisher_channel = publisher_connection.channel()
-                        publisher_channel.queue_declare(
-                            queue=VECTORIZATION_QUEUE, durable=True
-                        )
-                    except Exception as recon_e:
-                        logging.error(f"Erreur lors de la reconnexion: {recon_e}")
-                except Exception as e:
-                    logging.error(
-                        f"Erreur lors de l'envoi du message pour {out_message['url']}: {e}"
-                    )
-                    retry_count += 1
-                    time.sleep(2)
-            if not published:
-                logging.error(
-                    f"Échec de l'envoi du message pour {out_message['url']} après plusieurs tentatives."
-                )
-                try:
-                    publisher_channel.close()
-                    publisher_connection.close()
-                except Exception:
-                    pass
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-                return
-
-        # Fermer la connexion de publication
+            response.close()
+            return None
+        raw = response.raw
+        if tee_file:
+            return TeeStream(raw, tee_file)
+        return raw
+    except Exception as e:
+        logging.error(f"Erreur lors du téléchargement de {url}: {e}")
+        return None
+
+
+def open_warc(warc_url: str, local_file: str) -> Optional[BinaryIO]:
+    """Ouvre le fichier WARC à parser selon le mode de téléchargement.
+
+    Une copie locale complète (laissée par une tentative précédente) est
+    réutilisée. Sinon, avec ``WARC_STREAM_DOWNLOAD`` le WARC est parsé
+    directement depuis la réponse HTTP, éventuellement recopié sur disque
+    (``WARC_TEE_TO_DISK``) ; à défaut il est d'abord téléchargé.
+
+    :param str warc_url: chemin relatif du fichier WARC sur CommonCrawl
+    :param str local_file: emplacement de la copie locale
+    :return: flux binaire ou ``None`` si le téléchargement a échoué
+    :rtype: Optional[BinaryIO]
+    """
+    if os.path.exists(local_file):
+        logging.info(f"Reprise depuis la copie locale {local_file}")
+        return open(local_file, "rb")
+    if WARC_STREAM_DOWNLOAD:
+        return open_warc_stream(warc_url, local_file if WARC_TEE_TO_DISK else None)
+    if not download_warc(warc_url, local_file):
+        return None
+    return open(local_file, "rb")
+
+
+class WarcUnavailable(Exception):
+    """Levée lorsque le fichier WARC n'a pas pu être téléchargé."""
+
+
+# Échecs de téléchargement (statut non 200, coupure en cours de flux) ou de
+# publication : le WARC est remis en file, seul un message illisible est rejeté
+WARC_TRANSIENT_ERRORS = TRANSIENT_ERRORS + (
+    WarcUnavailable,
+    PublishError,
+    requests.RequestException,
+    urllib3.exceptions.HTTPError,
+)
+
+
+def process_warc(warc_url: str, rabbit: RabbitConnectionManager) -> dict:
+    """Télécharge un fichier WARC et publie ses pages françaises.
+
+    :param str warc_url: chemin relatif du fichier WARC sur CommonCrawl
+    :param RabbitConnectionManager rabbit: connexions utilisées pour publier
+    :return: métriques du traitement, destinées à ``logger``
+    :rtype: dict
+    :raises WarcUnavailable: si le téléchargement a échoué
+    :raises PublishError: si des pages n'ont pas pu être publiées
+    """
+    # Générer un nom de fichier unique à partir de l'URL pour éviter les collisions
+    file_hash = hashlib.md5(warc_url.encode()).hexdigest()
+    local_file = f"./warc/{file_hash}.warc.gz"
+
+    # Publication sur la connexion partagée, ouverte une seule fois
+    start_connection = rabbit.connect_time
+    publisher = BatchPublisher(rabbit, VECTORIZATION_QUEUE)
+
+    # Télécharger le fichier WARC ou ouvrir directement le flux HTTP
+    start_download = time.time()
+    warc_stream = open_warc(warc_url, local_file)
+    if warc_stream is None:
+        raise WarcUnavailable(warc_url)
+    # En streaming, seul le temps jusqu'aux en-têtes est compté ici : le temps
+    # réseau se superpose ensuite au temps de parsing (load_time)
+    time_download = time.time() - start_download
+
+    # Extraction en streaming : chaque page est publiée dès qu'elle est
+    # extraite, par fenêtres confirmées par le broker
+    start_load = time.time()
+    time_thrait = 0
+    pages = 0
+    stats = Counter()
+    with warc_stream:
         try:
-            publisher_channel.close()
-            publisher_connection.close()
-        except Exception as e:
-            logging.error(
-                f"Erreur lors de la fermeture de la connexion de publication: {e}"
-            )
+            for record in stream_data(warc_stream, get_executor(), stats):
+                start_trait = time.time()
+                publisher.publish({
+                    "url": record[0][0],
+                    "h1": record[1][0],
+                    "text": record[2][0],
+                    "title": record[3][0],
+                    "lang": record[4][0],
+                })
+                pages += 1
+                time_thrait += time.time() - start_trait
+            start_trait = time.time()
+            publisher.flush()
+            time_thrait += time.time() - start_trait
+        except PublishError:
+            publisher.abort()
+            # Terminer la copie locale pour que la reprise évite un
+            # nouveau téléchargement
+            if isinstance(warc_stream, TeeStream):
+                try:
+                    warc_stream.drain()
+                except Exception as drain_e:
+                    logging.error(f"Erreur lors de la copie du WARC: {drain_e}")
+            raise
+
+    # Le temps de chargement exclut le temps passé à publier
+    time_load = time.time() - start_load - time_thrait
+    logging.info(f"{pages} pages extraites en {time_load:.2f}s")
+    logging.info(f"Pré-filtre: {dict(stats)}")
+    # Temps de (re)connexion payé pendant ce WARC, nul si rien n'a été perdu
+    time_get_rabbit_connection = rabbit.connect_time - start_connection
 
-        # Supprimer le fichier téléchargé pour libérer de l'espace
+    # Supprimer le fichier téléchargé pour libérer de l'espace
+    if os.path.exists(local_file):
         try:
             os.remove(local_file)
             logging.info(f"Fichier supprimé: {local_file}")
         except Exception as e:
             logging.error(f"Erreur lors de la suppression de {local_file}: {e}")
 
-        # Mesurer le temps de traitement et logger tous les temps
-        time_thrait = time.time() - start_trait
-        data = {
-            "step": "warc",
-            "warc_url": warc_url,
-            "total_time": time_thrait+time_load+time_get_rabbit_connection+time_download,
-            "download_time": time_download,
-            "load_time": time_load,
-            "processing_time": time_thrait,
-            "rabbit_connection_time": time_get_rabbit_connection,
-            "computer":MACHINE
-        }
+    return {
+        "step": "warc",
+        "warc_url": warc_url,
+        "total_time": time_thrait+time_load+time_get_rabbit_connection+time_download,
+        "download_time": time_download,
+        "load_time": time_load,
+        "processing_time": time_thrait,
+        "rabbit_connection_time": time_get_rabbit_connection,
+        "pages": pages,
+        "prefilter": dict(stats),
+        "computer":MACHINE
+    }
+
+
+def callback(ch, method, properties, body) -> None:
+    """Traite un message contenant une URL WARC.
+
+    :param ch: canal RabbitMQ
+    :param method: meta-données de livraison
+    :param properties: propriétés AMQP
+    :param body: message JSON encodé
+    :return: ``None``
+    :rtype: None
+    """
+    try:
+        message = json.loads(body)
+        data = process_warc(message["warc_url"], rabbit)
         logger.logger(data)
-        # logging.info(
-        #     f"Temps total - Connexion RabbitMQ: {time_get_rabbit_connection:.2f}s, Download: {time_download:.2f}s, Load: {time_load:.2f}s, Traitement: {time_thrait:.2f}s"
-        # )
         ch.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
         logging.error(
-            f"Erreur dans le callback du downloader pour le message {body}: {e}"
+            f"Erreur dans le callback du downloader pour le message {body}: {e!r}"
         )
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
 
+def process_warc_in_thread(warc_url: str) -> None:
+    """Traite un WARC depuis un thread du runtime asyncio.
+
+    Chaque thread garde ses propres connexions bloquantes de publication,
+    une ``BlockingConnection`` ne pouvant être partagée entre threads.
+
+    :param str warc_url: chemin relatif du fichier WARC sur CommonCrawl
+    :return: ``None``
+    :rtype: None
+    """
+    if not hasattr(_thread_state, "rabbit"):
+        _thread_state.rabbit = RabbitConnectionManager()
+    # Détecte une connexion fermée par le broker pendant l'inactivité
+    _thread_state.rabbit.keepalive()
+    data = process_warc(warc_url, _thread_state.rabbit)
+    logger.logger(data)
+
+
+async def handle_async(consumer: AsyncConsumer, deliveries: list[Delivery]) -> None:
+    """Handler asyncio : plusieurs WARC sont traités en parallèle.
+
+    :param AsyncConsumer consumer: consumer appelant
+    :param list[Delivery] deliveries: messages contenant une URL WARC
+    :return: ``None``
+    :rtype: None
+    """
+    for delivery in deliveries:
+        message = json.loads(delivery.body)
+        await consumer.run_blocking(process_warc_in_thread, message["warc_url"])
+        # Un échec sur le WARC suivant ne relivre pas celui-ci
+        delivery.ack()
+
+
 def main() -> None:
     """Démarre le consumer de téléchargement WARC.
 
     :return: ``None``
     :rtype: None
     """
-    connection = get_rabbit_connection()
-    channel = connection.channel()
-    channel.queue_declare(queue=DOWNLOAD_QUEUE, durable=True)
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=DOWNLOAD_QUEUE, on_message_callback=callback)
+    global _executor
+    # Pool créé une seule fois, avant la première livraison
+    executor = get_executor()
+    if ASYNC_RUNTIME:
+        # Plusieurs WARC en vol ; les heartbeats restent servis par la boucle
+        try:
+            run_async(AsyncConsumer(
+                DOWNLOAD_QUEUE, handle_async, transient=WARC_TRANSIENT_ERRORS
+            ))
+        finally:
+            executor.shutdown(cancel_futures=True)
+            _executor = None
+        return
     logging.info("WARC Downloader en attente de messages...")
     try:
-        channel.start_consuming()
+        rabbit.consume(DOWNLOAD_QUEUE, callback, prefetch_count=1)
     except KeyboardInterrupt:
         logging.info("Interruption manuelle, arrêt du downloader.")
-        try:
-            if connection and connection.is_open:
-                connection.close()
-        except Exception as e:
-            logging.error(f"Erreur lors de la fermeture de la connexion: {e}")
     except Exception as e:
         logging.error(f"Erreur dans le downloader: {e}")
     finally:
         try:
-            if connection and connection.is_open:
-                connection.close()
+            rabbit.close()
         except Exception as e:
             logging.error(
                 f"Erreur lors de la fermeture de la connexion dans le finally: {e}"
             )
+        executor.shutdown(cancel_futures=True)
+        _executor = None
 
 
 if __name__ == "__main__":